@@ -5,12 +5,17 @@ from casevo.model_base import ModelBase
 from casevo.memory import Memory, MemeoryFactory
 from casevo.llm_interface import LLM_INTERFACE
 from casevo.base_component import BaseAgentComponent, BaseModelComponent
-from casevo.chain import ThoughtChain, BaseStep, ChoiceStep, ScoreStep, JsonStep
+from casevo.chain import ThoughtChain, BaseStep, ChoiceStep, ScoreStep, JsonStep, ChainPool, ChainPoolError, arun_chains
 from casevo.prompt import Prompt, PromptFactory
 from casevo.util.log import MesaLog
 from casevo.util.thread_send import ThreadSend
 from casevo.util.tot_log import TotLog
+from casevo.util.log_binary import BinaryLogSink, BinaryLogReader
+from casevo.util.log_sqlite import SqliteLogSink
 from casevo.util.cache import RequestCache
+from casevo.util.embedding_cache import EmbeddingCache
+from casevo.util.limiter import ConcurrencyLimiter, LimitedLLM, get_limiter
+from casevo.util.vector_store import VectorStore, ChromaStore, NumpyStore
 
 
 __all__ = [
@@ -18,12 +23,15 @@ __all__ = [
     "Memory", "MemeoryFactory",
     "LLM_INTERFACE",
     "BaseAgentComponent", "BaseModelComponent",
-    "ThoughtChain", "BaseStep", "ChoiceStep", "ScoreStep", "JsonStep",
+    "ThoughtChain", "BaseStep", "ChoiceStep", "ScoreStep", "JsonStep", "ChainPool", "ChainPoolError", "arun_chains",
     "Prompt", "PromptFactory",
     "MesaLog",
     "ThreadSend",
-    "TotLog",
-    "RequestCache"
+    "TotLog", "BinaryLogSink", "BinaryLogReader", "SqliteLogSink",
+    "RequestCache",
+    "EmbeddingCache",
+    "ConcurrencyLimiter", "LimitedLLM", "get_limiter",
+    "VectorStore", "ChromaStore", "NumpyStore"
 ]
 
 
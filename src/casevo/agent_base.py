@@ -1,3 +1,4 @@
+import asyncio
 from abc import abstractmethod
 
 import mesa
@@ -58,4 +59,12 @@ class AgentBase(mesa.Agent):
         # 定义抽象方法，用于代理的每一步操作
         pass
 
+    async def astep(self):
+        """
+        step的异步版本，供ParallelActivation的async模式调用。
+
+        默认在线程中执行step，子类可以重写为使用arun_step等异步接口的协程。
+        """
+        await asyncio.to_thread(self.step)
+
     
\ No newline at end of file
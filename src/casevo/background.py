@@ -2,6 +2,9 @@ from casevo.base_component import BaseAgentComponent, BaseModelComponent
 import chromadb
 from casevo.llm_interface import LLM_INTERFACE
 from typing import List,Optional
+import threading
+import numpy as np
+from casevo.util.vector_store import ChromaStore, NumpyStore
 
 class BackgroundItem:
     id = -1
@@ -71,7 +74,7 @@ class Background(BaseAgentComponent):
                 cur_extra = extra_list[i]
             add_list.append(BackgroundItem(self.agent.component_id, cur_type, content_list[i], cur_extra))
         
-        return self.background_factory.__add_short_memory__(add_list)
+        return self.background_factory.__add_backgrounds__(add_list)
 
     def search_short_memory_by_doc(self, content_list:List[str]):
         """
@@ -94,7 +97,7 @@ class Background(BaseAgentComponent):
 
 #全局的Background工厂
 class BackgroundFactory(BaseModelComponent):
-    def __init__(self, tar_llm : LLM_INTERFACE,  background_num, model,tar_path=None):
+    def __init__(self, tar_llm : LLM_INTERFACE,  background_num, model,tar_path=None, embedding_cache=None, store='chroma'):
         """
         初始化记忆模块。
         
@@ -105,6 +108,8 @@ class BackgroundFactory(BaseModelComponent):
         :param memory_num: 检索记忆条目的数量。
         :param prompt: 用于触发Reflection的提示。
         :param model: 关联的ABM模型。
+        :param embedding_cache: 可选的EmbeddingCache实例，设置后代替LLM的embedding工具类，相同文本只生成一次向量。
+        :param store: 存储后端，取值与MemeoryFactory的store参数相同。
         """
         
         #memory_log = MesaLog("memory")
@@ -112,19 +117,34 @@ class BackgroundFactory(BaseModelComponent):
         super().__init__("background_factory", "background_factory", model)
         
         self.llm = tar_llm
-        if tar_path:
-            self.client = chromadb.PersistentClient(path=tar_path)
+        if embedding_cache:
+            self.embedding_function = embedding_cache
         else:
-            self.client = chromadb.Client()
-        
-        self.background_collection = self.client.get_or_create_collection("background", embedding_function= self.llm.get_lang_embedding())
+            self.embedding_function = self.llm.get_lang_embedding()
+
+        if callable(store):
+            self.background_store = store("background")
+        elif store == 'numpy':
+            self.background_store = NumpyStore()
+        elif store == 'chroma':
+            if tar_path:
+                self.client = chromadb.PersistentClient(path=tar_path)
+            else:
+                self.client = chromadb.Client()
+            self.background_store = ChromaStore(self.client.get_or_create_collection("background", embedding_function= self.embedding_function))
+        else:
+            raise Exception("unknown store type: %s" % store)
         self.background_num = background_num
         #self.reflact_prompt = prompt
 
+        self.lock = threading.Lock()
+        #进程内的背景信息ID计数器，启动时根据已有的背景信息初始化一次，之后在self.lock下分配
+        self.next_id = self.background_store.max_id() + 1
+
         
         #print(self.memory_collection.count())
     def is_empty(self):
-        return self.background_collection.count() == 0
+        return self.background_store.count() == 0
 
 
     def create_background(self, agent):
@@ -150,12 +170,14 @@ class BackgroundFactory(BaseModelComponent):
         :return: 添加操作是否成功的布尔值。
         """
         # 记录开始位置，用于后续计算新增记忆项的数量。
+        embedding_list = np.asarray(self.embedding_function([item.content for item in tar_memory]), dtype=np.float32)
         self.lock.acquire()
-        start_pos = self.background_collection.count()
+        start_pos = self.next_id
+        self.next_id += len(tar_memory)
         # 将目标记忆项转换为统一的列表格式，准备添加到记忆集合中。
         content_list, meta_list, id_list = BackgroundItem.toList(tar_memory, start_pos)
         # 实际添加记忆项到记忆集合中，并返回操作是否成功。
-        res = self.background_collection.add(documents=content_list, metadatas=meta_list, ids=id_list)
+        res = self.background_store.add([int(item) for item in id_list], content_list, meta_list, embedding_list)
         self.lock.release() 
         return res
     
@@ -174,13 +196,10 @@ class BackgroundFactory(BaseModelComponent):
         查询结果列表，包含与内容列表匹配且与目标代理相关的记忆条目。
         """
         # 根据内容列表和查询条件在记忆库中查询相关信息
+        query_vec = np.asarray(self.embedding_function(content_list), dtype=np.float32)
         self.lock.acquire()
-        res = self.background_collection.query(
-            query_texts=content_list,
-            n_results=self.background_num,
-            where={"owner_id": tar_agent}
-        )
+        res = self.background_store.query(query_vec, self.background_num, {"owner_id": tar_agent})
         self.lock.release()
-        return res.documents
+        return res['documents']
     
     
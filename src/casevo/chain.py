@@ -1,9 +1,9 @@
 from casevo.base_component import BaseAgentComponent, BaseModelComponent
 import re
 import json
-import threading
-import queue
-import time
+import asyncio
+
+from casevo.util.thread_send import ThreadSend
 
 #CoT步骤基类
 class BaseStep:
@@ -49,6 +49,26 @@ class BaseStep:
         """
         response = self.prompt.send_prompt(input, agent, model)
         return response
+
+    async def aaction(self, input, agent=None, model=None):
+        """
+        action的异步版本。
+
+        默认通过prompt的异步接口发送请求。如果子类只重写了同步的action（例如调用工具或自定义逻辑），
+        则将该action放到线程池中执行，保证任意步骤都可以在异步思维链中使用。
+
+        参数:
+        input (str): 用户的输入，作为生成响应的依据。
+        agent (Agent, optional): 代理对象。默认为None。
+        model (Model, optional): 模型对象。默认为None。
+
+        返回:
+        str: 生成的响应文本。
+        """
+        if type(self).action is not BaseStep.action:
+            return await asyncio.to_thread(self.action, input, agent, model)
+        response = await self.prompt.asend_prompt(input, agent, model)
+        return response
     
     def after_process(self, input, response, agent=None, model=None):
         """
@@ -296,7 +316,33 @@ class ThoughtChain(BaseAgentComponent):
         
         抛出:
         Exception -- 如果当前状态不是就绪，则抛出异常。
+        RuntimeError -- 如果同步执行时遇到了await，则关闭协程并抛出异常。
         """
+        #同步执行时协程内不会await，一次send即可运行结束
+        cur_coro = self.__run_steps__(False)
+        try:
+            cur_coro.send(None)
+        except StopIteration:
+            return
+        #协程在await处挂起，无法在同步调用中继续执行
+        cur_coro.close()
+        self.status = 'ready'
+        raise RuntimeError("ThoughtChain.run_step hit an await on the sync path, use arun_step instead")
+
+    async def arun_step(self):
+        """
+        异步执行流程。
+
+        与run_step逻辑一致，但每个步骤通过aaction异步调用LLM，等待响应期间不占用线程，
+        因此一个事件循环中可以同时运行大量思维链。
+
+        抛出:
+        Exception -- 如果当前状态不是就绪，或者某个步骤重试失败，则抛出异常。
+        """
+        await self.__run_steps__(True)
+
+    async def __run_steps__(self, async_flag):
+        #run_step与arun_step共用的执行与重试逻辑，只有调用步骤action的方式不同
         if self.status != 'ready':
             raise Exception("running status error")
         
@@ -309,7 +355,10 @@ class ThoughtChain(BaseAgentComponent):
                 try:
                     cur_input = item.pre_process(last_input, self.agent, self.agent.model)
                     
-                    response = item.action(cur_input, self.agent, self.agent.model)
+                    if async_flag:
+                        response = await item.aaction(cur_input, self.agent, self.agent.model)
+                    else:
+                        response = item.action(cur_input, self.agent, self.agent.model)
                     
                     cur_output = item.after_process(cur_input, response,  self.agent, self.agent.model)
                     error_flag = False
@@ -366,36 +415,163 @@ class ThoughtChain(BaseAgentComponent):
             return self.step_history
         
 
+class ChainPoolError(Exception):
+    """
+    思维链池中有思维链执行失败时抛出的异常。
+
+    errors属性为(思维链, 异常)的列表，results属性为与提交顺序一致的结果列表，失败的位置为对应的异常。
+    """
+    def __init__(self, errors, results=None):
+        super().__init__("%d chains failed in chain pool" % len(errors))
+        self.errors = errors
+        self.results = results
+
+
 class ChainPool:
+    """
+    执行思维链的线程池。
+
+    基于ThreadSend，线程在创建时启动并在多个模型步骤之间复用，每个思维链提交后返回一个Future，
+    Future的结果为思维链的输出，执行失败时为对应的异常。
+    """
     def __init__(self, thread_num=8):
-        self.status = 'init' 
-        self.chain_list =  queue.Queue()
+        """
+        初始化思维链池。
+
+        参数:
+        thread_num -- 线程数量。
+        """
+        self.status = 'init'
         self.threads_num = thread_num
+        self.thread_send = ThreadSend(thread_num, "chain_pool")
+        #已提交但尚未等待的思维链，与thread_send中的任务一一对应
+        self.chain_list = []
+
+    @staticmethod
+    def run_chain(tar_chain):
+        tar_chain.run_step()
+        return tar_chain.get_output()
+
+    def submit(self, tar_chain):
+        """
+        提交一个就绪的思维链。
+
+        参数:
+        tar_chain -- 已经通过set_input进入就绪状态的思维链。
+
+        返回:
+        Future对象，结果为思维链的输出。
+        """
+        cur_future = self.thread_send.add_task(self.run_chain, (tar_chain,))
+        self.chain_list.append(tar_chain)
+        return cur_future
 
     def add_chains(self, chains):
-        for item in chains:
-            self.chain_list.put(item)
+        """
+        批量提交思维链，提交后立即开始执行。
+
+        参数:
+        chains -- 思维链列表。
+
+        返回:
+        与chains顺序一致的Future列表。
+        """
+        res = [self.submit(item) for item in chains]
         self.status = 'ready'
+        return res
 
-    def worker(self):
-        while True:
-            tar_chain = self.chain_list.get()
-            tar_chain.run_step()
-            self.chain_list.task_done()
-            if self.chain_list.empty():
-                break      
-            time.sleep(5)
-    
-    def start_pool(self):
+    def wait(self, timeout=None, raise_error=True):
+        """
+        等待所有已提交的思维链执行结束。
+
+        超时后尚未开始的思维链会被取消，正在执行的思维链会继续运行直到结束。
+
+        参数:
+        timeout -- 最长等待时间（秒），默认为None表示一直等待。
+        raise_error -- 是否在有思维链失败时抛出ChainPoolError。
+
+        返回:
+        与提交顺序一致的结果列表，失败的位置为对应的异常。
+
+        抛出:
+        TimeoutError -- 超时仍有思维链未完成。
+        ChainPoolError -- 有思维链执行失败且raise_error为True。
+        """
+        tar_list = self.chain_list
+        self.chain_list = []
+        results = self.thread_send.wait(timeout)
+        errors = [(tar_chain, item) for tar_chain, item in zip(tar_list, results) if isinstance(item, BaseException)]
+        self.status = 'init'
+        if errors and raise_error:
+            raise ChainPoolError(errors, results)
+        return results
+
+    def start_pool(self, timeout=None):
+        """
+        等待通过add_chains提交的思维链全部执行结束。
+
+        参数:
+        timeout -- 最长等待时间（秒），默认为None表示一直等待。
+
+        返回:
+        与提交顺序一致的思维链输出列表。
+
+        抛出:
+        Exception -- 如果没有提交任何思维链。
+        ChainPoolError -- 有思维链执行失败。
+        """
         if self.status != 'ready':
             raise Exception("start pool error")
-        self.threads = []
-        for _ in range(self.threads_num):
-            t = threading.Thread(target=self.worker)
-            t.start()
-            self.threads.append(t)
-        self.chain_list.join()
-    
-    
-    
+        return self.wait(timeout)
+
+    def cancel(self):
+        """
+        取消所有尚未开始执行的思维链。
+
+        返回:
+        被取消的思维链数量。
+        """
+        return self.thread_send.cancel()
+
+    def shutdown(self, wait=True, cancel=False):
+        """
+        关闭线程池。
+
+        参数:
+        wait -- 是否等待正在执行的思维链结束。
+        cancel -- 是否取消尚未开始的思维链。
+        """
+        self.thread_send.shutdown(wait, cancel)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+
+async def arun_chains(chains, max_concurrency=None):
+    """
+    在当前事件循环中并发执行多个思维链。
+
+    所有思维链需要已经通过set_input进入就绪状态。单个思维链失败不会中断其他思维链，
+    失败的异常会出现在返回列表的对应位置。
+
+    参数:
+    chains -- 思维链列表。
+    max_concurrency -- 同时运行的思维链数量上限，默认为None表示不限制。
+
+    返回:
+    与输入顺序一致的列表，成功的位置为None，失败的位置为对应的异常。
+    """
+    if max_concurrency:
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run_one(tar_chain):
+            async with semaphore:
+                return await tar_chain.arun_step()
+    else:
+        async def run_one(tar_chain):
+            return await tar_chain.arun_step()
 
+    return await asyncio.gather(*[run_one(item) for item in chains], return_exceptions=True)
@@ -1,4 +1,5 @@
 from abc import abstractmethod, ABCMeta
+import asyncio
 
 
 #LLM 接口基类
@@ -12,8 +13,79 @@ class LLM_INTERFACE(metaclass=ABCMeta):
     @abstractmethod
     def send_embedding(self, text_list):
         pass
-    
+
     # 获得langchain embedding的工具类
     @abstractmethod
     def get_lang_embedding(self):
         pass
+
+    # 异步发送prompt
+    async def asend_message(self, prompt, json_flag=False):
+        """
+        异步发送prompt。
+
+        默认实现将同步的send_message放到线程池中执行，作为仅支持同步调用的后端的适配器。
+        原生支持异步的后端应重写该方法，以便在一个事件循环中同时挂起大量请求。
+
+        参数:
+        - prompt: 发送给LLM的prompt文本。
+        - json_flag: 是否要求返回JSON格式。
+
+        返回:
+        - LLM的响应结果。
+        """
+        return await asyncio.to_thread(self.send_message, prompt, json_flag)
+
+    # 异步发送embedding
+    async def asend_embedding(self, text_list):
+        """
+        异步获取embedding。
+
+        默认实现将同步的send_embedding放到线程池中执行。
+
+        参数:
+        - text_list: 需要生成embedding的文本列表。
+
+        返回:
+        - 与输入文本对应的embedding列表。
+        """
+        return await asyncio.to_thread(self.send_embedding, text_list)
+
+    # 批量发送prompt
+    def send_messages(self, prompt_list, json_flag=False):
+        """
+        批量发送prompt。
+
+        默认实现逐条调用send_message。支持批量推理的后端应重写该方法，一次性提交整个批次。
+        重写时需保持相同的约定：返回结果与输入顺序一致，单条失败时在对应位置返回异常对象，而不是让整个批次失败。
+
+        参数:
+        - prompt_list: prompt文本列表。
+        - json_flag: 是否要求返回JSON格式。
+
+        返回:
+        - 与prompt_list等长的列表，每个位置为响应结果或该条请求抛出的异常。
+        """
+        res_list = []
+        for prompt in prompt_list:
+            try:
+                res_list.append(self.send_message(prompt, json_flag))
+            except Exception as e:
+                res_list.append(e)
+        return res_list
+
+    # 异步批量发送prompt
+    async def asend_messages(self, prompt_list, json_flag=False):
+        """
+        异步批量发送prompt。
+
+        默认实现并发调用asend_message，结果约定与send_messages相同。
+
+        参数:
+        - prompt_list: prompt文本列表。
+        - json_flag: 是否要求返回JSON格式。
+
+        返回:
+        - 与prompt_list等长的列表，每个位置为响应结果或该条请求抛出的异常。
+        """
+        return await asyncio.gather(*[self.asend_message(prompt, json_flag) for prompt in prompt_list], return_exceptions=True)
@@ -3,6 +3,10 @@ import chromadb
 from casevo.llm_interface import LLM_INTERFACE
 from typing import List,Optional
 import threading
+import bisect
+import numpy as np
+from casevo.util.effect import defer_effect
+from casevo.util.vector_store import ChromaStore, NumpyStore
 
 #记忆元素
 class MemoryItem:
@@ -14,18 +18,24 @@ class MemoryItem:
     action = ""
     #内容
     content = ""
+    #重要性评分，可选
+    importance = None
     
     #初始化
-    def __init__(self, ts, source, target, action, content):
+    def __init__(self, ts, source, target, action, content, importance=None):
         self.ts = ts
         self.source = source
         self.target = target
         self.action = action
         self.content = content
+        self.importance = importance
     
     #将元素转换为字典类型
     def toDict(self):
-        return { "ts": self.ts, "source": self.source, "target": self.target, "action": self.action, "content": self.content }
+        res = { "ts": self.ts, "source": self.source, "target": self.target, "action": self.action, "content": self.content }
+        if self.importance is not None:
+            res['importance'] = self.importance
+        return res
     
 
     @staticmethod
@@ -68,8 +78,10 @@ class Memory(BaseAgentComponent):
         
         #最近一次reflection的短记忆ID
         self.last_id = -1
+        #最近一次reflection时的模型步数
+        self.last_reflect_step = 0
 
-    def add_short_memory(self, source, target, action, content, ts=None):
+    def add_short_memory(self, source, target, action, content, ts=None, importance=None):
         """
         向短期记忆中添加一条记忆项。
 
@@ -82,6 +94,7 @@ class Memory(BaseAgentComponent):
         action - 执行的动作。
         content - 动作的内容或结果。
         ts (可选) - 记忆项的时间戳。如果未提供，将使用当前模拟时间。
+        importance (可选) - 记忆项的重要性评分，用于组合评分检索。
 
         返回:
         添加记忆项后的短期记忆状态。
@@ -89,8 +102,11 @@ class Memory(BaseAgentComponent):
         # 如果没有提供时间戳，则使用当前模拟时间
         if not ts:
             ts = self.agent.model.schedule.time
-        cur_memory = MemoryItem(ts, source, target, action, content)
+        cur_memory = MemoryItem(ts, source, target, action, content, importance)
 
+        # 并行调度时，记忆写入延迟到本轮所有agent执行结束后按顺序进行
+        if defer_effect(self.short_memory_factory.__add_short_memory__, [cur_memory]):
+            return None
         return self.short_memory_factory.__add_short_memory__([cur_memory])
 
 
@@ -124,11 +140,17 @@ class Memory(BaseAgentComponent):
         response, last_id = self.short_memory_factory.__reflect_memory__(self.agent,self.last_id,self.long_memory)
         self.last_id = last_id
         self.long_memory = response
+        self.last_reflect_step = self.agent.model.schedule.steps
     
     def reflect_memory_by_chain(self, chain):
         response, last_id = self.short_memory_factory.__reflect_memory_by_chain__(self.agent,self.last_id,self.long_memory, chain)
         self.last_id = last_id
         self.long_memory = response
+        self.last_reflect_step = self.agent.model.schedule.steps
+
+    def get_pending_num(self):
+        #上次reflection之后新增的记忆项数量
+        return self.short_memory_factory.get_pending_num(self.agent.component_id, self.last_id)
     
     def get_long_memory(self):
         #获得长期记忆
@@ -137,7 +159,7 @@ class Memory(BaseAgentComponent):
 
 #全局的Memory工厂
 class MemeoryFactory(BaseModelComponent):
-    def __init__(self, tar_llm : LLM_INTERFACE,  memory_num, prompt, model,tar_path=None):
+    def __init__(self, tar_llm : LLM_INTERFACE,  memory_num, prompt, model,tar_path=None, embedding_cache=None, write_behind=False, flush_size=256, partition=False, store='chroma', max_memory=None, memory_ttl=None, compact_reflected=False, score_weights=None, recency_decay=0.99, candidate_num=None):
         """
         初始化记忆模块。
         
@@ -148,6 +170,19 @@ class MemeoryFactory(BaseModelComponent):
         :param memory_num: 检索记忆条目的数量。
         :param prompt: 用于触发Reflection的提示。
         :param model: 关联的ABM模型。
+        :param embedding_cache: 可选的EmbeddingCache实例，设置后代替LLM的embedding工具类，相同文本只生成一次向量。
+        :param write_behind: 是否开启写后缓冲。开启后新增的记忆项先进入缓冲区，再批量生成向量并写入。
+        :param flush_size: 写后缓冲区的记忆项数量达到该值时自动写入。
+        :param partition: 是否按agent分区存储。开启后每个agent拥有独立的记忆集合，检索和反思只访问该agent的数据。
+        :param store: 存储后端。'chroma'使用chromadb（支持tar_path持久化）；'numpy'使用进程内的NumpyStore；
+                      也可以传入一个以集合名称为参数、返回VectorStore实例的函数。
+        :param max_memory: 每个agent保留的记忆项数量上限，超出时优先删除重要性最低的记忆项，重要性相同时删除最早的。
+        :param memory_ttl: 记忆项的存活时间（模拟时间），ts早于当前时间减去memory_ttl的记忆项会被删除。
+        :param compact_reflected: 是否删除已经被reflection汇总到长期记忆中的记忆项（ID不大于agent的last_id）。
+        以上三种保留策略由evict_memory在两步之间批量执行。
+        :param score_weights: 组合评分检索的(时近性, 相关性, 重要性)权重，为None时只按向量距离排序。
+        :param recency_decay: 时近性每个时间单位的衰减系数，时近性为recency_decay ** (当前时间 - ts)。
+        :param candidate_num: 组合评分时先按向量距离取出的候选数量，默认为memory_num的5倍。
         """
         
         #memory_log = MesaLog("memory")
@@ -155,17 +190,129 @@ class MemeoryFactory(BaseModelComponent):
         super().__init__("memory_factory", "memory_factory", model)
         
         self.llm = tar_llm
-        if tar_path:
-            self.client = chromadb.PersistentClient(path=tar_path)
-        else:
-            self.client = chromadb.Client()
+        self.store_type = store
+        self.client = None
+        if store == 'chroma':
+            if tar_path:
+                self.client = chromadb.PersistentClient(path=tar_path)
+            else:
+                self.client = chromadb.Client()
+        elif store != 'numpy' and not callable(store):
+            raise Exception("unknown store type: %s" % store)
         
-        self.memory_collection = self.client.get_or_create_collection( "memory", embedding_function= self.llm.get_lang_embedding())
+        if embedding_cache:
+            self.embedding_function = embedding_cache
+        else:
+            self.embedding_function = self.llm.get_lang_embedding()
+        self.memory_store = self.__create_store__("memory")
         self.memory_num = memory_num
+        #组合评分检索
+        self.score_weights = score_weights
+        self.recency_decay = recency_decay
+        self.candidate_num = candidate_num if candidate_num else memory_num * 5
         self.reflact_prompt = prompt
 
         self.lock = threading.Lock()
-        #print(self.memory_collection.count())
+
+        #分区存储：每个agent（按component_id）使用独立的记忆集合
+        self.partition = partition
+        self.partition_dict = {}
+        if self.partition and self.client is not None:
+            for item in self.client.list_collections():
+                cur_name = item if isinstance(item, str) else item.name
+                if cur_name.startswith("memory_"):
+                    self.partition_dict[cur_name[len("memory_"):]] = self.__create_store__(cur_name)
+
+        #进程内的记忆ID计数器，启动时根据已有的记忆项初始化一次
+        self.id_lock = threading.Lock()
+        self.next_id = 0
+        for cur_store in [self.memory_store] + list(self.partition_dict.values()):
+            self.next_id = max(self.next_id, cur_store.max_id() + 1)
+
+        #每个agent相关记忆项的ID索引（升序），记忆项写入存储或缓冲区后追加
+        self.index_lock = threading.Lock()
+        self.memory_index = {}
+        #广播记忆：ID -> 尚未删除的接收者集合，以及每个agent收到的广播记忆ID
+        #广播记忆只在self.memory_store中保存一份（分区模式也是如此）
+        self.broadcast_dict = {}
+        self.broadcast_index = {}
+        #每个agent相关记忆项中设置了重要性的：ID -> importance，数量超出上限时优先删除重要性低的记忆项
+        self.importance_index = {}
+        self.__load_index__()
+        self.reflect_stats = {'reflected': 0, 'skipped': 0}
+
+        #保留策略
+        self.max_memory = max_memory
+        self.memory_ttl = memory_ttl
+        self.compact_reflected = compact_reflected
+        self.evict_num = 0
+        #component_id -> Memory，用于读取各agent的last_id
+        self.memory_dict = {}
+
+        #写后缓冲区
+        self.write_behind = write_behind
+        self.flush_size = flush_size
+        self.pending_memory = []
+        #缓冲区中记忆项的向量：ID -> 向量，每个记忆项只生成一次，检索和写入时共用
+        self.pending_vec = {}
+        self.pending_lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+
+    def __create_store__(self, name):
+        #按名称创建（或打开）一个存储
+        if callable(self.store_type):
+            return self.store_type(name)
+        if self.store_type == 'numpy':
+            return NumpyStore()
+        return ChromaStore(self.client.get_or_create_collection(name, embedding_function=self.embedding_function))
+
+    def __load_index__(self):
+        #根据存储中已有的记忆项建立ID索引，只在启动时执行一次
+        res = self.memory_store.get()
+        for cur_id, cur_dict in zip(res['ids'], res['metadatas']):
+            if 'recipients' in cur_dict:
+                self.__index_broadcast__(int(cur_id), cur_dict['recipients'].split(","), cur_dict.get('importance'))
+            elif not self.partition:
+                for owner in set([cur_dict['source'], cur_dict['target']]):
+                    if owner:
+                        self.__index_owner__(owner, int(cur_id), cur_dict.get('importance'))
+        for owner, cur_store in self.partition_dict.items():
+            res = cur_store.get()
+            for cur_id, cur_dict in zip(res['ids'], res['metadatas']):
+                self.__index_owner__(owner, int(cur_id), cur_dict.get('importance'))
+
+    def __index_owner__(self, owner, cur_id, importance=None):
+        #把一个ID追加到owner的索引中，调用方需持有self.index_lock（启动时除外）
+        if importance is not None:
+            self.importance_index.setdefault(owner, {})[cur_id] = importance
+        cur_list = self.memory_index.setdefault(owner, [])
+        if len(cur_list) == 0 or cur_list[-1] < cur_id:
+            cur_list.append(cur_id)
+        else:
+            #并发写入时ID可能稍晚到达
+            bisect.insort(cur_list, cur_id)
+
+    def __index_memory__(self, tar_memory:List[MemoryItem]):
+        #把记忆项的ID追加到相关agent的索引中
+        with self.index_lock:
+            for item in tar_memory:
+                for owner in set([item.source, item.target]):
+                    if owner:
+                        self.__index_owner__(owner, item.id, item.importance)
+
+    def __index_broadcast__(self, cur_id, target_list, importance=None):
+        #记录广播记忆的接收者，调用方需持有self.index_lock（启动时除外）
+        self.broadcast_dict[cur_id] = set(target_list)
+        for owner in target_list:
+            self.__index_owner__(owner, cur_id, importance)
+            cur_list = self.broadcast_index.setdefault(owner, [])
+            if len(cur_list) == 0 or cur_list[-1] < cur_id:
+                cur_list.append(cur_id)
+            else:
+                bisect.insort(cur_list, cur_id)
+
+    def __embed__(self, text_list):
+        return np.asarray(self.embedding_function(text_list), dtype=np.float32)
     
     def create_memory(self, agent):
         """
@@ -180,27 +327,299 @@ class MemeoryFactory(BaseModelComponent):
         - Memory: 一个Memory实例，用于存储和管理代理的记忆。
         """
         #cur_collection = self.client.get_or_create_collection(agent.component_id + "_memory", embedding_function= self.llm.get_lang_embedding())
-        return Memory(agent.component_id + "_memory", agent, self)
+        cur_memory = Memory(agent.component_id + "_memory", agent, self)
+        self.memory_dict[agent.component_id] = cur_memory
+        return cur_memory
     
+    def __alloc_ids__(self, num):
+        #原子地分配num个连续的记忆ID，返回起始ID
+        with self.id_lock:
+            start_id = self.next_id
+            self.next_id += num
+        return start_id
+
     def __add_short_memory__(self, tar_memory:List[MemoryItem]) -> bool:
         """
         将目标记忆项添加到短期记忆中。
 
-        这个方法封装了将记忆项添加到记忆集合的过程，包括计算开始位置、
-        转换记忆项格式以及实际添加操作。
+        ID由进程内的计数器分配，不再查询记忆集合的数量。开启写后缓冲时，记忆项先进入缓冲区，
+        在缓冲区达到flush_size或调用flush_memory时统一生成向量并写入记忆集合。
 
         :param tar_memory: 待添加的目标记忆项列表。
         :return: 添加操作是否成功的布尔值。
         """
-        # 记录开始位置，用于后续计算新增记忆项的数量。
-        self.lock.acquire()
-        start_pos = self.memory_collection.count()
-        # 将目标记忆项转换为统一的列表格式，准备添加到记忆集合中。
-        content_list, meta_list, id_list = MemoryItem.toList(tar_memory, start_pos)
-        # 实际添加记忆项到记忆集合中，并返回操作是否成功。
-        res = self.memory_collection.add(documents=content_list, metadatas=meta_list, ids=id_list)
-        self.lock.release() 
+        start_id = self.__alloc_ids__(len(tar_memory))
+        for i, item in enumerate(tar_memory):
+            item.id = start_id + i
+        if not self.write_behind:
+            res = self.__write_memory__(tar_memory)
+            self.__index_memory__(tar_memory)
+            return res
+
+        flush_flag = False
+        with self.pending_lock:
+            self.pending_memory.extend(tar_memory)
+            flush_flag = len(self.pending_memory) >= self.flush_size
+        self.__index_memory__(tar_memory)
+        if flush_flag:
+            self.flush_memory()
+        return True
+
+    def __write_memory__(self, tar_memory:List[MemoryItem], embedding_list=None):
+        #将已分配ID的记忆项批量写入存储（没有传入向量时进行一次embedding调用）
+        if len(tar_memory) == 0:
+            return True
+        content_list = []
+        meta_list = []
+        id_list = []
+        for item in tar_memory:
+            cur_dict = item.toDict()
+            cur_dict['id'] = item.id
+            content_list.append(cur_dict['content'])
+            meta_list.append(cur_dict)
+            id_list.append(item.id)
+        if embedding_list is None:
+            embedding_list = self.__embed__(content_list)
+        if self.partition:
+            return self.__write_partition__(content_list, meta_list, id_list, embedding_list)
+        with self.lock:
+            res = self.memory_store.add(id_list, content_list, meta_list, embedding_list)
         return res
+
+    def __get_partition__(self, owner, create=False):
+        #获取owner对应的记忆分区，不存在且create为False时返回None
+        cur_store = self.partition_dict.get(owner)
+        if cur_store is None and create:
+            cur_store = self.__create_store__("memory_" + owner)
+            self.partition_dict[owner] = cur_store
+        return cur_store
+
+    def __write_partition__(self, content_list, meta_list, id_list, embedding_list):
+        #向量只生成一次，涉及两个agent的记忆项同时写入双方的分区
+        owner_dict = {}
+        for i, cur_dict in enumerate(meta_list):
+            for owner in set([cur_dict['source'], cur_dict['target']]):
+                if owner:
+                    owner_dict.setdefault(owner, []).append(i)
+        with self.lock:
+            for owner, pos_list in owner_dict.items():
+                self.__get_partition__(owner, True).add(
+                    [id_list[i] for i in pos_list],
+                    [content_list[i] for i in pos_list],
+                    [meta_list[i] for i in pos_list],
+                    embedding_list[pos_list])
+        return True
+
+    def add_broadcast(self, content, targets, ts, action, source="", importance=None):
+        """
+        添加一条发给多个agent的广播记忆，例如公开辩论的内容。
+
+        文本和向量只保存一份，并记录接收者列表；各接收者的检索、反思、计数和保留策略都会把它当作自己的记忆项处理，
+        返回结果中的source为广播来源，target为该接收者。
+
+        参数:
+        - content: 广播内容。
+        - targets: 接收者的component_id列表。
+        - ts: 时间戳。
+        - action: 事件类型。
+        - source: 广播来源，默认为空。
+        - importance: 重要性评分，可选。
+
+        返回:
+        - 添加操作是否成功的布尔值。
+        """
+        # 并行调度时与add_short_memory一样延迟执行
+        if defer_effect(self.add_broadcast, content, targets, ts, action, source, importance):
+            return None
+        target_list = list(dict.fromkeys(item for item in targets if item))
+        if len(target_list) == 0:
+            return True
+        cur_id = self.__alloc_ids__(1)
+        cur_dict = {"ts": ts, "source": "", "target": "", "action": action, "content": content, "id": cur_id,
+                    "broadcast_source": source, "recipients": ",".join(target_list)}
+        if importance is not None:
+            cur_dict['importance'] = importance
+        embedding_list = self.__embed__([content])
+        with self.lock:
+            res = self.memory_store.add([cur_id], [content], [cur_dict], embedding_list)
+        with self.index_lock:
+            self.__index_broadcast__(cur_id, target_list, importance)
+        return res
+
+    @staticmethod
+    def __resolve_broadcast__(cur_dict, tar_agent):
+        #把广播记忆的元数据还原为tar_agent视角下的普通记忆项
+        if 'recipients' not in cur_dict:
+            return cur_dict
+        res = {"ts": cur_dict['ts'], "source": cur_dict['broadcast_source'], "target": tar_agent,
+               "action": cur_dict['action'], "content": cur_dict['content'], "id": cur_dict['id']}
+        if 'importance' in cur_dict:
+            res['importance'] = cur_dict['importance']
+        return res
+
+    def flush_memory(self):
+        """
+        将写后缓冲区中的所有记忆项作为一批写入记忆集合。
+
+        应在每一步结束时调用（ModelBase.step会自动调用）。写入完成前，这些记忆项仍可以通过缓冲区被检索和反思读取。
+        """
+        with self.flush_lock:
+            with self.pending_lock:
+                tar_memory = list(self.pending_memory)
+            if len(tar_memory) == 0:
+                return
+            #检索时已经生成的向量直接复用
+            self.__write_memory__(tar_memory, self.__embed_pending__(tar_memory))
+            with self.pending_lock:
+                #写入期间新加入的记忆项保留在缓冲区中
+                self.pending_memory = self.pending_memory[len(tar_memory):]
+                for item in tar_memory:
+                    self.pending_vec.pop(item.id, None)
+
+    def __embed_pending__(self, tar_memory):
+        #返回缓冲区中记忆项的向量，尚未生成向量的记忆项合并为一次embedding调用
+        with self.pending_lock:
+            new_list = [item for item in tar_memory if item.id not in self.pending_vec]
+        if len(new_list) > 0:
+            text_list = list(dict.fromkeys(item.content for item in new_list))
+            text_pos = {text: i for i, text in enumerate(text_list)}
+            text_vec = self.__embed__(text_list)
+            with self.pending_lock:
+                for item in new_list:
+                    self.pending_vec.setdefault(item.id, text_vec[text_pos[item.content]])
+        with self.pending_lock:
+            return np.stack([self.pending_vec[item.id] for item in tar_memory])
+
+    def evict_memory(self):
+        """
+        按保留策略批量删除记忆项，应在两步之间调用（ModelBase.step会自动调用）。
+
+        - max_memory：每个agent最多保留max_memory条记忆项，超出时优先删除重要性最低的（未设置时按0计），
+          重要性相同时删除最旧的；都未设置重要性时即只保留最新的max_memory条。
+        - memory_ttl：删除ts早于当前时间减去memory_ttl的记忆项。
+        - compact_reflected：删除已被reflection汇总到长期记忆中的记忆项。
+
+        共享存储中涉及两个agent的记忆项：超出数量上限或过期时直接删除；
+        compact_reflected只在双方都已反思过该记忆项时删除。分区模式下各agent的分区分别处理。
+        广播记忆按接收者分别移除，所有接收者都移除后（或过期时）才从存储中删除。
+
+        返回:
+        - 本次删除的记忆项数量（分区模式下按各分区中的副本计数）。
+        """
+        if self.max_memory is None and self.memory_ttl is None and not self.compact_reflected:
+            return 0
+        if self.write_behind:
+            self.flush_memory()
+
+        #超出数量上限的记忆项，以及各agent已反思过的记忆项
+        force_dict = {}
+        cover_dict = {}
+        with self.index_lock:
+            for owner, cur_list in self.memory_index.items():
+                if self.max_memory is not None and len(cur_list) > self.max_memory:
+                    force_dict[owner] = self.__select_evict__(owner, cur_list, len(cur_list) - self.max_memory)
+                if self.compact_reflected and owner in self.memory_dict:
+                    cur_pos = bisect.bisect_right(cur_list, self.memory_dict[owner].last_id)
+                    if cur_pos > 0:
+                        cover_dict[owner] = set(cur_list[:cur_pos])
+        ttl_where = None
+        if self.memory_ttl is not None:
+            ttl_where = {"ts": {"$lt": self.model.schedule.time - self.memory_ttl}}
+
+        #drop_dict：每个agent索引中需要移除的ID；broadcast_drop：已没有接收者、需要删除的广播记忆
+        drop_dict = {}
+        broadcast_drop = set()
+        evict_num = 0
+        with self.lock:
+            if ttl_where:
+                expire_list = [int(item) for item in self.memory_store.get(where=ttl_where)['ids']]
+            with self.index_lock:
+                #广播记忆按接收者分别移除，所有接收者都移除后才删除
+                for owner in set(force_dict) | set(cover_dict):
+                    for cur_id in list(force_dict.get(owner, [])) + list(cover_dict.get(owner, ())):
+                        if cur_id in self.broadcast_dict:
+                            drop_dict.setdefault(owner, set()).add(cur_id)
+                            self.broadcast_dict[cur_id].discard(owner)
+                            if len(self.broadcast_dict[cur_id]) == 0:
+                                broadcast_drop.add(cur_id)
+                if ttl_where:
+                    for cur_id in expire_list:
+                        if cur_id in self.broadcast_dict:
+                            for owner in self.broadcast_dict[cur_id]:
+                                drop_dict.setdefault(owner, set()).add(cur_id)
+                            broadcast_drop.add(cur_id)
+                for cur_id in broadcast_drop:
+                    del self.broadcast_dict[cur_id]
+                broadcast_set = set(self.broadcast_dict) | broadcast_drop
+            if broadcast_drop:
+                self.memory_store.delete(sorted(broadcast_drop))
+                evict_num += len(broadcast_drop)
+            #接收者减少的广播记忆更新其接收者列表，保证重新打开存储后索引一致
+            update_ids = sorted(set(item for cur_drop in drop_dict.values() for item in cur_drop) - broadcast_drop)
+            if update_ids:
+                res = self.memory_store.get(id_list=update_ids)
+                with self.index_lock:
+                    meta_list = [dict(cur_dict, recipients=",".join(sorted(self.broadcast_dict[int(cur_id)])))
+                                 for cur_id, cur_dict in zip(res['ids'], res['metadatas'])]
+                self.memory_store.update([int(item) for item in res['ids']], meta_list)
+
+            if self.partition:
+                for owner, cur_store in list(self.partition_dict.items()):
+                    cur_drop = set(force_dict.get(owner, [])) | cover_dict.get(owner, set())
+                    cur_drop -= broadcast_set
+                    if ttl_where:
+                        cur_drop.update(int(item) for item in cur_store.get(where=ttl_where)['ids'])
+                    if cur_drop:
+                        cur_store.delete(sorted(cur_drop))
+                        drop_dict.setdefault(owner, set()).update(cur_drop)
+                        evict_num += len(cur_drop)
+            else:
+                cur_drop = set()
+                for item in force_dict.values():
+                    cur_drop.update(item)
+                if ttl_where:
+                    cur_drop.update(expire_list)
+                cur_drop -= broadcast_set
+                cover_set = set().union(*cover_dict.values()) - cur_drop - broadcast_set
+                if cover_set:
+                    res = self.memory_store.get(id_list=sorted(cover_set))
+                    for cur_id, cur_dict in zip(res['ids'], res['metadatas']):
+                        owner_list = [owner for owner in set([cur_dict['source'], cur_dict['target']]) if owner]
+                        if all(int(cur_id) in cover_dict.get(owner, ()) for owner in owner_list):
+                            cur_drop.add(int(cur_id))
+                if cur_drop:
+                    res = self.memory_store.get(id_list=sorted(cur_drop))
+                    for cur_id, cur_dict in zip(res['ids'], res['metadatas']):
+                        for owner in set([cur_dict['source'], cur_dict['target']]):
+                            if owner:
+                                drop_dict.setdefault(owner, set()).add(int(cur_id))
+                    self.memory_store.delete(sorted(cur_drop))
+                    evict_num += len(res['ids'])
+
+        with self.index_lock:
+            for owner, cur_drop in drop_dict.items():
+                self.memory_index[owner] = [item for item in self.memory_index.get(owner, []) if item not in cur_drop]
+                if owner in self.broadcast_index:
+                    self.broadcast_index[owner] = [item for item in self.broadcast_index[owner] if item not in cur_drop]
+                if owner in self.importance_index:
+                    for item in cur_drop:
+                        self.importance_index[owner].pop(item, None)
+            self.evict_num += evict_num
+        return evict_num
+
+    def __select_evict__(self, owner, cur_list, num):
+        #从owner的记忆项中选出num条删除：重要性最低的优先，重要性相同时最旧的优先，调用方需持有self.index_lock
+        cur_dict = self.importance_index.get(owner)
+        if not cur_dict:
+            return cur_list[:num]
+        #cur_list按ID升序，稳定排序保证重要性相同时先删除旧的
+        return sorted(sorted(cur_list, key=lambda cur_id: cur_dict.get(cur_id, 0))[:num])
+
+    def __get_pending__(self, tar_agent, tar_pos=-1):
+        #缓冲区中与tar_agent相关且ID大于tar_pos的记忆项
+        with self.pending_lock:
+            return [item for item in self.pending_memory
+                    if item.id > tar_pos and (item.source == tar_agent or item.target == tar_agent)]
     
     def __search_short_memory_by_doc__(self, content_list:List[str], tar_agent):
         """
@@ -208,6 +627,7 @@ class MemeoryFactory(BaseModelComponent):
         
         这个方法用于在内部记忆集合中搜索与给定内容列表匹配且与目标代理相关的条目。
         它支持同时查询记忆的来源或目标为指定代理的记忆条目。
+        写后缓冲区中尚未写入的相关记忆项会与查询结果按距离合并。
         
         参数:
         content_list (List[str]): 需要查询的记忆内容列表。
@@ -216,16 +636,287 @@ class MemeoryFactory(BaseModelComponent):
         返回:
         查询结果列表，包含与内容列表匹配且与目标代理相关的记忆条目。
         """
-        # 根据内容列表和查询条件在记忆库中查询相关信息
+        return self.search_many([(tar_agent, content_list)])[tar_agent]
+
+    def search_many(self, request_list):
+        """
+        批量检索多个agent的记忆。
+
+        适用于一个阶段内所有agent都需要检索记忆的场景（例如talk）。所有查询文本去重后只生成一次向量，
+        然后在一次加锁内依次完成各agent的相似度检索，用一次调用代替每个agent各自的检索。
+
+        参数:
+        request_list: (agent的component_id, 查询文本列表)组成的列表。同一个agent出现多次时，其查询文本会被合并。
+
+        返回:
+        以agent的component_id为键的字典，值的格式与search_short_memory_by_doc的结果相同。
+        """
+        query_dict = {}
+        for tar_agent, content_list in request_list:
+            query_dict.setdefault(tar_agent, []).extend(content_list)
+
+        #所有查询文本只生成一次向量
+        text_list = list(dict.fromkeys(text for content_list in query_dict.values() for text in content_list))
+        pos_dict = {text: i for i, text in enumerate(text_list)}
+        if len(text_list) > 0:
+            query_vec = np.asarray(self.embedding_function(text_list), dtype=np.float32)
+
+        res_dict = {}
+        agent_list = []
+        for tar_agent, content_list in query_dict.items():
+            if len(content_list) == 0:
+                res_dict[tar_agent] = self.__empty_result__(0)
+            else:
+                agent_list.append(tar_agent)
+        with self.lock:
+            if self.partition:
+                for tar_agent in agent_list:
+                    cur_vec = query_vec[[pos_dict[text] for text in query_dict[tar_agent]]]
+                    res_dict[tar_agent] = self.__query_agent__(tar_agent, cur_vec)
+            elif len(agent_list) > 0:
+                #共享存储中的检索交给存储的批量接口（NumpyStore只做一次矩阵乘法）
+                res_list = self.memory_store.query_many(
+                    [(query_vec[[pos_dict[text] for text in query_dict[tar_agent]]], self.__owner_where__(tar_agent))
+                     for tar_agent in agent_list],
+                    self.__get_query_num__())
+                res_dict.update(zip(agent_list, res_list))
+
+        if self.write_behind:
+            pending_dict = {}
+            for tar_agent, content_list in query_dict.items():
+                pending_list = self.__get_pending__(tar_agent)
+                if len(pending_list) > 0 and len(content_list) > 0:
+                    pending_dict[tar_agent] = pending_list
+            if len(pending_dict) > 0:
+                #缓冲区中的记忆项只在第一次用到时生成向量，之后的检索和flush_memory都复用该向量
+                pending_all = list({item.id: item for pending_list in pending_dict.values() for item in pending_list}.values())
+                pending_pos = {item.id: i for i, item in enumerate(pending_all)}
+                pending_vec = self.__embed_pending__(pending_all)
+                for tar_agent, pending_list in pending_dict.items():
+                    cur_vec = query_vec[[pos_dict[text] for text in query_dict[tar_agent]]]
+                    cur_pending = pending_vec[[pending_pos[item.id] for item in pending_list]]
+                    res_dict[tar_agent] = self.__merge_pending__(res_dict[tar_agent], cur_vec, pending_list, cur_pending)
+
+        if len(self.broadcast_dict) > 0:
+            for tar_agent, res in res_dict.items():
+                res['metadatas'] = [[self.__resolve_broadcast__(item, tar_agent) for item in cur_list] for cur_list in res['metadatas']]
+        if self.score_weights:
+            for res in res_dict.values():
+                self.__score_result__(res)
+        return res_dict
+
+    def __get_query_num__(self):
+        #向存储查询的数量：组合评分时先取candidate_num个候选
+        if self.score_weights:
+            return max(self.memory_num, self.candidate_num)
+        return self.memory_num
+
+    @staticmethod
+    def __normalize__(tar_array):
+        #把一组候选的分数线性缩放到[0, 1]，所有候选相同时为0
+        if len(tar_array) == 0:
+            return tar_array
+        cur_range = tar_array.max() - tar_array.min()
+        if cur_range <= 0:
+            return np.zeros_like(tar_array)
+        return (tar_array - tar_array.min()) / cur_range
+
+    def __score_result__(self, res):
+        """
+        按时近性、相关性和重要性的加权和对每个查询的候选重新排序，保留memory_num条。
+
+        每个查询的候选作为一组数组整体计算：相关性为负的向量距离，时近性为recency_decay ** (当前时间 - ts)，
+        重要性取元数据中的importance（没有时为0），三者分别在候选内归一化到[0, 1]后加权求和。
+        结果中增加scores字段。
+        """
+        recency_weight, relevance_weight, importance_weight = self.score_weights
+        cur_time = self.model.schedule.time
+        res['scores'] = []
+        for i in range(len(res['ids'])):
+            meta_list = res['metadatas'][i]
+            dist = np.asarray(res['distances'][i], dtype=np.float64)
+            ts = np.asarray([item.get('ts', cur_time) for item in meta_list], dtype=np.float64)
+            importance = np.asarray([item.get('importance', 0) for item in meta_list], dtype=np.float64)
+            score = (recency_weight * self.__normalize__(self.recency_decay ** np.maximum(cur_time - ts, 0))
+                     + relevance_weight * self.__normalize__(-dist)
+                     + importance_weight * self.__normalize__(importance))
+            order = np.argsort(-score, kind='stable')[:self.memory_num]
+            for key in ['ids', 'distances', 'documents', 'metadatas']:
+                res[key][i] = [res[key][i][j] for j in order]
+            res['scores'].append([float(score[j]) for j in order])
+        return res
+
+    @staticmethod
+    def __empty_result__(query_num):
+        return {key: [[] for _ in range(query_num)] for key in ['ids', 'distances', 'documents', 'metadatas']}
+
+    def __owner_where__(self, tar_agent):
+        #共享存储中与tar_agent相关的记忆项（包括收到的广播记忆）的过滤条件
+        cur_where = [{"source": tar_agent},{"target": tar_agent}]
+        with self.index_lock:
+            broadcast_list = list(self.broadcast_index.get(tar_agent, []))
+        if len(broadcast_list) > 0:
+            cur_where.append({"id": {"$in": broadcast_list}})
+        return {"$or": cur_where}
+
+    def __broadcast_where__(self, tar_agent):
+        #tar_agent收到的广播记忆的过滤条件，没有时返回None
+        with self.index_lock:
+            broadcast_list = list(self.broadcast_index.get(tar_agent, []))
+        if len(broadcast_list) == 0:
+            return None
+        return {"id": {"$in": broadcast_list}}
+
+    def __query_agent__(self, tar_agent, query_vec):
+        #使用查询向量检索tar_agent的记忆，调用方需持有self.lock
+        if self.partition:
+            #分区模式下只查询该agent自己的分区
+            cur_store = self.__get_partition__(tar_agent)
+            if cur_store is None:
+                res = self.__empty_result__(len(query_vec))
+            else:
+                res = cur_store.query(query_vec, self.__get_query_num__())
+            broadcast_where = self.__broadcast_where__(tar_agent)
+            if broadcast_where is not None:
+                res = self.__merge_result__(res, self.memory_store.query(query_vec, self.__get_query_num__(), broadcast_where))
+            return res
+        return self.memory_store.query(query_vec, self.__get_query_num__(), self.__owner_where__(tar_agent))
+
+    def __merge_result__(self, res, other_res):
+        #按距离合并两个查询结果，每个查询保留__get_query_num__()条
+        for i in range(len(res['ids'])):
+            cur_list = list(zip(res['distances'][i], res['ids'][i], res['documents'][i], res['metadatas'][i]))
+            cur_list.extend(zip(other_res['distances'][i], other_res['ids'][i], other_res['documents'][i], other_res['metadatas'][i]))
+            cur_list.sort(key=lambda x: x[0])
+            cur_list = cur_list[:self.__get_query_num__()]
+            res['distances'][i] = [item[0] for item in cur_list]
+            res['ids'][i] = [item[1] for item in cur_list]
+            res['documents'][i] = [item[2] for item in cur_list]
+            res['metadatas'][i] = [item[3] for item in cur_list]
+        return res
+
+    def __merge_pending__(self, res, query_vec, pending_list, pending_vec):
+        #把缓冲区中的记忆项按与查询的距离（平方L2，与chromadb默认一致）合并到查询结果中
+        dist = ((query_vec[:, None, :] - pending_vec[None, :, :]) ** 2).sum(axis=2)
+        meta_list = []
+        for item in pending_list:
+            cur_dict = item.toDict()
+            cur_dict['id'] = item.id
+            meta_list.append(cur_dict)
+        pending_res = {
+            'distances': [[float(item) for item in dist[i]] for i in range(len(query_vec))],
+            'ids': [[str(item.id) for item in pending_list] for _ in range(len(query_vec))],
+            'documents': [[item.content for item in pending_list] for _ in range(len(query_vec))],
+            'metadatas': [list(meta_list) for _ in range(len(query_vec))]
+        }
+        return self.__merge_result__(res, pending_res)
+
+    def get_memory_count(self, tar_agent):
+        """
+        获取与指定agent相关的记忆项数量（包括写后缓冲区中的记忆项）。
+
+        直接读取该agent的ID索引长度，不访问存储。
+
+        参数:
+        - tar_agent: agent的component_id。
+
+        返回:
+        - 记忆项数量。
+        """
+        with self.index_lock:
+            return len(self.memory_index.get(tar_agent, []))
+
+    def get_pending_num(self, tar_agent, tar_pos):
+        """
+        获取与指定agent相关且ID大于tar_pos的记忆项数量，即该agent尚未反思的记忆项数量。
+        """
+        with self.index_lock:
+            cur_list = self.memory_index.get(tar_agent, [])
+            return len(cur_list) - bisect.bisect_right(cur_list, tar_pos)
+
+    def select_reflect_agents(self, agent_list, min_count=1, max_staleness=None):
+        """
+        从agent_list中选出需要反思的agent。
+
+        没有新记忆项的agent不需要反思；新记忆项数量达到min_count，或距上次反思已经过max_staleness步的agent需要反思。
+        被跳过的agent数量计入反思统计。
+
+        参数:
+        - agent_list: 候选agent列表。
+        - min_count: 触发反思的最少新记忆项数量。
+        - max_staleness: 最长不反思的步数，为None时只按min_count判断。
+
+        返回:
+        - 需要反思的agent列表，保持agent_list中的顺序。
+        """
+        cur_step = self.model.schedule.steps
+        res = []
+        for cur_agent in agent_list:
+            cur_memory = cur_agent.memory
+            pending_num = self.get_pending_num(cur_agent.component_id, cur_memory.last_id)
+            if pending_num == 0:
+                continue
+            if pending_num >= min_count or (max_staleness is not None and cur_step - cur_memory.last_reflect_step >= max_staleness):
+                res.append(cur_agent)
+        with self.index_lock:
+            self.reflect_stats['reflected'] += len(res)
+            self.reflect_stats['skipped'] += len(agent_list) - len(res)
+        return res
+
+    def get_reflect_stats(self):
+        """
+        获取反思统计信息。
+
+        返回:
+        - 包含实际反思次数（reflected）和被跳过的反思次数（skipped，即节省的LLM调用次数）的字典。
+        """
+        with self.index_lock:
+            return dict(self.reflect_stats)
+
+    def __get_new_memory__(self, tar_agent, tar_pos):
+        """
+        获取tar_agent在tar_pos之后的所有记忆项（包括写后缓冲区中的记忆项）。
+
+        新记忆项的ID直接从该agent的ID索引中二分查找得到，再按ID读取，不需要在存储中按条件扫描。
+
+        返回:
+        - meta_list: 按ID升序排列的记忆项元数据列表。
+        - last_id: 最新的记忆项ID；没有新记忆项时保持为tar_pos。
+        """
+        owner = tar_agent.component_id
+        with self.index_lock:
+            cur_list = self.memory_index.get(owner, [])
+            new_ids = cur_list[bisect.bisect_right(cur_list, tar_pos):]
+        if len(new_ids) == 0:
+            return [], tar_pos
+
         self.lock.acquire()
-        res = self.memory_collection.query(
-            query_texts=content_list,
-            n_results=self.memory_num,
-            where={"$or":[{"source": tar_agent},{"target": tar_agent}]}
-        )
+        if self.partition:
+            #广播记忆保存在共享存储中，其余记忆项在该agent的分区中
+            broadcast_ids = [item for item in new_ids if item in self.broadcast_dict]
+            cur_store = self.__get_partition__(owner)
+            meta_list = []
+            if cur_store is not None:
+                meta_list = list(cur_store.get(id_list=new_ids)['metadatas'])
+            if len(broadcast_ids) > 0:
+                meta_list.extend(self.memory_store.get(id_list=broadcast_ids)['metadatas'])
+                meta_list.sort(key=lambda x: x['id'])
+        else:
+            meta_list = list(self.memory_store.get(id_list=new_ids)['metadatas'])
         self.lock.release()
-        return res
-    
+
+        meta_list = [self.__resolve_broadcast__(item, owner) for item in meta_list]
+        if self.write_behind and len(meta_list) < len(new_ids):
+            #尚未写入存储的记忆项从缓冲区中读取
+            id_set = set(item['id'] for item in meta_list)
+            for item in self.__get_pending__(owner, tar_pos):
+                if item.id not in id_set:
+                    cur_dict = item.toDict()
+                    cur_dict['id'] = item.id
+                    meta_list.append(cur_dict)
+            meta_list.sort(key=lambda x: x['id'])
+        return meta_list, new_ids[-1]
+
     def __reflect_memory__(self, tar_agent, tar_pos, tar_long_opinion):
         """
         根据目标代理和位置进行reflection。
@@ -243,34 +934,18 @@ class MemeoryFactory(BaseModelComponent):
         - response: 反射操作的结果。
         - last_id: 最新的记忆项ID。
         """
-        self.lock.acquire()
-        # 从内存集合中查询位于tar_pos之后且与tar_agent相关的记忆项
-        memory_list = self.memory_collection.get(
-            where={
-                "$and":[
-                    {"id":{"$gt":tar_pos}},
-                    {"$or":[{"source": tar_agent.component_id},{"target": tar_agent.component_id}]}
-                ]
-            })
-        self.lock.release()
+        # 查询位于tar_pos之后且与tar_agent相关的记忆项
+        meta_list, last_id = self.__get_new_memory__(tar_agent, tar_pos)
 
         # 构建包含长期和短期记忆的字典
         tar_item = {
             'long_memory': tar_long_opinion,
-            'short_memory': memory_list['metadatas']
+            'short_memory': meta_list
         }
         
         # 发送包含记忆的提示，并获取反射操作的结果
         response = self.reflact_prompt.send_prompt(tar_item, tar_agent, self.model)
         
-        # 初始化最后一个记忆项ID为-1，用于后续寻找最新的记忆项ID
-        last_id = -1
-        
-        # 遍历记忆项ID列表，更新last_id为最大的ID值
-        for item in memory_list['ids']:
-            if int(item) > last_id:
-                last_id = int(item)
-        
         # 返回反射操作的结果和最新的记忆项ID
         return response, last_id
 
@@ -291,21 +966,13 @@ class MemeoryFactory(BaseModelComponent):
         - response: 反射操作的结果。
         - last_id: 最新的记忆项ID。
         """
-        self.lock.acquire()
-        # 从内存集合中查询位于tar_pos之后且与tar_agent相关的记忆项
-        memory_list = self.memory_collection.get(
-            where={
-                "$and":[
-                    {"id":{"$gt":tar_pos}},
-                    {"$or":[{"source": tar_agent.component_id},{"target": tar_agent.component_id}]}
-                ]
-            })
-        self.lock.release()
+        # 查询位于tar_pos之后且与tar_agent相关的记忆项
+        meta_list, last_id = self.__get_new_memory__(tar_agent, tar_pos)
 
         # 构建包含长期和短期记忆的字典
         tar_item = {
             'long_memory': tar_long_opinion,
-            'short_memory': memory_list['metadatas']
+            'short_memory': meta_list
         }
         tar_chain.set_input(tar_item)
         
@@ -313,14 +980,6 @@ class MemeoryFactory(BaseModelComponent):
         
         response = tar_chain.get_output()['last_response']
          
-        # 初始化最后一个记忆项ID为-1，用于后续寻找最新的记忆项ID
-        last_id = -1
-        
-        # 遍历记忆项ID列表，更新last_id为最大的ID值
-        for item in memory_list['ids']:
-            if int(item) > last_id:
-                last_id = int(item)
-        
         # 返回反射操作的结果和最新的记忆项ID
         return response, last_id
 
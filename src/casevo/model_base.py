@@ -1,13 +1,175 @@
 import mesa
+import asyncio
 from casevo.memory import MemeoryFactory
 from casevo.prompt import PromptFactory
+from casevo.chain import ChainPoolError, arun_chains
 from casevo.util.thread_send import ThreadSend
+from casevo.util.effect import EffectBuffer, capture_effects
 
 class OrederTypeActivation(mesa.time.RandomActivationByType):
     def add_timestemp(self):
         self.time += 1
         self.steps += 1
         
+#并行激活调度器
+class ParallelActivation(mesa.time.RandomActivation):
+    """
+    并行执行所有agent的step。
+
+    每一步先按随机顺序排列agent，然后通过线程池（或asyncio）同时执行各agent的step。
+    执行期间记忆写入和日志等副作用被记录到各agent的缓冲区中，所有agent结束后再按本步的随机顺序依次应用，
+    因此副作用的顺序与串行的RandomActivation一致，只取决于随机种子。
+    需要注意，agent在本步中写入的记忆要到本步结束后才能被检索到。
+    """
+    def __init__(self, model, thread_num=8, use_async=False):
+        """
+        初始化调度器。
+
+        参数:
+        - model: 所属的模型。
+        - thread_num: 线程池的线程数量。
+        - use_async: 为True时在一个事件循环中并发执行各agent的astep协程，而不是在线程池中执行step。
+                     在已有事件循环中调用step时，该事件循环在单独的线程中运行。
+        """
+        super().__init__(model)
+        self.use_async = use_async
+        self.thread_send = None
+        if not use_async:
+            self.thread_send = ThreadSend(thread_num)
+
+    @staticmethod
+    def run_agent(tar_agent, tar_buffer):
+        with capture_effects(tar_buffer):
+            tar_agent.step()
+
+    @staticmethod
+    async def arun_agent(tar_agent, tar_buffer):
+        with capture_effects(tar_buffer):
+            await tar_agent.astep()
+
+    async def arun_agents(self, agent_list, buffer_list):
+        return await asyncio.gather(*[self.arun_agent(agent, buffer) for agent, buffer in zip(agent_list, buffer_list)], return_exceptions=True)
+
+    def step(self):
+        """
+        并行执行一步，然后按随机顺序应用各agent的副作用。
+
+        抛出:
+        - 如果有agent执行失败，在其他agent的副作用应用完成后抛出第一个异常。
+        """
+        #与RandomActivation相同的随机顺序
+        self._agents.shuffle(inplace=True)
+        agent_list = list(self._agents)
+        buffer_list = [EffectBuffer() for _ in agent_list]
+
+        if self.use_async:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                res_list = asyncio.run(self.arun_agents(agent_list, buffer_list))
+            else:
+                #已经在事件循环中（例如notebook或异步驱动程序），在单独的线程中运行新的事件循环
+                with ThreadSend(1) as cur_send:
+                    res_list = cur_send.add_task(asyncio.run, (self.arun_agents(agent_list, buffer_list),)).result()
+        else:
+            res_list = self.thread_send.map(lambda item: self.run_agent(*item), list(zip(agent_list, buffer_list)), return_exceptions=True)
+
+        for cur_buffer in buffer_list:
+            cur_buffer.apply()
+
+        self.steps += 1
+        self.time += 1
+
+        for item in res_list:
+            if isinstance(item, BaseException):
+                raise item
+
+#按阶段同步推进的调度器
+class LockstepActivation(mesa.time.BaseScheduler):
+    """
+    面向LLM的分阶段调度器，类似于mesa的StagedActivation。
+
+    每一步按stage_list依次执行各阶段（例如listen、talk、reflect、vote）。在每个阶段中：
+    1. 按随机顺序调用每个agent的阶段方法（例如agent.talk()），该方法只负责准备思维链并通过set_input设置输入，
+       返回一个思维链、思维链列表或None。
+    2. 收集所有agent的思维链，在一个事件循环中作为一批并发执行。
+    3. 所有思维链结束后（阶段屏障），按同样的顺序调用agent的"阶段名_done"方法（如果存在）处理输出，
+       参数为该agent在本阶段返回的内容。
+    以"model."开头的阶段调用模型自身的方法，例如"model.public_debate"。
+    这样每一步的LLM往返次数从 agent数 × 阶段数 次串行调用变为 阶段数 轮并发调用。
+    """
+    def __init__(self, model, stage_list, shuffle=True, max_concurrency=None):
+        """
+        初始化调度器。
+
+        参数:
+        - model: 所属的模型。
+        - stage_list: 阶段名称列表，按顺序执行。
+        - shuffle: 是否在每一步开始时随机打乱agent的顺序。
+        - max_concurrency: 每个阶段同时运行的思维链数量上限，默认为None表示不限制。
+        """
+        super().__init__(model)
+        self.stage_list = stage_list
+        self.shuffle = shuffle
+        self.max_concurrency = max_concurrency
+
+    @staticmethod
+    def get_chain_list(tar_res):
+        if tar_res is None:
+            return []
+        if isinstance(tar_res, (list, tuple)):
+            return list(tar_res)
+        return [tar_res]
+
+    def run_stage(self, stage, agent_list):
+        """
+        执行一个阶段：收集思维链，并发执行，然后处理输出。
+
+        抛出:
+        - ChainPoolError: 本阶段有思维链执行失败，失败的agent不会调用"阶段名_done"方法。
+        """
+        res_list = []
+        chain_list = []
+        for cur_agent in agent_list:
+            cur_res = getattr(cur_agent, stage)()
+            res_list.append(cur_res)
+            chain_list.extend(self.get_chain_list(cur_res))
+
+        #一次性并发执行本阶段的所有思维链
+        error_dict = {}
+        if len(chain_list) > 0:
+            chain_res = asyncio.run(arun_chains(chain_list, self.max_concurrency))
+            for cur_chain, cur_error in zip(chain_list, chain_res):
+                if isinstance(cur_error, BaseException):
+                    error_dict[id(cur_chain)] = (cur_chain, cur_error)
+
+        done_name = stage + "_done"
+        for cur_agent, cur_res in zip(agent_list, res_list):
+            if any(id(item) in error_dict for item in self.get_chain_list(cur_res)):
+                continue
+            if hasattr(cur_agent, done_name):
+                getattr(cur_agent, done_name)(cur_res)
+
+        if error_dict:
+            raise ChainPoolError(list(error_dict.values()))
+
+    def step(self):
+        """
+        依次执行所有阶段，每个阶段结束后时间前进1/阶段数，一步结束时时间为整数的步数。
+        """
+        if self.shuffle:
+            self._agents.shuffle(inplace=True)
+        agent_list = list(self._agents)
+        for i, stage in enumerate(self.stage_list):
+            if stage.startswith("model."):
+                getattr(self.model, stage[6:])()
+            else:
+                self.run_stage(stage, agent_list)
+            #由整数的步数和阶段序号计算时间，避免逐阶段累加浮点数产生误差
+            self.time = self.steps + (i + 1) / len(self.stage_list)
+        self.steps += 1
+        self.time = self.steps
+
 class VariableNetwork(mesa.space.NetworkGrid):
     def del_edge(self, source, target):
         self.G.remove_edge(source, target)
@@ -18,14 +180,22 @@ class VariableNetwork(mesa.space.NetworkGrid):
 
 #模型定义基类
 class ModelBase(mesa.Model):
-    def __init__(self, tar_graph, llm, context=None, prompt_path='./prompt/', memory_path=None, memory_num=10, reflect_file='reflect.txt', type_schedule=False):
+    def __init__(self, tar_graph, llm, context=None, prompt_path='./prompt/', memory_path=None, memory_num=10, reflect_file='reflect.txt', type_schedule=False, request_cache=None, coalesce_requests=False, embedding_cache=None, parallel_schedule=False, schedule_thread_num=8, stage_list=None, stage_concurrency=None, memory_write_behind=False, memory_partition=False, memory_store='chroma', memory_max_num=None, memory_ttl=None, memory_compact=False, memory_score_weights=None):
         super().__init__()
         #设置网络
         self.grid = VariableNetwork(tar_graph)
     
         #Agent调度器
+        if sum(1 for item in [type_schedule, parallel_schedule, stage_list] if item) > 1:
+            raise Exception("type_schedule, parallel_schedule and stage_list can not be used together")
         if type_schedule:
             self.schedule = OrederTypeActivation(self)
+        elif parallel_schedule:
+            #parallel_schedule为True时使用线程池，为'async'时使用asyncio执行agent的astep
+            self.schedule = ParallelActivation(self, schedule_thread_num, parallel_schedule == 'async')
+        elif stage_list:
+            #按阶段同步推进，每个阶段的思维链作为一批并发执行
+            self.schedule = LockstepActivation(self, stage_list, max_concurrency=stage_concurrency)
         else:
             self.schedule = mesa.time.RandomActivation(self)
 
@@ -44,14 +214,27 @@ class ModelBase(mesa.Model):
         self.llm = llm
 
         #设置prompt工厂
-        self.prompt_factory = PromptFactory(prompt_path, self.llm)
+        #request_cache为可选的RequestCache实例，用于跳过重复的prompt请求
+        #coalesce_requests开启后，同一时刻完全相同的prompt只调用一次LLM
+        self.prompt_factory = PromptFactory(prompt_path, self.llm, request_cache, coalesce_requests)
+        self.request_cache = request_cache
         
         #反思prompt
         reflect_prompt = self.prompt_factory.get_template(reflect_file)
 
 
         #设置memory工厂
-        self.memory_factory = MemeoryFactory(self.llm, memory_num, reflect_prompt, self, memory_path)
+        #embedding_cache为可选的EmbeddingCache实例，相同文本只生成一次向量
+        #memory_write_behind开启后，记忆项在每一步结束时批量写入；memory_partition开启后按agent分区存储
+        #memory_store为'numpy'时使用进程内的向量存储代替chromadb
+        #memory_max_num、memory_ttl、memory_compact为记忆的保留策略，在每一步结束时执行
+        #memory_score_weights为(时近性, 相关性, 重要性)权重，设置后检索按组合评分排序
+        self.memory_factory = MemeoryFactory(self.llm, memory_num, reflect_prompt, self, memory_path, embedding_cache, memory_write_behind, partition=memory_partition, store=memory_store,
+                                             max_memory=memory_max_num, memory_ttl=memory_ttl, compact_reflected=memory_compact,
+                                             score_weights=memory_score_weights)
+
+        #reflect_agents使用的线程池
+        self.reflect_pool = ThreadSend(schedule_thread_num)
 
         #初始化agent列表
         self.agent_list = []
@@ -86,6 +269,40 @@ class ModelBase(mesa.Model):
         
         #cur_thread.start_thread()
 
+    def reflect_agents(self, reflect_func=None, min_count=1, max_staleness=None, agent_list=None):
+        """
+        只让有新记忆项的agent进行反思，并发执行。
+
+        没有新记忆项（或未达到阈值）的agent会被跳过，从而节省对应的LLM调用。
+        反思中的记忆写入、日志等副作用在所有反思结束后按agent顺序执行。
+        也可以作为LockstepActivation的模型阶段使用，例如'model.reflect_agents'。
+
+        参数:
+        - reflect_func: 对单个agent执行反思的函数，默认为agent.memory.reflect_memory()，例如可以传入lambda agent: agent.reflect()。
+        - min_count: 触发反思的最少新记忆项数量。
+        - max_staleness: 最长不反思的步数，超过后只要有新记忆项就反思，为None时只按min_count判断。
+        - agent_list: 候选agent列表，默认为全部agent。
+
+        返回:
+        - 包含本次反思的agent数量（reflected）和跳过的数量（skipped）的字典。
+        """
+        if agent_list is None:
+            agent_list = self.agent_list
+        tar_list = self.memory_factory.select_reflect_agents(agent_list, min_count, max_staleness)
+        if reflect_func is None:
+            reflect_func = lambda tar_agent: tar_agent.memory.reflect_memory()
+
+        buffer_list = [EffectBuffer() for _ in tar_list]
+        def run_reflect(i):
+            with capture_effects(buffer_list[i]):
+                return reflect_func(tar_list[i])
+        res_list = self.reflect_pool.map(run_reflect, range(len(tar_list)), return_exceptions=True)
+        for cur_buffer in buffer_list:
+            cur_buffer.apply()
+        for item in res_list:
+            if isinstance(item, BaseException):
+                raise item
+        return {'reflected': len(tar_list), 'skipped': len(agent_list) - len(tar_list)}
 
     
     def step(self):
@@ -95,10 +312,18 @@ class ModelBase(mesa.Model):
         此方法推进模拟时间的一个步骤，并管理所有调度对象的更新。它不接受任何参数，也不返回任何有意义的值，
         主要是为了触发模拟过程的推进。
         
+        重写该方法时，应在步骤结束时调用self.memory_factory.flush_memory()和self.memory_factory.evict_memory()，
+        以写入写后缓冲区中的记忆项并执行记忆的保留策略；使用request_cache时还应调用self.request_cache.flush()。
+        
         Returns:
             int: 始终返回0，作为步骤执行的结果指示。
         """
         self.schedule.step()
+        self.memory_factory.flush_memory()
+        self.memory_factory.evict_memory()
+        #把本步积累的请求缓存提交到sqlite，避免运行结束时丢失
+        if self.request_cache:
+            self.request_cache.flush()
         return 0
     '''
     def write_log(self, tar_file_name):
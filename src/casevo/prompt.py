@@ -1,5 +1,6 @@
 import os
 from jinja2 import Environment, FileSystemLoader
+from casevo.util.single_flight import SingleFlight
 
 
 #prompt
@@ -38,6 +39,64 @@ class Prompt:
         返回:
         - 发送的提示信息的响应结果。
         """
+        prompt_text = self.__build_prompt__(ertra, agent, model)
+        #print(prompt_text)
+        #return ""
+        return self.factory.__send_message__(prompt_text)
+
+    async def asend_prompt(self, ertra=None, agent=None, model=None):
+        """
+        异步发送提示信息。
+
+        与send_prompt相同，但通过工厂的异步接口发送，可在同一个事件循环中并发大量请求。
+
+        参数:
+        - ertra: 额外参数，用于提供额外的定制信息，默认为None。
+        - agent: 代理对象，用于定制提示信息。
+        - model: 模型对象，用于定制提示信息。
+
+        返回:
+        - 发送的提示信息的响应结果。
+        """
+        prompt_text = self.__build_prompt__(ertra, agent, model)
+        return await self.factory.__asend_message__(prompt_text)
+
+    def send_prompt_batch(self, ertra_list, agent_list=None, model=None):
+        """
+        批量发送提示信息。
+
+        对每一组agent和额外参数分别渲染模板，然后通过工厂一次性批量发送。
+
+        参数:
+        - ertra_list: 额外参数列表，每个元素对应一条提示信息。
+        - agent_list: 代理对象列表，与ertra_list一一对应，默认为None表示不使用代理信息。
+        - model: 模型对象，所有提示信息共用。
+
+        返回:
+        - 与ertra_list顺序一致的响应列表，发送失败的位置为对应的异常对象。
+
+        抛出:
+        - Exception: 如果agent_list与ertra_list长度不一致。
+        """
+        prompt_list = self.__build_prompt_list__(ertra_list, agent_list, model)
+        return self.factory.__send_messages__(prompt_list)
+
+    async def asend_prompt_batch(self, ertra_list, agent_list=None, model=None):
+        """
+        send_prompt_batch的异步版本，返回结果约定相同。
+        """
+        prompt_list = self.__build_prompt_list__(ertra_list, agent_list, model)
+        return await self.factory.__asend_messages__(prompt_list)
+
+    def __build_prompt_list__(self, ertra_list, agent_list=None, model=None):
+        if agent_list is None:
+            agent_list = [None] * len(ertra_list)
+        elif len(agent_list) != len(ertra_list):
+            raise Exception("batch size not match")
+        return [self.__build_prompt__(ertra, agent, model) for ertra, agent in zip(ertra_list, agent_list)]
+
+    def __build_prompt__(self, ertra=None, agent=None, model=None):
+        #根据agent、model和额外参数渲染prompt文本
         tar_agent = {}
         if agent:
             tar_agent = {
@@ -51,17 +110,14 @@ class Prompt:
             }
              
 
-        prompt_text = self.__get_prompt__({
+        return self.__get_prompt__({
             "agent": tar_agent,
             "model": tar_model,
             "extra": ertra})
-        #print(prompt_text)
-        #return ""
-        return self.factory.__send_message__(prompt_text)
 
 #prompt 工厂类
 class PromptFactory:
-    def __init__(self, tar_folder, llm):
+    def __init__(self, tar_folder, llm, cache=None, coalesce=False):
         """
         初始化类的实例。
 
@@ -69,12 +125,18 @@ class PromptFactory:
 
         :param tar_folder: 模板文件夹的路径。必须是现有目录。
         :param llm: 语言模型的实例，用于处理自然语言。
+        :param cache: 可选的RequestCache实例。设置后，渲染结果完全相同的prompt将直接返回缓存的响应，不再调用LLM。
+        :param coalesce: 是否合并并发的相同请求。开启后，渲染结果完全相同的并发prompt只调用一次LLM并共享响应。
         """
         self.prompt_folder = tar_folder
         if not os.path.exists(tar_folder):
             raise Exception("prompt folder not exist")
         self.env = Environment(loader=FileSystemLoader(tar_folder))
         self.llm = llm
+        self.cache = cache
+        self.single_flight = None
+        if coalesce:
+            self.single_flight = SingleFlight()
 
     def get_template(self, tar_temp):
         """
@@ -101,7 +163,84 @@ class PromptFactory:
 
     def __send_message__(self, prompt_text):
         #print(prompt_text)
-        return self.llm.send_message(prompt_text)
-    
+        if self.cache:
+            response = self.cache.get_request_cache(prompt_text)
+            if response is not None:
+                return response
+        if self.single_flight:
+            return self.single_flight.do(SingleFlight.get_hash(prompt_text), self.__call_llm__, prompt_text)
+        return self.__call_llm__(prompt_text)
 
-    
+    async def __asend_message__(self, prompt_text):
+        if self.cache:
+            response = self.cache.get_request_cache(prompt_text)
+            if response is not None:
+                return response
+        if self.single_flight:
+            return await self.single_flight.ado(SingleFlight.get_hash(prompt_text), self.__acall_llm__, prompt_text)
+        return await self.__acall_llm__(prompt_text)
+
+    def __call_llm__(self, prompt_text):
+        response = self.llm.send_message(prompt_text)
+        self.__add_cache__(prompt_text, response)
+        return response
+
+    async def __acall_llm__(self, prompt_text):
+        response = await self.llm.asend_message(prompt_text)
+        self.__add_cache__(prompt_text, response)
+        return response
+
+    def __send_messages__(self, prompt_list):
+        res_list, miss_list = self.__get_batch_cache__(prompt_list)
+        if len(miss_list) > 0:
+            miss_res = self.llm.send_messages(miss_list)
+            self.__set_batch_result__(prompt_list, res_list, miss_list, miss_res)
+        return res_list
+
+    async def __asend_messages__(self, prompt_list):
+        res_list, miss_list = self.__get_batch_cache__(prompt_list)
+        if len(miss_list) > 0:
+            miss_res = await self.llm.asend_messages(miss_list)
+            self.__set_batch_result__(prompt_list, res_list, miss_list, miss_res)
+        return res_list
+
+    def __get_batch_cache__(self, prompt_list):
+        #查询批量请求的缓存，返回结果列表和需要发送的prompt列表
+        res_list = [None] * len(prompt_list)
+        miss_list = []
+        for i, prompt_text in enumerate(prompt_list):
+            if self.cache:
+                res_list[i] = self.cache.get_request_cache(prompt_text)
+            if res_list[i] is None:
+                miss_list.append(prompt_text)
+        if self.single_flight:
+            #批量内完全相同的prompt只发送一次
+            unique_list = list(dict.fromkeys(miss_list))
+            self.single_flight.add_stats(len(unique_list), len(miss_list) - len(unique_list))
+            miss_list = unique_list
+        return res_list, miss_list
+
+    def __set_batch_result__(self, prompt_list, res_list, miss_list, miss_res):
+        res_dict = {}
+        for prompt_text, response in zip(miss_list, miss_res):
+            res_dict[prompt_text] = response
+            self.__add_cache__(prompt_text, response)
+        for i, prompt_text in enumerate(prompt_list):
+            if res_list[i] is None:
+                res_list[i] = res_dict[prompt_text]
+
+    def __add_cache__(self, prompt_text, response):
+        #只缓存成功的文本响应
+        if self.cache and isinstance(response, str):
+            self.cache.add_request_cache(prompt_text, response)
+
+    def get_coalesce_stats(self):
+        """
+        获取请求合并的统计信息。
+
+        返回:
+        - 包含实际调用次数(calls)、节省的调用次数(shared)和进行中请求数量(in_flight)的字典；未开启合并时返回None。
+        """
+        if self.single_flight:
+            return self.single_flight.get_stats()
+        return None
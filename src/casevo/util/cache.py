@@ -1,44 +1,193 @@
-
+import atexit
 import sqlite3
 import hashlib
+import threading
+from collections import OrderedDict
 
 
 class RequestCache(object):
+    """
+    LLM请求的响应缓存。
+
+    由两层组成：内存中的LRU缓存（按缓存内容的字符数淘汰），以及可选的sqlite持久化缓存。
+    sqlite层使用WAL模式，每个线程使用独立的连接，写入先进入待提交队列，累计到commit_size条后批量提交。
+    剩余的条目在flush或close时提交，进程退出时会自动调用close。
+    """
     db_path = ""
-    db_conn = None
-    db_cursor = None
-    def __init__(self, tar_path):
+
+    def __init__(self, tar_path=None, memory_size=64 * 1024 * 1024, commit_size=32):
+        """
+        初始化请求缓存。
+
+        参数:
+        - tar_path: sqlite数据库文件路径，为None时只使用内存缓存。
+        - memory_size: 内存LRU缓存的容量（请求与响应的总字符数），超过后淘汰最久未使用的条目。
+        - commit_size: 待写入条目达到该数量时批量提交到sqlite。
+        """
         self.db_path = tar_path
-        self.db_conn = sqlite3.connect(self.db_path)
-        self.db_cursor = self.db_conn.cursor()
-        self.db_cursor.execute("""
-            CREATE TABLE IF NOT EXISTS request_cache (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                request_hash VARCHAR(70),
-                request_content TEXT,
-                response_content TEXT,
-            );
-        """)
-        self.db_conn.commit()
-    
+        self.memory_size = memory_size
+        self.commit_size = commit_size
+
+        #内存LRU层
+        self.memory_cache = OrderedDict()
+        self.memory_used = 0
+        #尚未提交到sqlite的条目
+        self.pending = {}
+
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.conn_list = []
+
+        #命中统计
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.db_path:
+            cur_conn = self.__get_conn__()
+            cur_conn.execute("""
+                CREATE TABLE IF NOT EXISTS request_cache (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    request_hash VARCHAR(70),
+                    request_content TEXT,
+                    response_content TEXT
+                );
+            """)
+            cur_conn.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_request_hash ON request_cache (request_hash);
+            """)
+            cur_conn.commit()
+            #进程退出时提交剩余的条目
+            atexit.register(self.close)
+
+    def __get_conn__(self):
+        #每个线程使用独立的sqlite连接
+        cur_conn = getattr(self.local, 'conn', None)
+        if cur_conn is None:
+            cur_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            cur_conn.execute("PRAGMA journal_mode=WAL;")
+            cur_conn.execute("PRAGMA synchronous=NORMAL;")
+            self.local.conn = cur_conn
+            with self.lock:
+                self.conn_list.append(cur_conn)
+        return cur_conn
+
+    @staticmethod
+    def get_hash(request_content):
+        return hashlib.sha256(request_content.encode()).hexdigest()
+
+    def __put_memory__(self, request_hash, request_content, response_content):
+        #写入LRU层并按容量淘汰，调用方需持有self.lock
+        if request_hash in self.memory_cache:
+            old_item = self.memory_cache.pop(request_hash)
+            self.memory_used -= len(old_item[0]) + len(old_item[1])
+        self.memory_cache[request_hash] = (request_content, response_content)
+        self.memory_used += len(request_content) + len(response_content)
+        while self.memory_used > self.memory_size and len(self.memory_cache) > 1:
+            _, old_item = self.memory_cache.popitem(last=False)
+            self.memory_used -= len(old_item[0]) + len(old_item[1])
+
     def add_request_cache(self, request_content, response_content):
-        request_hash = hashlib.sha256(request_content.encode()).hexdigest()
-        self.db_cursor.execute("""
-            INSERT INTO request_cache (request_hash, request_content, response_content)
-            VALUES (?, ?, ?)
-        """, (request_hash, request_content, response_content))
-        self.db_conn.commit()
-    
+        """
+        添加一条请求与响应的缓存。
+
+        参数:
+        - request_content: 请求文本。
+        - response_content: 响应文本。
+        """
+        request_hash = self.get_hash(request_content)
+        flush_flag = False
+        with self.lock:
+            self.__put_memory__(request_hash, request_content, response_content)
+            if self.db_path:
+                self.pending[request_hash] = (request_content, response_content)
+                flush_flag = len(self.pending) >= self.commit_size
+        if flush_flag:
+            self.flush()
+
     def get_request_cache(self, request_content):
-        request_hash = hashlib.sha256(request_content.encode()).hexdigest()
-        self.db_cursor.execute("""
-            SELECT request_content, response_content FROM request_cache WHERE request_hash = ?
-        """, (request_hash,))
-        res = self.db_cursor.fetchone()
-        if res and res[0] == request_content:
-            return res[1]
-        else:
-            return None
+        """
+        查询请求对应的缓存响应。
+
+        依次查询内存LRU层、待提交队列和sqlite层，sqlite层命中的条目会被放入LRU层。
+
+        参数:
+        - request_content: 请求文本。
+
+        返回:
+        - 缓存的响应文本，未命中时返回None。
+        """
+        request_hash = self.get_hash(request_content)
+        with self.lock:
+            item = self.memory_cache.get(request_hash)
+            if item is not None:
+                self.memory_cache.move_to_end(request_hash)
+            else:
+                item = self.pending.get(request_hash)
+            if item is not None and item[0] == request_content:
+                self.memory_hits += 1
+                return item[1]
+
+        res = None
+        if self.db_path:
+            res = self.__get_conn__().execute("""
+                SELECT request_content, response_content FROM request_cache WHERE request_hash = ?
+            """, (request_hash,)).fetchone()
+
+        with self.lock:
+            if res and res[0] == request_content:
+                self.disk_hits += 1
+                self.__put_memory__(request_hash, res[0], res[1])
+                return res[1]
+            self.misses += 1
+        return None
+
+    def flush(self):
+        """
+        将待提交的条目在一个事务中批量写入sqlite。
+        """
+        with self.lock:
+            if not self.pending:
+                return
+            tar_list = [(key, item[0], item[1]) for key, item in self.pending.items()]
+            self.pending = {}
+        cur_conn = self.__get_conn__()
+        with cur_conn:
+            cur_conn.executemany("""
+                INSERT OR REPLACE INTO request_cache (request_hash, request_content, response_content)
+                VALUES (?, ?, ?)
+            """, tar_list)
 
+    def get_stats(self):
+        """
+        获取缓存的统计信息。
 
+        返回:
+        - 包含命中数、未命中数、命中率和内存层大小的字典。
+        """
+        with self.lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                'hits': hits,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': hits / total if total > 0 else 0.0,
+                'memory_items': len(self.memory_cache),
+                'memory_used': self.memory_used,
+                'pending': len(self.pending)
+            }
 
+    def close(self):
+        """
+        提交所有待写入的条目并关闭全部sqlite连接。
+        """
+        if not self.db_path:
+            return
+        self.flush()
+        with self.lock:
+            for cur_conn in self.conn_list:
+                cur_conn.close()
+            self.conn_list = []
+        self.local = threading.local()
@@ -0,0 +1,64 @@
+import contextvars
+from contextlib import contextmanager
+
+
+#当前上下文中用于收集副作用的缓冲区
+effect_context = contextvars.ContextVar("casevo_effect_buffer", default=None)
+
+
+class EffectBuffer(object):
+    """
+    副作用缓冲区。
+
+    并行执行agent时，记忆写入、日志等有顺序要求的副作用先记录在各自agent的缓冲区中，
+    所有agent执行结束后再按确定的顺序依次执行。
+    """
+    def __init__(self):
+        self.effect_list = []
+
+    def add(self, func, args, kwargs):
+        self.effect_list.append((func, args, kwargs))
+
+    def apply(self):
+        """
+        按记录顺序执行缓冲区中的副作用，并清空缓冲区。
+        """
+        tar_list = self.effect_list
+        self.effect_list = []
+        for func, args, kwargs in tar_list:
+            func(*args, **kwargs)
+
+    def __len__(self):
+        return len(self.effect_list)
+
+
+def defer_effect(func, *args, **kwargs):
+    """
+    如果当前上下文正在收集副作用，则把func(*args, **kwargs)记录到缓冲区中。
+
+    参数:
+    - func: 副作用函数。
+    - args/kwargs: 函数参数。
+
+    返回:
+    - 已记录到缓冲区时返回True，此时调用方不应再执行该副作用；否则返回False。
+    """
+    cur_buffer = effect_context.get()
+    if cur_buffer is None:
+        return False
+    cur_buffer.add(func, args, kwargs)
+    return True
+
+
+@contextmanager
+def capture_effects(tar_buffer):
+    """
+    在with语句块内把defer_effect记录的副作用收集到tar_buffer中。
+
+    基于contextvars实现，线程池中的线程和asyncio任务各自拥有独立的缓冲区。
+    """
+    token = effect_context.set(tar_buffer)
+    try:
+        yield tar_buffer
+    finally:
+        effect_context.reset(token)
@@ -0,0 +1,174 @@
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from chromadb import EmbeddingFunction
+
+
+class EmbeddingCache(EmbeddingFunction):
+    """
+    按文本哈希缓存embedding的向量化函数。
+
+    可以直接作为chromadb的embedding_function使用。由两层组成：内存中的LRU缓存，以及可选的sqlite持久化缓存
+    （向量以float32二进制保存）。每次调用只把两层都未命中的文本去重后合并为一次send_embedding请求。
+    """
+    def __init__(self, tar_llm, tar_path=None, memory_size=100000):
+        """
+        初始化embedding缓存。
+
+        参数:
+        - tar_llm: LLM接口，未命中的文本通过其send_embedding生成向量。
+        - tar_path: sqlite数据库文件路径，为None时只使用内存缓存。
+        - memory_size: 内存LRU缓存保存的向量数量上限。
+        """
+        self.llm = tar_llm
+        self.db_path = tar_path
+        self.memory_size = memory_size
+
+        self.memory_cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.conn_list = []
+
+        #命中统计
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.db_path:
+            cur_conn = self.__get_conn__()
+            cur_conn.execute("""
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    text_hash VARCHAR(70) PRIMARY KEY,
+                    vector BLOB
+                );
+            """)
+            cur_conn.commit()
+
+    def __get_conn__(self):
+        #每个线程使用独立的sqlite连接
+        cur_conn = getattr(self.local, 'conn', None)
+        if cur_conn is None:
+            cur_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            cur_conn.execute("PRAGMA journal_mode=WAL;")
+            cur_conn.execute("PRAGMA synchronous=NORMAL;")
+            self.local.conn = cur_conn
+            with self.lock:
+                self.conn_list.append(cur_conn)
+        return cur_conn
+
+    @staticmethod
+    def get_hash(text):
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def __put_memory__(self, text_hash, vector):
+        #写入LRU层，调用方需持有self.lock
+        self.memory_cache[text_hash] = vector
+        self.memory_cache.move_to_end(text_hash)
+        while len(self.memory_cache) > self.memory_size:
+            self.memory_cache.popitem(last=False)
+
+    def __get_disk__(self, hash_list):
+        #批量从sqlite中读取向量
+        res = {}
+        cur_conn = self.__get_conn__()
+        for i in range(0, len(hash_list), 500):
+            cur_list = hash_list[i:i + 500]
+            rows = cur_conn.execute(
+                "SELECT text_hash, vector FROM embedding_cache WHERE text_hash IN (%s)" % ",".join("?" * len(cur_list)),
+                cur_list).fetchall()
+            for text_hash, vector in rows:
+                res[text_hash] = np.frombuffer(vector, dtype=np.float32)
+        return res
+
+    def __put_disk__(self, item_list):
+        cur_conn = self.__get_conn__()
+        with cur_conn:
+            cur_conn.executemany("INSERT OR REPLACE INTO embedding_cache (text_hash, vector) VALUES (?, ?)",
+                                 [(text_hash, vector.tobytes()) for text_hash, vector in item_list])
+
+    def get_embeddings(self, text_list):
+        """
+        获取一组文本的embedding。
+
+        参数:
+        - text_list: 文本列表。
+
+        返回:
+        - 形状为(len(text_list), dim)的float32矩阵，顺序与输入一致。
+        """
+        hash_list = [self.get_hash(text) for text in text_list]
+        vector_dict = {}
+        with self.lock:
+            for text_hash in hash_list:
+                vector = self.memory_cache.get(text_hash)
+                if vector is not None:
+                    self.memory_cache.move_to_end(text_hash)
+                    vector_dict[text_hash] = vector
+                    self.memory_hits += 1
+
+        #内存层未命中的文本（去重）
+        miss_dict = {}
+        for text_hash, text in zip(hash_list, text_list):
+            if text_hash not in vector_dict:
+                miss_dict[text_hash] = text
+
+        if self.db_path and len(miss_dict) > 0:
+            disk_dict = self.__get_disk__(list(miss_dict.keys()))
+            with self.lock:
+                for text_hash, vector in disk_dict.items():
+                    vector_dict[text_hash] = vector
+                    self.__put_memory__(text_hash, vector)
+                    del miss_dict[text_hash]
+                self.disk_hits += sum(1 for text_hash in hash_list if text_hash in disk_dict)
+
+        if len(miss_dict) > 0:
+            miss_hash = list(miss_dict.keys())
+            miss_vector = np.asarray(self.llm.send_embedding([miss_dict[item] for item in miss_hash]), dtype=np.float32)
+            new_list = list(zip(miss_hash, miss_vector))
+            with self.lock:
+                for text_hash, vector in new_list:
+                    vector_dict[text_hash] = vector
+                    self.__put_memory__(text_hash, vector)
+                self.misses += sum(1 for text_hash in hash_list if text_hash in miss_dict)
+            if self.db_path:
+                self.__put_disk__(new_list)
+
+        if len(hash_list) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([vector_dict[text_hash] for text_hash in hash_list])
+
+    def __call__(self, input):
+        #chromadb的embedding_function接口
+        return [vector.tolist() for vector in self.get_embeddings(list(input))]
+
+    def get_stats(self):
+        """
+        获取缓存的统计信息。
+
+        返回:
+        - 包含命中数、未命中数、命中率和内存层大小的字典。
+        """
+        with self.lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                'hits': hits,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': hits / total if total > 0 else 0.0,
+                'memory_items': len(self.memory_cache)
+            }
+
+    def close(self):
+        """
+        关闭全部sqlite连接。
+        """
+        with self.lock:
+            for cur_conn in self.conn_list:
+                cur_conn.close()
+            self.conn_list = []
+        self.local = threading.local()
@@ -0,0 +1,305 @@
+import time
+import threading
+import asyncio
+from collections import deque
+
+from chromadb import EmbeddingFunction
+
+from casevo.llm_interface import LLM_INTERFACE
+
+
+class ConcurrencyLimiter(object):
+    """
+    LLM请求的自适应并发控制器。
+
+    由两部分组成：
+    - 令牌桶：限制每秒发起的请求数（rate）以及允许的突发数量（burst）。
+    - AIMD并发窗口：请求成功且延迟未超过target_latency时窗口加性增长，请求失败或延迟超标时窗口乘性减小。
+
+    同步调用和异步调用共用同一个窗口和等待队列，等待者按先进先出的顺序获得并发额度。
+    """
+    def __init__(self, rate=None, burst=None, init_window=8, min_window=1, max_window=64,
+                 target_latency=None, increase=1.0, decrease=0.5):
+        """
+        初始化并发控制器。
+
+        参数:
+        - rate: 每秒允许发起的请求数，为None时不限速。
+        - burst: 令牌桶容量，默认为max(1, rate)。
+        - init_window: 初始并发窗口。
+        - min_window: 并发窗口下限。
+        - max_window: 并发窗口上限。
+        - target_latency: 目标延迟（秒），超过该延迟视为后端饱和；为None时只根据错误调整窗口。
+        - increase: 每个窗口周期内窗口的增长量。
+        - decrease: 出错或延迟超标时窗口的缩小比例。
+        """
+        self.rate = rate
+        self.burst = burst if burst else max(1.0, rate if rate else 1.0)
+        self.tokens = self.burst
+        self.token_time = time.monotonic()
+
+        self.window = float(init_window)
+        self.min_window = min_window
+        self.max_window = max_window
+        self.target_latency = target_latency
+        self.increase = increase
+        self.decrease = decrease
+        self.last_decrease = 0.0
+
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        #等待并发额度的请求
+        self.waiters = deque()
+        #等待令牌的请求数量
+        self.token_waiting = 0
+
+        #统计信息
+        self.success_num = 0
+        self.error_num = 0
+        self.latency = 0.0
+
+    def __reserve_token__(self):
+        #预约一个令牌，返回需要等待的秒数
+        if not self.rate:
+            return 0.0
+        with self.lock:
+            cur_time = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (cur_time - self.token_time) * self.rate)
+            self.token_time = cur_time
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def __wake__(self):
+        #把空出的并发额度按顺序交给等待者，调用方需持有self.lock
+        while self.waiters and self.in_flight < int(self.window):
+            waiter = self.waiters.popleft()
+            self.in_flight += 1
+            if isinstance(waiter, threading.Event):
+                waiter.set()
+            else:
+                loop, cur_future = waiter
+                loop.call_soon_threadsafe(self.__set_future__, cur_future)
+
+    def __set_future__(self, cur_future):
+        if cur_future.done():
+            #等待者已被取消，归还额度
+            self.__release_slot__()
+        else:
+            cur_future.set_result(None)
+
+    def __release_slot__(self):
+        with self.lock:
+            self.in_flight -= 1
+            self.__wake__()
+
+    def acquire(self):
+        """
+        获取一个并发额度，必要时阻塞等待令牌和窗口。
+        """
+        delay = self.__reserve_token__()
+        if delay > 0:
+            with self.lock:
+                self.token_waiting += 1
+            time.sleep(delay)
+            with self.lock:
+                self.token_waiting -= 1
+
+        with self.lock:
+            if not self.waiters and self.in_flight < int(self.window):
+                self.in_flight += 1
+                return
+            waiter = threading.Event()
+            self.waiters.append(waiter)
+        waiter.wait()
+
+    async def aacquire(self):
+        """
+        acquire的异步版本，等待期间不占用线程。
+        """
+        delay = self.__reserve_token__()
+        if delay > 0:
+            with self.lock:
+                self.token_waiting += 1
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                with self.lock:
+                    self.token_waiting -= 1
+
+        with self.lock:
+            if not self.waiters and self.in_flight < int(self.window):
+                self.in_flight += 1
+                return
+            loop = asyncio.get_running_loop()
+            cur_future = loop.create_future()
+            self.waiters.append((loop, cur_future))
+        try:
+            await cur_future
+        except asyncio.CancelledError:
+            if cur_future.done() and not cur_future.cancelled():
+                #额度已分配但任务被取消，归还额度
+                self.__release_slot__()
+            raise
+
+    def release(self, latency, error=False):
+        """
+        归还并发额度，并根据本次请求的结果调整并发窗口。
+
+        参数:
+        - latency: 本次请求的耗时（秒）。
+        - error: 本次请求是否失败。
+        """
+        with self.lock:
+            self.in_flight -= 1
+            cur_time = time.monotonic()
+            if error:
+                self.error_num += 1
+            else:
+                self.success_num += 1
+                self.latency = latency if self.latency == 0 else self.latency * 0.9 + latency * 0.1
+
+            if error or (self.target_latency and latency > self.target_latency):
+                #同一个延迟周期内只缩小一次，避免并发的失败使窗口骤降
+                if cur_time - self.last_decrease > max(latency, self.latency):
+                    self.window = max(self.min_window, self.window * self.decrease)
+                    self.last_decrease = cur_time
+            else:
+                self.window = min(self.max_window, self.window + self.increase / max(self.window, 1.0))
+            self.__wake__()
+
+    def call(self, func, *args):
+        """
+        在并发控制下执行func(*args)。
+        """
+        self.acquire()
+        start_time = time.monotonic()
+        try:
+            res = func(*args)
+        except Exception:
+            self.release(time.monotonic() - start_time, True)
+            raise
+        self.release(time.monotonic() - start_time)
+        return res
+
+    async def acall(self, coro_func, *args):
+        """
+        在并发控制下执行协程coro_func(*args)。
+        """
+        await self.aacquire()
+        start_time = time.monotonic()
+        try:
+            res = await coro_func(*args)
+        except Exception:
+            self.release(time.monotonic() - start_time, True)
+            raise
+        except BaseException:
+            #任务被取消，不计入错误
+            self.__release_slot__()
+            raise
+        self.release(time.monotonic() - start_time)
+        return res
+
+    def get_stats(self):
+        """
+        获取控制器的当前状态。
+
+        返回:
+        - 包含当前窗口、进行中的请求数、排队数量、平均延迟和成功/失败次数的字典。
+        """
+        with self.lock:
+            return {
+                'window': int(self.window),
+                'in_flight': self.in_flight,
+                'queue_depth': len(self.waiters) + self.token_waiting,
+                'latency': self.latency,
+                'success': self.success_num,
+                'error': self.error_num
+            }
+
+
+#按后端名称共享的并发控制器
+limiter_dict = {}
+limiter_lock = threading.Lock()
+
+def get_limiter(backend_name, **kwargs):
+    """
+    获取指定后端的并发控制器，不存在时使用kwargs创建。
+
+    同一个后端的多个LimitedLLM实例共用一个控制器，不同后端的额度互不影响。
+
+    参数:
+    - backend_name: 后端名称。
+    - kwargs: 创建ConcurrencyLimiter时使用的参数。
+
+    返回:
+    - ConcurrencyLimiter实例。
+    """
+    with limiter_lock:
+        if backend_name not in limiter_dict:
+            limiter_dict[backend_name] = ConcurrencyLimiter(**kwargs)
+        return limiter_dict[backend_name]
+
+
+class LimitedEmbedding(EmbeddingFunction):
+    """
+    LimitedLLM.get_lang_embedding返回的向量化函数。
+
+    可以直接作为chromadb的embedding_function使用，每次调用作为一次send_embedding请求经过embedding_limiter。
+    """
+    def __init__(self, tar_llm):
+        """
+        参数:
+        - tar_llm: LimitedLLM实例。
+        """
+        self.llm = tar_llm
+
+    def __call__(self, input):
+        return self.llm.embedding_limiter.call(self.llm.llm.send_embedding, list(input))
+
+
+class LimitedLLM(LLM_INTERFACE):
+    """
+    为LLM接口加上并发控制的包装类。
+
+    send_message、send_embedding、send_messages及其异步版本都会经过并发控制器，
+    一次批量请求占用一个并发额度。可以直接代替原始的LLM传给ModelBase。
+    """
+    def __init__(self, tar_llm, limiter=None, embedding_limiter=None):
+        """
+        初始化包装类。
+
+        参数:
+        - tar_llm: 被包装的LLM接口。
+        - limiter: 对话请求使用的ConcurrencyLimiter，默认新建一个。
+        - embedding_limiter: embedding请求使用的ConcurrencyLimiter，默认与limiter相同。
+        """
+        self.llm = tar_llm
+        self.limiter = limiter if limiter else ConcurrencyLimiter()
+        self.embedding_limiter = embedding_limiter if embedding_limiter else self.limiter
+
+    def send_message(self, prompt, json_flag=False):
+        return self.limiter.call(self.llm.send_message, prompt, json_flag)
+
+    def send_embedding(self, text_list):
+        return self.embedding_limiter.call(self.llm.send_embedding, text_list)
+
+    def get_lang_embedding(self):
+        #返回经过embedding_limiter的向量化函数，供Memory和Background的集合使用
+        return LimitedEmbedding(self)
+
+    async def asend_message(self, prompt, json_flag=False):
+        return await self.limiter.acall(self.llm.asend_message, prompt, json_flag)
+
+    async def asend_embedding(self, text_list):
+        return await self.embedding_limiter.acall(self.llm.asend_embedding, text_list)
+
+    def send_messages(self, prompt_list, json_flag=False):
+        return self.limiter.call(self.llm.send_messages, prompt_list, json_flag)
+
+    async def asend_messages(self, prompt_list, json_flag=False):
+        return await self.limiter.acall(self.llm.asend_messages, prompt_list, json_flag)
+
+    def get_stats(self):
+        return self.limiter.get_stats()
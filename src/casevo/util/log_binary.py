@@ -0,0 +1,288 @@
+import os
+import json
+import mmap
+import struct
+
+import numpy as np
+
+
+#文件头：魔数与版本号，共16字节
+FILE_MAGIC = b'CASEVOLG'
+FILE_VERSION = 2
+FILE_HEADER = struct.Struct('<8sI4x')
+#块头：魔数、记录数量、块元数据长度、块总长度
+CHUNK_MAGIC = b'CLCH'
+CHUNK_HEADER = struct.Struct('<4sIIQ')
+#文件尾：索引的起始位置与魔数
+FOOTER_MAGIC = b'CLFOOTER'
+FOOTER_TRAILER = struct.Struct('<Q8s')
+
+
+def pad_size(size):
+    #补齐到8字节，保证各列在映射内存中对齐
+    return (8 - size % 8) % 8
+
+
+def to_ts(value):
+    #整数的ts还原为int，其余保持float，与写入前的值一致
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+class BinaryLogSink(object):
+    """
+    分块的二进制列式日志文件。
+
+    记录按块写入，每块内ts保存为float64数组，owner和type保存为块内字典编码的int32数组，
+    item序列化为JSON后按偏移数组拼接保存。文件末尾的索引记录每个块的位置、ts范围以及包含的owner和type，
+    读取时可以跳过不相关的块。可以作为TotLog的sink使用。
+    """
+    def __init__(self, tar_path, chunk_size=4096):
+        """
+        打开日志文件，文件已存在时在原有的块之后继续追加。
+
+        参数:
+        - tar_path: 日志文件路径。
+        - chunk_size: 每块的记录数量。
+        """
+        self.tar_path = tar_path
+        self.chunk_size = chunk_size
+        self.record_list = []
+        self.chunk_list = []
+        if os.path.exists(tar_path) and os.path.getsize(tar_path) > 0:
+            #读取已有的索引，从索引位置（或最后一个完整的块之后）继续写入
+            with BinaryLogReader(tar_path) as cur_reader:
+                self.chunk_list = list(cur_reader.chunk_list)
+                end_pos = cur_reader.data_end
+            self.file = open(tar_path, 'r+b')
+            self.file.truncate(end_pos)
+            self.file.seek(end_pos)
+        else:
+            self.file = open(tar_path, 'wb')
+            self.file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION))
+        self.footer_written = False
+
+    def write(self, record_list):
+        """
+        添加记录。
+
+        参数:
+        - record_list: 记录列表，每条记录包含ts、owner、type和item。
+        """
+        self.record_list.extend(record_list)
+        while len(self.record_list) >= self.chunk_size:
+            self.__write_chunk__(self.record_list[:self.chunk_size])
+            self.record_list = self.record_list[self.chunk_size:]
+
+    def __write_chunk__(self, record_list):
+        num = len(record_list)
+        owner_list = []
+        owner_dict = {}
+        type_list = []
+        type_dict = {}
+        ts_data = np.empty(num, dtype=np.float64)
+        owner_data = np.empty(num, dtype=np.int32)
+        type_data = np.empty(num, dtype=np.int32)
+        offset_data = np.empty(num + 1, dtype=np.int64)
+        offset_data[0] = 0
+        blob_list = []
+        for i, item in enumerate(record_list):
+            ts_data[i] = item['ts']
+            cur_owner = str(item['owner'])
+            if cur_owner not in owner_dict:
+                owner_dict[cur_owner] = len(owner_list)
+                owner_list.append(cur_owner)
+            owner_data[i] = owner_dict[cur_owner]
+            cur_type = str(item['type'])
+            if cur_type not in type_dict:
+                type_dict[cur_type] = len(type_list)
+                type_list.append(cur_type)
+            type_data[i] = type_dict[cur_type]
+            cur_blob = json.dumps(item['item'], ensure_ascii=False).encode('utf-8')
+            blob_list.append(cur_blob)
+            offset_data[i + 1] = offset_data[i] + len(cur_blob)
+
+        meta = json.dumps({'owners': owner_list, 'types': type_list}, ensure_ascii=False).encode('utf-8')
+        meta += b'\0' * pad_size(CHUNK_HEADER.size + len(meta))
+        blob = b''.join(blob_list)
+        #块头与元数据补齐到8字节后，ts/owner/type/偏移各列依次对齐，块末尾再补齐
+        body = b''.join([meta, ts_data.tobytes(), owner_data.tobytes(), type_data.tobytes(), offset_data.tobytes(), blob])
+        body += b'\0' * pad_size(CHUNK_HEADER.size + len(body))
+        chunk_start = self.file.tell()
+        self.file.write(CHUNK_HEADER.pack(CHUNK_MAGIC, num, len(meta), CHUNK_HEADER.size + len(body)))
+        self.file.write(body)
+        self.chunk_list.append({
+            'offset': chunk_start,
+            'num': num,
+            'ts_min': float(ts_data.min()),
+            'ts_max': float(ts_data.max()),
+            'owners': owner_list,
+            'types': type_list
+        })
+
+    def flush(self):
+        """
+        把未满一块的记录写为一个块，并刷新到磁盘。
+        """
+        if len(self.record_list) > 0:
+            self.__write_chunk__(self.record_list)
+            self.record_list = []
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        """
+        写入剩余的记录和文件尾的索引，关闭文件。
+        """
+        if self.footer_written:
+            return
+        if len(self.record_list) > 0:
+            self.__write_chunk__(self.record_list)
+            self.record_list = []
+        footer_start = self.file.tell()
+        self.file.write(json.dumps({'chunks': self.chunk_list}, ensure_ascii=False).encode('utf-8'))
+        self.file.write(FOOTER_TRAILER.pack(footer_start, FOOTER_MAGIC))
+        self.file.close()
+        self.footer_written = True
+
+    def query(self, owner=None, type=None, ts_range=None):
+        """
+        按条件读取已写入的记录，参数与BinaryLogReader.iter_records相同。
+        """
+        self.flush()
+        with BinaryLogReader(self.tar_path) as cur_reader:
+            return list(cur_reader.iter_records(owner, type, ts_range))
+
+
+class BinaryLogReader(object):
+    """
+    BinaryLogSink日志文件的读取器。
+
+    通过mmap映射文件，列数据直接在映射内存上构造numpy数组，只解码满足条件的记录的item。
+    文件没有正常关闭（缺少文件尾索引）时，顺序扫描块头重建索引。
+    """
+    def __init__(self, tar_path):
+        self.tar_path = tar_path
+        self.file = open(tar_path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = FILE_HEADER.unpack_from(self.map, 0)
+        if magic != FILE_MAGIC:
+            raise Exception("not a casevo binary log: %s" % tar_path)
+        if version != FILE_VERSION:
+            raise Exception("unsupported binary log version %d: %s" % (version, tar_path))
+        self.chunk_list, self.data_end = self.__load_index__()
+
+    def __load_index__(self):
+        size = len(self.map)
+        if size >= FILE_HEADER.size + FOOTER_TRAILER.size:
+            footer_start, magic = FOOTER_TRAILER.unpack_from(self.map, size - FOOTER_TRAILER.size)
+            if magic == FOOTER_MAGIC:
+                footer = json.loads(bytes(self.map[footer_start:size - FOOTER_TRAILER.size]).decode('utf-8'))
+                return footer['chunks'], footer_start
+        #没有索引时顺序扫描，忽略末尾不完整的块
+        chunk_list = []
+        pos = FILE_HEADER.size
+        while pos + CHUNK_HEADER.size <= size:
+            magic, num, meta_len, chunk_len = CHUNK_HEADER.unpack_from(self.map, pos)
+            if magic != CHUNK_MAGIC or pos + chunk_len > size:
+                break
+            meta = self.__get_meta__(pos, meta_len)
+            ts_data = np.frombuffer(self.map, dtype=np.float64, count=num, offset=pos + CHUNK_HEADER.size + meta_len)
+            chunk_list.append({
+                'offset': pos,
+                'num': num,
+                'ts_min': float(ts_data.min()),
+                'ts_max': float(ts_data.max()),
+                'owners': meta['owners'],
+                'types': meta['types']
+            })
+            pos += chunk_len
+        return chunk_list, pos
+
+    def __get_meta__(self, pos, meta_len):
+        start = pos + CHUNK_HEADER.size
+        return json.loads(bytes(self.map[start:start + meta_len]).rstrip(b'\0').decode('utf-8'))
+
+    def __get_columns__(self, tar_chunk):
+        #块内各列在映射内存上的数组
+        pos = tar_chunk['offset']
+        num = tar_chunk['num']
+        _, _, meta_len, _ = CHUNK_HEADER.unpack_from(self.map, pos)
+        start = pos + CHUNK_HEADER.size + meta_len
+        ts_data = np.frombuffer(self.map, dtype=np.float64, count=num, offset=start)
+        start += 8 * num
+        owner_data = np.frombuffer(self.map, dtype=np.int32, count=num, offset=start)
+        start += 4 * num
+        type_data = np.frombuffer(self.map, dtype=np.int32, count=num, offset=start)
+        start += 4 * num
+        offset_data = np.frombuffer(self.map, dtype=np.int64, count=num + 1, offset=start)
+        start += 8 * (num + 1)
+        return ts_data, owner_data, type_data, offset_data, start
+
+    def __len__(self):
+        return sum(item['num'] for item in self.chunk_list)
+
+    def iter_records(self, owner=None, type=None, ts_range=None):
+        """
+        按条件遍历记录，不满足条件的块直接跳过。
+
+        参数:
+        - owner: 只返回该owner的记录，例如'agent_0'或'model'；也可以是owner列表。
+        - type: 只返回该类型的记录；也可以是类型列表。
+        - ts_range: (开始, 结束)，只返回ts在该闭区间内的记录，任一端为None表示不限制。
+
+        返回:
+        - 生成器，依次返回{'ts', 'owner', 'type', 'item'}字典。
+        """
+        owner_set = None if owner is None else set([owner] if isinstance(owner, str) else owner)
+        type_set = None if type is None else set([type] if isinstance(type, str) else type)
+        ts_start, ts_end = ts_range if ts_range is not None else (None, None)
+        for tar_chunk in self.chunk_list:
+            if ts_start is not None and tar_chunk['ts_max'] < ts_start:
+                continue
+            if ts_end is not None and tar_chunk['ts_min'] > ts_end:
+                continue
+            owner_code = None
+            if owner_set is not None:
+                owner_code = [i for i, item in enumerate(tar_chunk['owners']) if item in owner_set]
+                if len(owner_code) == 0:
+                    continue
+            type_code = None
+            if type_set is not None:
+                type_code = [i for i, item in enumerate(tar_chunk['types']) if item in type_set]
+                if len(type_code) == 0:
+                    continue
+
+            ts_data, owner_data, type_data, offset_data, blob_start = self.__get_columns__(tar_chunk)
+            mask = np.ones(tar_chunk['num'], dtype=bool)
+            if ts_start is not None:
+                mask &= ts_data >= ts_start
+            if ts_end is not None:
+                mask &= ts_data <= ts_end
+            if owner_code is not None:
+                mask &= np.isin(owner_data, owner_code)
+            if type_code is not None:
+                mask &= np.isin(type_data, type_code)
+            for i in np.flatnonzero(mask):
+                start = blob_start + int(offset_data[i])
+                end = blob_start + int(offset_data[i + 1])
+                yield {
+                    'ts': to_ts(ts_data[i]),
+                    'owner': tar_chunk['owners'][owner_data[i]],
+                    'type': tar_chunk['types'][type_data[i]],
+                    'item': json.loads(bytes(self.map[start:end]).decode('utf-8'))
+                }
+
+    def close(self):
+        try:
+            self.map.close()
+        except BufferError:
+            #仍有数组引用映射内存时，由垃圾回收释放
+            pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,67 @@
+import itertools
+import threading
+from collections import deque
+
+
+class ThreadLogBuffer(object):
+    """
+    按线程划分的日志缓冲区。
+
+    每个线程把记录追加到自己的deque中，追加时不需要加锁；每条记录带有全局递增的序号。
+    drain时取出所有线程中的记录，按(ts, 序号)稳定排序后返回，同一时间步内保持追加的先后顺序。
+    """
+    def __init__(self):
+        self.local = threading.local()
+        #(线程, deque)列表，注册新线程时加锁
+        self.buffer_list = []
+        self.lock = threading.Lock()
+        #drain只能有一个线程执行
+        self.drain_lock = threading.Lock()
+        self.counter = itertools.count(1)
+        self.drain_num = 0
+
+    def append(self, tar_key, tar_item):
+        """
+        追加一条记录。
+
+        参数:
+        - tar_key: 记录的去向，drain时原样返回。
+        - tar_item: 日志记录，需要包含'ts'。
+
+        返回:
+        - 记录的序号，从1开始。
+        """
+        cur_buffer = getattr(self.local, 'buffer', None)
+        if cur_buffer is None:
+            cur_buffer = deque()
+            with self.lock:
+                self.buffer_list.append((threading.current_thread(), cur_buffer))
+            self.local.buffer = cur_buffer
+        seq = next(self.counter)
+        cur_buffer.append((tar_item['ts'], seq, tar_key, tar_item))
+        return seq
+
+    def drain(self):
+        """
+        取出所有线程中已追加的记录。
+
+        返回:
+        - 按(ts, 序号)排序的(tar_key, tar_item)列表。
+        """
+        with self.drain_lock:
+            with self.lock:
+                tar_list = list(self.buffer_list)
+            res = []
+            for _, cur_buffer in tar_list:
+                for _ in range(len(cur_buffer)):
+                    res.append(cur_buffer.popleft())
+            #移除已结束线程的空缓冲区
+            with self.lock:
+                self.buffer_list = [item for item in self.buffer_list if item[0].is_alive() or len(item[1]) > 0]
+            self.drain_num += len(res)
+        res.sort(key=lambda item: (item[0], item[1]))
+        return [(item[2], item[3]) for item in res]
+
+    def get_pending_num(self):
+        #尚未取出的记录数量（近似值）
+        return sum(len(item[1]) for item in list(self.buffer_list))
@@ -0,0 +1,145 @@
+import json
+import sqlite3
+import threading
+
+
+class SqliteLogSink(object):
+    """
+    基于sqlite的日志存储，可以作为TotLog的sink使用。
+
+    记录先在内存中积累，达到batch_size条后在一个事务中批量插入。表上有(owner, ts)和(type, ts)索引，
+    item以JSON文本保存，可以在SQL中通过JSON1函数（例如json_extract）查询。
+    每个线程使用独立的连接，写入在同一时刻只有一个线程执行。
+    """
+    def __init__(self, tar_path, batch_size=1000):
+        """
+        打开（或创建）日志数据库。
+
+        参数:
+        - tar_path: sqlite数据库文件路径。
+        - batch_size: 积累多少条记录后插入数据库。
+        """
+        self.db_path = tar_path
+        self.batch_size = batch_size
+        self.record_list = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.conn_list = []
+
+        cur_conn = self.__get_conn__()
+        cur_conn.execute("""
+            CREATE TABLE IF NOT EXISTS log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts INTEGER,
+                owner TEXT,
+                type TEXT,
+                item TEXT
+            );
+        """)
+        cur_conn.execute("CREATE INDEX IF NOT EXISTS idx_log_owner_ts ON log (owner, ts);")
+        cur_conn.execute("CREATE INDEX IF NOT EXISTS idx_log_type_ts ON log (type, ts);")
+        cur_conn.commit()
+
+    def __get_conn__(self):
+        #每个线程使用独立的sqlite连接
+        cur_conn = getattr(self.local, 'conn', None)
+        if cur_conn is None:
+            cur_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            cur_conn.execute("PRAGMA journal_mode=WAL;")
+            cur_conn.execute("PRAGMA synchronous=NORMAL;")
+            self.local.conn = cur_conn
+            with self.lock:
+                self.conn_list.append(cur_conn)
+        return cur_conn
+
+    def write(self, record_list):
+        """
+        添加记录。
+
+        参数:
+        - record_list: 记录列表，每条记录包含ts、owner、type和item。
+        """
+        with self.lock:
+            self.record_list.extend(record_list)
+            if len(self.record_list) < self.batch_size:
+                return
+            tar_list = self.record_list
+            self.record_list = []
+            self.__insert__(tar_list)
+
+    def __insert__(self, tar_list):
+        #在一个事务中批量插入，调用方需持有self.lock
+        if len(tar_list) == 0:
+            return
+        cur_conn = self.__get_conn__()
+        with cur_conn:
+            cur_conn.executemany(
+                "INSERT INTO log (ts, owner, type, item) VALUES (?, ?, ?, ?)",
+                [(item['ts'], str(item['owner']), str(item['type']), json.dumps(item['item'], ensure_ascii=False)) for item in tar_list]
+            )
+
+    def flush(self):
+        """
+        插入所有积累的记录。
+        """
+        with self.lock:
+            tar_list = self.record_list
+            self.record_list = []
+            self.__insert__(tar_list)
+
+    def query(self, owner=None, type=None, ts_range=None):
+        """
+        按条件查询记录，结果按ts和写入顺序排列。
+
+        参数:
+        - owner: 只返回该owner的记录，例如'agent_0'或'model'；也可以是owner列表。
+        - type: 只返回该类型的记录；也可以是类型列表。
+        - ts_range: (开始, 结束)，只返回ts在该闭区间内的记录，任一端为None表示不限制。
+
+        返回:
+        - {'ts', 'owner', 'type', 'item'}字典的列表。
+        """
+        self.flush()
+        cond_list = []
+        param_list = []
+        for name, value in [('owner', owner), ('type', type)]:
+            if value is None:
+                continue
+            value_list = [value] if isinstance(value, str) else list(value)
+            cond_list.append("%s IN (%s)" % (name, ",".join("?" * len(value_list))))
+            param_list.extend(value_list)
+        if ts_range is not None:
+            if ts_range[0] is not None:
+                cond_list.append("ts >= ?")
+                param_list.append(ts_range[0])
+            if ts_range[1] is not None:
+                cond_list.append("ts <= ?")
+                param_list.append(ts_range[1])
+        sql = "SELECT ts, owner, type, item FROM log"
+        if len(cond_list) > 0:
+            sql += " WHERE " + " AND ".join(cond_list)
+        sql += " ORDER BY ts, id"
+        rows = self.__get_conn__().execute(sql, param_list).fetchall()
+        return [{'ts': ts, 'owner': cur_owner, 'type': cur_type, 'item': json.loads(item)} for ts, cur_owner, cur_type, item in rows]
+
+    def execute(self, sql, params=()):
+        """
+        在日志数据库上执行只读SQL，例如
+        "SELECT owner, json_extract(item, '$.vote') FROM log WHERE type = 'vote' AND ts = 5"。
+
+        返回:
+        - 查询结果的行列表。
+        """
+        self.flush()
+        return self.__get_conn__().execute(sql, params).fetchall()
+
+    def close(self):
+        """
+        插入剩余的记录并关闭所有连接。
+        """
+        self.flush()
+        with self.lock:
+            for cur_conn in self.conn_list:
+                cur_conn.close()
+            self.conn_list = []
+        self.local = threading.local()
@@ -0,0 +1,103 @@
+import hashlib
+import threading
+import asyncio
+from concurrent.futures import Future
+
+
+class SingleFlight(object):
+    """
+    合并并发的相同请求。
+
+    同一个key在执行期间，后续到达的调用不会再次执行，而是等待正在执行的调用并共享其结果（或异常）。
+    同步调用和异步调用共用同一组进行中的请求，因此线程和事件循环中的相同请求也可以互相合并。
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        #进行中的请求：key -> Future
+        self.flights = {}
+        #实际执行的调用次数
+        self.calls = 0
+        #被合并（节省）的调用次数
+        self.shared = 0
+
+    @staticmethod
+    def get_hash(text):
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def __join__(self, key):
+        #加入进行中的请求，返回(Future, 是否为执行者)
+        with self.lock:
+            cur_future = self.flights.get(key)
+            if cur_future is not None:
+                self.shared += 1
+                return cur_future, False
+            cur_future = Future()
+            self.flights[key] = cur_future
+            self.calls += 1
+            return cur_future, True
+
+    def __leave__(self, key):
+        with self.lock:
+            del self.flights[key]
+
+    def do(self, key, func, *args):
+        """
+        以合并的方式执行func(*args)。
+
+        参数:
+        - key: 请求的标识，相同key的并发调用将被合并。
+        - func: 实际执行的函数。
+        - args: 函数参数。
+
+        返回:
+        - func的返回值。执行失败时，所有等待者都会抛出同一个异常。
+        """
+        cur_future, leader = self.__join__(key)
+        if not leader:
+            return cur_future.result()
+        try:
+            res = func(*args)
+            cur_future.set_result(res)
+            return res
+        except BaseException as e:
+            cur_future.set_exception(e)
+            raise
+        finally:
+            self.__leave__(key)
+
+    async def ado(self, key, coro_func, *args):
+        """
+        do的异步版本，coro_func(*args)需返回一个可等待对象。
+        """
+        cur_future, leader = self.__join__(key)
+        if not leader:
+            return await asyncio.wrap_future(cur_future)
+        try:
+            res = await coro_func(*args)
+            cur_future.set_result(res)
+            return res
+        except BaseException as e:
+            cur_future.set_exception(e)
+            raise
+        finally:
+            self.__leave__(key)
+
+    def add_stats(self, calls=0, shared=0):
+        #记录在调用方合并的请求（例如批量请求内部的去重）
+        with self.lock:
+            self.calls += calls
+            self.shared += shared
+
+    def get_stats(self):
+        """
+        获取合并统计信息。
+
+        返回:
+        - 包含实际调用次数、节省的调用次数和当前进行中请求数量的字典。
+        """
+        with self.lock:
+            return {
+                'calls': self.calls,
+                'shared': self.shared,
+                'in_flight': len(self.flights)
+            }
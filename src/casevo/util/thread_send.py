@@ -1,36 +1,130 @@
-import threading
-import queue
-import time
+import concurrent.futures
+
 
 class ThreadSend:
-    def __init__(self, thread_num=8):
-        self.status = 'init' 
-        self.task_list =  queue.Queue()
+    """
+    可复用的多线程任务执行器。
+
+    线程在创建时启动并在多次调用之间复用，任务提交后立即开始执行，没有额外的等待。
+    每个任务返回一个Future，可以通过result()获取返回值，通过exception()获取执行时抛出的异常。
+    """
+    def __init__(self, thread_num=8, thread_name="thread_send"):
+        """
+        初始化执行器。
+
+        参数:
+        - thread_num: 线程数量。
+        - thread_name: 线程名称的前缀。
+        """
+        self.status = 'init'
         self.threads_num = thread_num
-        #self.task_num = 0
-    def add_task(self, func, args):
-        self.task_list.put([func, args])
-        #self.task_num += 1
-    
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=thread_num, thread_name_prefix=thread_name)
+        #已提交但尚未等待的任务
+        self.task_list = []
+
+    def add_task(self, func, args=()):
+        """
+        提交一个任务。
+
+        参数:
+        - func: 任务函数。
+        - args: 任务函数的参数元组。
+
+        返回:
+        - Future对象，可通过result()获取返回值或exception()获取异常。
+        """
+        cur_future = self.executor.submit(func, *args)
+        self.task_list.append(cur_future)
+        return cur_future
+
+    def cancel(self):
+        """
+        取消所有已提交但尚未开始执行的任务。
+
+        返回:
+        - 被取消的任务数量。
+        """
+        return sum(1 for item in self.task_list if item.cancel())
+
     def get_task_num(self):
-        return self.task_list.qsize()
-
-    def worker(self):
-        while True:
-            try:
-                task = self.task_list.get(timeout=5)
-                task[0](*task[1])
-                self.task_list.task_done()
-                time.sleep(5)
-                if self.task_list.empty():
-                    break
-            except:
-                break
-    
-    def start_thread(self):
-        self.thread_list = []
-        for i in range(self.threads_num):
-            t = threading.Thread(target=self.worker)
-            t.start()
-            self.thread_list.append(t)
-        self.task_list.join()
\ No newline at end of file
+        #尚未完成的任务数量
+        return sum(1 for item in self.task_list if not item.done())
+
+    def wait(self, timeout=None):
+        """
+        等待所有已提交的任务执行结束。
+
+        参数:
+        - timeout: 最长等待时间（秒），默认为None表示一直等待。
+
+        返回:
+        - 与提交顺序一致的结果列表，执行失败的位置为对应的异常。
+
+        抛出:
+        - TimeoutError: 超时仍有任务未完成，此时尚未开始的任务会被取消。
+        """
+        tar_list = self.task_list
+        self.task_list = []
+        done, not_done = concurrent.futures.wait(tar_list, timeout=timeout)
+        if not_done:
+            for cur_future in not_done:
+                cur_future.cancel()
+            raise TimeoutError("thread send timeout, %d tasks unfinished" % len(not_done))
+        return [self.__get_result__(item) for item in tar_list]
+
+    @staticmethod
+    def __get_result__(cur_future):
+        if cur_future.cancelled():
+            return concurrent.futures.CancelledError()
+        cur_error = cur_future.exception()
+        if cur_error is not None:
+            return cur_error
+        return cur_future.result()
+
+    def start_thread(self, timeout=None):
+        """
+        等待通过add_task提交的任务全部执行结束，与wait相同。
+        """
+        return self.wait(timeout)
+
+    def map(self, func, tar_list, timeout=None, return_exceptions=False):
+        """
+        对tar_list中的每个元素并行执行func，例如对model.agent_list中的每个agent执行reflect。
+
+        参数:
+        - func: 任务函数，接收一个元素作为参数。
+        - tar_list: 元素列表。
+        - timeout: 最长等待时间（秒），默认为None表示一直等待。
+        - return_exceptions: 为True时失败的位置返回异常对象，否则抛出第一个异常。
+
+        返回:
+        - 与tar_list顺序一致的结果列表。
+        """
+        future_list = [self.executor.submit(func, item) for item in tar_list]
+        done, not_done = concurrent.futures.wait(future_list, timeout=timeout)
+        if not_done:
+            for cur_future in not_done:
+                cur_future.cancel()
+            raise TimeoutError("thread send timeout, %d tasks unfinished" % len(not_done))
+        res = [self.__get_result__(item) for item in future_list]
+        if not return_exceptions:
+            for item in res:
+                if isinstance(item, BaseException):
+                    raise item
+        return res
+
+    def shutdown(self, wait=True, cancel=False):
+        """
+        关闭执行器。
+
+        参数:
+        - wait: 是否等待正在执行的任务结束。
+        - cancel: 是否取消尚未开始的任务。
+        """
+        self.executor.shutdown(wait=wait, cancel_futures=cancel)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
@@ -1,6 +1,121 @@
 import json
 import copy
 import os
+import threading
+from casevo.util.effect import defer_effect
+from casevo.util.log_buffer import ThreadLogBuffer
+
+
+def iter_json_array(tar_path, chunk_size=1 << 20):
+    """
+    逐条读取JSON数组文件中的元素，每次只读取chunk_size个字符，不把整个文件载入内存。
+    """
+    decoder = json.JSONDecoder()
+    with open(tar_path, 'r', encoding='utf-8') as f:
+        buf = ''
+        pos = 0
+        started = False
+        eof = False
+        while True:
+            #跳过空白和分隔符
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buf):
+                if eof:
+                    raise Exception("unexpected end of json array: %s" % tar_path)
+                cur_data = f.read(chunk_size)
+                eof = len(cur_data) == 0
+                buf = buf[pos:] + cur_data
+                pos = 0
+                continue
+            if not started:
+                if buf[pos] != '[':
+                    raise Exception("not a json array: %s" % tar_path)
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                #元素不完整，继续读取
+                if eof:
+                    raise
+                cur_data = f.read(chunk_size)
+                eof = len(cur_data) == 0
+                buf = buf[pos:] + cur_data
+                pos = 0
+                continue
+            pos = end
+            yield item
+
+
+def read_last_item(tar_path, chunk_size=4096):
+    """
+    从文件末尾读取JSON数组的最后一个元素，数组为空时返回None。
+    """
+    decoder = json.JSONDecoder()
+    with open(tar_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        file_size = f.tell()
+        read_size = min(chunk_size, file_size)
+        while True:
+            f.seek(file_size - read_size)
+            tail = f.read(read_size).decode('utf-8', errors='ignore').rstrip()
+            if not tail.endswith(']'):
+                raise Exception("not a json array: %s" % tar_path)
+            tail = tail[:-1].rstrip()
+            if tail.endswith('['):
+                return None
+            #从后往前找到能完整解析到结尾的元素起点
+            pos = len(tail)
+            while True:
+                pos = max(tail.rfind('{', 0, pos), tail.rfind('[', 0, pos))
+                if pos < 0:
+                    break
+                try:
+                    item, end = decoder.raw_decode(tail, pos)
+                    if end == len(tail):
+                        return item
+                except json.JSONDecodeError:
+                    pass
+            if read_size == file_size:
+                raise Exception("cannot read last item: %s" % tar_path)
+            read_size = min(read_size * 4, file_size)
+
+
+def append_json_array(tar_path, item_list):
+    """
+    把item_list追加到JSON数组文件的末尾，不读取已有的元素；文件不存在时新建。
+    """
+    if not os.path.exists(tar_path):
+        with open(tar_path, 'w', encoding='utf-8') as f:
+            json.dump(item_list, f, ensure_ascii=False)
+        return
+    with open(tar_path, 'r+b') as f:
+        #从末尾向前找到结尾的']'，以及它之前的最后一个非空白字符
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        char_list = []
+        while pos > 0 and len(char_list) < 2:
+            read_size = min(4096, pos)
+            pos -= read_size
+            f.seek(pos)
+            cur_data = f.read(read_size)
+            for i in range(len(cur_data) - 1, -1, -1):
+                if cur_data[i] not in b' \t\r\n':
+                    char_list.append((pos + i, cur_data[i]))
+                    if len(char_list) == 2:
+                        break
+        if len(char_list) < 2 or char_list[0][1] != ord(']'):
+            raise Exception("not a json array: %s" % tar_path)
+        cur_str = json.dumps(item_list, ensure_ascii=False)[1:]
+        if char_list[1][1] != ord('['):
+            cur_str = ', ' + cur_str
+        f.seek(char_list[0][0])
+        f.write(cur_str.encode('utf-8'))
+        f.truncate()
 
 '''
 __log_dict = {
@@ -23,10 +138,22 @@ class TotLog(object):
     offset = 0
     event_log = []
     event_flag = False
+    #并发添加的日志先写入各线程的缓冲区，读取或写文件前合并到上面的列表中
+    log_buffer = ThreadLogBuffer()
+    merge_lock = threading.Lock()
+    #可选的日志输出，例如BinaryLogSink，合并后的日志依次交给它写入
+    sink = None
+    #延迟恢复时已有日志所在的文件夹，以及各日志中已经追加到文件的记录数量
+    resume_folder = None
+    written_dict = {}
 
     @classmethod
-    def init_log(cls,agent_num, if_event=False):
+    def init_log(cls,agent_num, if_event=False, sink=None):
         
+        cls.log_buffer = ThreadLogBuffer()
+        cls.sink = sink
+        cls.resume_folder = None
+        cls.written_dict = {}
         cls.model_log = []
         cls.agent_log = [[] for i in range(agent_num)]
         cls.agent_num = agent_num
@@ -48,8 +175,28 @@ class TotLog(object):
         '''
     
     @classmethod
-    def set_log(cls, tar_file, tar_offset, extra_list=[]):
-        
+    def set_log(cls, tar_file, tar_offset, extra_list=[], lazy=False):
+        """
+        从tar_file中恢复日志，继续之前的仿真。
+
+        参数:
+        - tar_file: 之前的write_log写入的文件夹。
+        - tar_offset: 新日志的时间偏移量。为None时使用已有日志中最后一条记录的ts加1。
+        - extra_list: 需要恢复的额外日志名称。
+        - lazy: 为True时不读取已有的日志，只从文件末尾读取计算偏移量所需的最后一条记录。
+          此后write_log把新记录追加到已有文件的末尾，get_*_log只返回新记录，历史记录通过iter_log逐条读取。
+        """
+        cls.__merge_log__()
+        if lazy:
+            cls.resume_folder = tar_file
+            cls.written_dict = {}
+            for item in extra_list:
+                cls.extra_log.setdefault(item, [])
+            if tar_offset is None:
+                tar_offset = cls.get_last_ts(tar_file, extra_list) + 1
+            cls.offset = tar_offset
+            return
+
         cls.offset = tar_offset
         with open(os.path.join(tar_file, 'model.json'), 'r') as f:
             cls.model_log = json.load(f)
@@ -62,6 +209,12 @@ class TotLog(object):
         for item in extra_list:
             with open(os.path.join(tar_file, '{}.json'.format(item)), 'r') as f:
                 cls.extra_log[item] = json.load(f)
+        if tar_offset is None:
+            last_ts = -1
+            for cur_log in [cls.model_log] + cls.agent_log + list(cls.extra_log.values()):
+                if len(cur_log) > 0:
+                    last_ts = max(last_ts, cur_log[-1]['ts'])
+            cls.offset = last_ts + 1
 
         
         '''
@@ -81,19 +234,15 @@ class TotLog(object):
 
     @classmethod
     def add_model_log(cls, tar_ts, tar_type, tar_item):
+        #在并行调度中，日志在本轮结束后按顺序写入
+        if defer_effect(cls.add_model_log, tar_ts, tar_type, tar_item):
+            return
         
-        cls.model_log.append({
+        cls.log_buffer.append(('model', None, 'model'), {
             'ts': tar_ts + cls.offset,
             'type': tar_type,
             'item': tar_item
         })
-        if  cls.event_flag:
-            cls.event_log.append({
-                'ts': tar_ts + cls.offset,
-                'owner': 'model',
-                'type': tar_type,
-                'item': tar_item
-            })
 
         '''
         __log_dict['model'].append({
@@ -112,19 +261,14 @@ class TotLog(object):
 
     @classmethod
     def add_agent_log(cls, tar_ts, tar_type, tar_item, tar_agent_id):
+        if defer_effect(cls.add_agent_log, tar_ts, tar_type, tar_item, tar_agent_id):
+            return
         
-        cls.agent_log[tar_agent_id].append({
+        cls.log_buffer.append(('agent', tar_agent_id, 'agent_{}'.format(tar_agent_id)), {
             'ts': tar_ts + cls.offset,
             'type': tar_type,
             'item': tar_item
         })
-        if cls.event_flag:
-            cls.event_log.append({
-                'ts': tar_ts + cls.offset,
-                'owner': 'agent_{}'.format(tar_agent_id),
-                'type': tar_type,
-                'item': tar_item
-            })
 
         
         '''
@@ -144,19 +288,14 @@ class TotLog(object):
 
     @classmethod
     def add_extra_log(cls, tar_ts, tar_type, tar_item, tar_name):
+        if defer_effect(cls.add_extra_log, tar_ts, tar_type, tar_item, tar_name):
+            return
         
-        cls.extra_log[tar_name].append({
+        cls.log_buffer.append(('extra', tar_name, tar_name), {
             'ts': tar_ts + cls.offset,
             'type': tar_type,
             'item': tar_item
         })
-        if cls.event_flag:
-            cls.event_log.append({
-                'ts': tar_ts + cls.offset,
-                'owner': tar_name,
-                'type': tar_type,
-                'item': tar_item
-            })
 
         
         '''
@@ -175,18 +314,186 @@ class TotLog(object):
             })
         '''
 
+    @classmethod
+    def __merge_log__(cls):
+        #把各线程缓冲区中的日志按(ts, 添加顺序)合并到日志列表中
+        with cls.merge_lock:
+            sink_list = []
+            for (tar_kind, tar_key, tar_owner), tar_item in cls.log_buffer.drain():
+                if tar_kind == 'model':
+                    cls.model_log.append(tar_item)
+                elif tar_kind == 'agent':
+                    cls.agent_log[tar_key].append(tar_item)
+                else:
+                    cls.extra_log.setdefault(tar_key, []).append(tar_item)
+                if cls.event_flag or cls.sink is not None:
+                    cur_event = {
+                        'ts': tar_item['ts'],
+                        'owner': tar_owner,
+                        'type': tar_item['type'],
+                        'item': tar_item['item']
+                    }
+                    if cls.event_flag:
+                        cls.event_log.append(cur_event)
+                    if cls.sink is not None:
+                        sink_list.append(cur_event)
+            if len(sink_list) > 0:
+                cls.sink.write(sink_list)
+
+    @classmethod
+    def get_last_ts(cls, tar_file, extra_list=[]):
+        """
+        读取tar_file中已有日志最后一条记录的ts，只读取各文件的末尾。
+
+        返回:
+        - 最大的ts，没有记录时返回-1。
+        """
+        event_path = os.path.join(tar_file, 'event.json')
+        if cls.event_flag and os.path.exists(event_path):
+            #事件日志包含全部记录，只需要读取它的末尾
+            path_list = [event_path]
+        else:
+            name_list = ['model'] + ['agent_{}'.format(i) for i in range(cls.agent_num)] + list(extra_list)
+            path_list = [os.path.join(tar_file, '{}.json'.format(item)) for item in name_list]
+        last_ts = -1
+        for tar_path in path_list:
+            if not os.path.exists(tar_path):
+                continue
+            item = read_last_item(tar_path)
+            if item is not None:
+                last_ts = max(last_ts, item['ts'])
+        return last_ts
+
+    @classmethod
+    def __get_named_log__(cls, name):
+        #按文件名称（model、event、agent_{i}或额外日志名称）获取内存中的日志
+        if name == 'model':
+            return cls.model_log
+        if name == 'event':
+            return cls.event_log
+        if name.startswith('agent_') and name[6:].isdigit() and int(name[6:]) < cls.agent_num:
+            return cls.agent_log[int(name[6:])]
+        return cls.extra_log.get(name, [])
+
+    @classmethod
+    def iter_log(cls, name, tar_file=None):
+        """
+        逐条读取一个日志的全部记录，不把历史记录载入内存。
+
+        参数:
+        - name: 日志名称，'model'、'event'、'agent_{i}'或额外日志名称。
+        - tar_file: 日志文件夹，默认为延迟恢复时set_log的文件夹。
+
+        返回:
+        - 生成器，先返回文件中的记录，再返回内存中尚未写入文件的记录。
+        """
+        cls.__merge_log__()
+        cur_log = cls.__get_named_log__(name)
+        tar_file = tar_file or cls.resume_folder
+        if tar_file is None or cls.resume_folder is None:
+            #未使用延迟恢复时，全部记录都在内存中
+            yield from list(cur_log)
+            return
+        end = len(cur_log)
+        start = cls.written_dict.get(name, 0)
+        tar_path = os.path.join(tar_file, '{}.json'.format(name))
+        if os.path.exists(tar_path):
+            yield from iter_json_array(tar_path)
+        yield from cur_log[start:end]
+
+    @classmethod
+    def get_model_log(cls):
+        cls.__merge_log__()
+        return cls.model_log
+
     @classmethod
     def get_agent_log(cls, tar_agent_id):
+        cls.__merge_log__()
         return cls.agent_log[tar_agent_id]
 
     @classmethod
     def get_event_log(cls):
+        cls.__merge_log__()
         return cls.event_log
 
 
+    @classmethod
+    def flush(cls):
+        """
+        合并各线程中的日志，并把sink中的日志写入磁盘。
+        """
+        cls.__merge_log__()
+        if cls.sink is not None:
+            cls.sink.flush()
+
+    @classmethod
+    def close(cls):
+        """
+        写入剩余的日志并关闭sink，运行结束时调用。
+        """
+        cls.__merge_log__()
+        if cls.sink is not None:
+            cls.sink.close()
+            cls.sink = None
+
+    @classmethod
+    def query(cls, owner=None, type=None, ts_range=None):
+        """
+        按条件查询日志。sink支持查询（例如SqliteLogSink、BinaryLogSink）时在sink中查询，否则在内存中的日志中筛选。
+
+        参数:
+        - owner: 只返回该owner的记录，例如'agent_0'、'model'或额外日志的名称；也可以是owner列表。
+        - type: 只返回该类型的记录；也可以是类型列表。
+        - ts_range: (开始, 结束)，只返回ts在该闭区间内的记录，任一端为None表示不限制。
+
+        返回:
+        - 按ts排序的{'ts', 'owner', 'type', 'item'}字典列表。
+        """
+        cls.flush()
+        if cls.sink is not None and hasattr(cls.sink, 'query'):
+            return cls.sink.query(owner, type, ts_range)
+
+        owner_set = None if owner is None else set([owner] if isinstance(owner, str) else owner)
+        type_set = None if type is None else set([type] if isinstance(type, str) else type)
+        ts_start, ts_end = ts_range if ts_range is not None else (None, None)
+        source_list = [('model', cls.model_log)]
+        source_list += [('agent_{}'.format(i), cls.agent_log[i]) for i in range(cls.agent_num)]
+        source_list += list(cls.extra_log.items())
+        res = []
+        for cur_owner, cur_log in source_list:
+            if owner_set is not None and cur_owner not in owner_set:
+                continue
+            for item in cur_log:
+                if type_set is not None and item['type'] not in type_set:
+                    continue
+                if ts_start is not None and item['ts'] < ts_start:
+                    continue
+                if ts_end is not None and item['ts'] > ts_end:
+                    continue
+                res.append({
+                    'ts': item['ts'],
+                    'owner': cur_owner,
+                    'type': item['type'],
+                    'item': item['item']
+                })
+        res.sort(key=lambda item: item['ts'])
+        return res
+
     @classmethod
     def write_log(cls, tar_file):
         
+        cls.flush()
+        if cls.resume_folder is not None:
+            #延迟恢复时只把尚未写入的新记录追加到文件末尾
+            for name in ['model', 'event'] + ['agent_{}'.format(i) for i in range(cls.agent_num)] + list(cls.extra_log):
+                if name == 'event' and not cls.event_flag:
+                    continue
+                cur_log = cls.__get_named_log__(name)
+                start = cls.written_dict.get(name, 0)
+                if start < len(cur_log) or not os.path.exists(os.path.join(tar_file, '{}.json'.format(name))):
+                    append_json_array(os.path.join(tar_file, '{}.json'.format(name)), cur_log[start:])
+                cls.written_dict[name] = len(cur_log)
+            return
         with open(os.path.join(tar_file, 'model.json'), 'w') as f:
             json.dump(cls.model_log, f, ensure_ascii=False)
         for i in range(cls.agent_num):
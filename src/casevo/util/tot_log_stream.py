@@ -1,6 +1,129 @@
 import json
 import copy
 import os
+import threading
+from casevo.util.effect import defer_effect
+from casevo.util.log_buffer import ThreadLogBuffer
+
+
+class LogWriter(object):
+    """
+    后台日志写入线程。
+
+    日志记录先追加到添加线程自己的缓冲区中（不加锁），由独立的写入线程取出、序列化并追加到对应的文件中。
+    文件句柄在运行期间保持打开，积累的记录达到flush_size条或距上次写入超过flush_interval秒时批量写入。
+    未写入的记录超过queue_size条时，添加记录的线程等待写入线程处理。
+    """
+    def __init__(self, tar_folder, queue_size=10000, flush_size=1000, flush_interval=1.0):
+        """
+        初始化并启动写入线程。
+
+        参数:
+        - tar_folder: 日志文件所在的文件夹。
+        - queue_size: 未写入记录数量的上限，超过时添加方等待写入线程处理。
+        - flush_size: 积累多少条记录后写入文件。
+        - flush_interval: 最长写入间隔（秒）。
+        """
+        self.tar_folder = tar_folder
+        self.queue_size = queue_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.log_buffer = ThreadLogBuffer()
+        #文件名 -> 打开的文件句柄
+        self.file_dict = {}
+        #写入线程与flush/close互斥
+        self.write_lock = threading.Lock()
+        #未写入的记录过多时等待
+        self.cond = threading.Condition()
+        self.wake = threading.Event()
+        #写入时出现的异常，在flush/close时抛出
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self.__run__, name="tot_log_writer", daemon=True)
+        self.thread.start()
+
+    def put(self, file_name, tar_item):
+        """
+        添加一条记录。
+
+        参数:
+        - file_name: 目标文件名，例如'agent_0.txt'。
+        - tar_item: 日志记录，需要包含'ts'，写入时序列化为一行JSON。
+        """
+        if self.closed:
+            raise Exception("log writer closed")
+        seq = self.log_buffer.append(file_name, tar_item)
+        if seq % self.flush_size == 0:
+            self.wake.set()
+        if seq - self.log_buffer.drain_num > self.queue_size:
+            self.wake.set()
+            with self.cond:
+                while not self.closed and seq - self.log_buffer.drain_num > self.queue_size:
+                    self.cond.wait(0.1)
+
+    def __run__(self):
+        while not self.closed:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.__write__()
+
+    def __write__(self, sync=False):
+        #把积累的记录追加到文件，sync为True时同步到磁盘
+        with self.write_lock:
+            tar_list = self.log_buffer.drain()
+            if len(tar_list) > 0 or sync:
+                try:
+                    line_dict = {}
+                    for file_name, tar_item in tar_list:
+                        line_dict.setdefault(file_name, []).append(json.dumps(tar_item, ensure_ascii=False) + '\n')
+                    for file_name, line_list in line_dict.items():
+                        cur_file = self.file_dict.get(file_name)
+                        if cur_file is None:
+                            cur_file = open(os.path.join(self.tar_folder, file_name), 'a')
+                            self.file_dict[file_name] = cur_file
+                        cur_file.write(''.join(line_list))
+                    for cur_file in self.file_dict.values():
+                        cur_file.flush()
+                        if sync:
+                            os.fsync(cur_file.fileno())
+                except Exception as e:
+                    self.error = e
+        with self.cond:
+            self.cond.notify_all()
+
+    def __check_error__(self):
+        if self.error is not None:
+            cur_error = self.error
+            self.error = None
+            raise cur_error
+
+    def flush(self):
+        """
+        把已添加的记录全部写入文件并同步到磁盘。
+
+        抛出:
+        - 写入时出现的异常。
+        """
+        self.__write__(sync=True)
+        self.__check_error__()
+
+    def close(self, timeout=None):
+        """
+        写入剩余的记录，关闭文件并结束写入线程。
+        """
+        if not self.closed:
+            self.closed = True
+            self.wake.set()
+            self.thread.join(timeout)
+            self.__write__(sync=True)
+            with self.write_lock:
+                for cur_file in self.file_dict.values():
+                    try:
+                        cur_file.close()
+                    except Exception as e:
+                        self.error = e
+                self.file_dict = {}
+        self.__check_error__()
 
 
 """
@@ -35,11 +158,18 @@ class TotLogStream(object):
     # 缓冲区大小列表，用于管理日志流的缓冲
     buffer_size = 20
 
-    current_num = 0
+    # 各线程添加的日志先写入自己的缓冲区，写文件时按(ts, 添加顺序)合并
+    log_buffer = ThreadLogBuffer()
+
+    # 合并与写文件时使用的锁，添加日志时不需要加锁
+    write_lock = threading.Lock()
+
+    # 后台写入线程，异步模式下使用
+    writer = None
         
         
     @classmethod
-    def init_log(cls, agent_num, tar_folder, if_event=False, buffer_size=20):
+    def init_log(cls, agent_num, tar_folder, if_event=False, buffer_size=20, async_write=False, queue_size=10000, flush_interval=1.0):
         """
         初始化日志类方法。
         
@@ -50,6 +180,10 @@ class TotLogStream(object):
         - tar_folder (str): 目标文件夹的路径，用于存储日志文件。
         - if_event (bool): 是否启用事件日志的标志，默认为False。
         - buffer_size (int): 日志缓冲区的大小，用于控制写入日志文件的时机。
+        - async_write (bool): 是否使用后台线程写入。开启后日志记录放入有界队列，由写入线程批量写入，
+          添加日志时不再执行文件写入；运行结束时需要调用close()。
+        - queue_size (int): 异步模式下队列长度上限。
+        - flush_interval (float): 异步模式下的最长写入间隔（秒）。
         
         返回:
         无返回值，但初始化了多个类变量用于记录各种日志。
@@ -79,6 +213,15 @@ class TotLogStream(object):
         cls.tar_folder = tar_folder
         
         cls.buffer_size = buffer_size
+
+        cls.log_buffer = ThreadLogBuffer()
+
+        # 关闭之前的写入线程，异步模式下启动新的写入线程。
+        if cls.writer is not None:
+            cls.writer.close()
+            cls.writer = None
+        if async_write:
+            cls.writer = LogWriter(tar_folder, queue_size, buffer_size, flush_interval)
             
 
     @classmethod
@@ -101,25 +244,33 @@ class TotLogStream(object):
         - tar_type: 日志类型。
         - tar_item: 日志项内容。
         """
-        # 将日志条目添加到model_log列表中，包括时间戳、类型和内容。
-        cls.model_log.append({
-            'ts': tar_ts + cls.offset,
-            'type': tar_type,
-            'item': tar_item
-        })
-        # 如果事件标志为真，也将日志条目添加到event_log列表中。
-        if cls.event_flag:
-            cls.event_log.append({
+        # 并行调度时延迟到本轮结束后写入
+        if defer_effect(cls.add_model_log, tar_ts, tar_type, tar_item):
+            return
+        # 异步模式下直接交给写入线程
+        if cls.writer is not None:
+            cls.writer.put('model.txt', {
                 'ts': tar_ts + cls.offset,
-                'owner': 'model',
                 'type': tar_type,
                 'item': tar_item
             })
+            if cls.event_flag:
+                cls.writer.put('event.txt', {
+                    'ts': tar_ts + cls.offset,
+                    'owner': 'model',
+                    'type': tar_type,
+                    'item': tar_item
+                })
+            return
+        # 将日志条目添加到当前线程的缓冲区中，写文件时合并到model_log（以及event_log）。
+        cur_num = cls.log_buffer.append(('model', None, 'model'), {
+            'ts': tar_ts + cls.offset,
+            'type': tar_type,
+            'item': tar_item
+        })
         
-        # 增加当前日志条目计数。
-        cls.current_num += 1
-        # 如果当前日志条目数达到缓冲区大小，触发写入日志操作。
-        if cls.current_num >= cls.buffer_size:
+        # 每添加缓冲区大小条日志，触发一次写入日志操作。
+        if cur_num % cls.buffer_size == 0:
             cls.write_log()
 
     @classmethod
@@ -137,22 +288,46 @@ class TotLogStream(object):
         如果事件标志已设置，也会在事件日志中添加相应的条目。
         最后，检查当前日志条目数是否达到缓冲区大小，如果是，则写入日志。
         """
-        cls.agent_log[tar_agent_id].append({
-            'ts': tar_ts + cls.offset,
-            'type': tar_type,
-            'item': tar_item
-        })
-        if cls.event_flag:
-            cls.event_log.append({
+        if defer_effect(cls.add_agent_log, tar_ts, tar_type, tar_item, tar_agent_id):
+            return
+        if cls.writer is not None:
+            cls.writer.put('agent_{}.txt'.format(tar_agent_id), {
                 'ts': tar_ts + cls.offset,
-                'owner': 'agent_{}'.format(tar_agent_id),
                 'type': tar_type,
                 'item': tar_item
             })
-        cls.current_num += 1
-        if cls.current_num >= cls.buffer_size:
+            if cls.event_flag:
+                cls.writer.put('event.txt', {
+                    'ts': tar_ts + cls.offset,
+                    'owner': 'agent_{}'.format(tar_agent_id),
+                    'type': tar_type,
+                    'item': tar_item
+                })
+            return
+        cur_num = cls.log_buffer.append(('agent', tar_agent_id, 'agent_{}'.format(tar_agent_id)), {
+            'ts': tar_ts + cls.offset,
+            'type': tar_type,
+            'item': tar_item
+        })
+        if cur_num % cls.buffer_size == 0:
             cls.write_log()
 
+    @classmethod
+    def __merge_log__(cls):
+        # 把各线程缓冲区中的日志按(ts, 添加顺序)合并到日志列表中，调用方需持有write_lock
+        for (tar_kind, tar_key, tar_owner), tar_item in cls.log_buffer.drain():
+            if tar_kind == 'model':
+                cls.model_log.append(tar_item)
+            else:
+                cls.agent_log[tar_key].append(tar_item)
+            if cls.event_flag:
+                cls.event_log.append({
+                    'ts': tar_item['ts'],
+                    'owner': tar_owner,
+                    'type': tar_item['type'],
+                    'item': tar_item['item']
+                })
+
     @classmethod
     def get_agent_log(cls, tar_agent_id):
         """
@@ -164,6 +339,8 @@ class TotLogStream(object):
         返回:
         - 指定代理的日志列表。
         """
+        with cls.write_lock:
+            cls.__merge_log__()
         return cls.agent_log[tar_agent_id]
 
     @classmethod
@@ -174,6 +351,8 @@ class TotLogStream(object):
         返回:
         - 事件日志列表。
         """
+        with cls.write_lock:
+            cls.__merge_log__()
         return cls.event_log
 
     @classmethod
@@ -185,30 +364,33 @@ class TotLogStream(object):
         然后，对于每个代理的日志，如果非空，则写入相应的'agent_{id}.txt'文件。
         如果事件标志已设置且事件日志非空，则将其写入'event.txt'文件。
         最后，对于任何额外日志，如果非空，则写入相应的文件。
-        完成日志写入后，重置当前数量、模型日志、代理日志和事件日志。
+        完成日志写入后，重置模型日志、代理日志和事件日志。
+        写入前先合并各线程缓冲区中的日志，同一时刻只有一个线程写文件。
+        异步模式下等待写入线程写完已添加的记录。
         """
+        if cls.writer is not None:
+            cls.writer.flush()
+            return
+
+        with cls.write_lock:
+            cls.__write_log__()
+
+    @classmethod
+    def __write_log__(cls):
+        cls.__merge_log__()
         if len(cls.model_log) > 0:
-            res_str = ""
-            for item in cls.model_log:
-                res_str += json.dumps(item, ensure_ascii=False) + '\n'
             with open(os.path.join(cls.tar_folder, 'model.txt'), 'a') as f:
-                f.write(res_str)
+                f.write(''.join([json.dumps(item, ensure_ascii=False) + '\n' for item in cls.model_log]))
         
         for i in range(cls.agent_num):
             if len(cls.agent_log[i]) == 0:
                 continue
-            res_str = ""
-            for item in cls.agent_log[i]:
-                res_str += json.dumps(item, ensure_ascii=False) + '\n'
             with open(os.path.join(cls.tar_folder, 'agent_{}.txt'.format(i)), 'a') as f:
-                f.write(res_str)
+                f.write(''.join([json.dumps(item, ensure_ascii=False) + '\n' for item in cls.agent_log[i]]))
         
         if cls.event_flag and len(cls.event_log) > 0:
-            res_str = ""
-            for item in cls.event_log:
-                res_str += json.dumps(item, ensure_ascii=False) + '\n'
             with open(os.path.join(cls.tar_folder, 'event.txt'), 'a') as f:
-                f.write(res_str)
+                f.write(''.join([json.dumps(item, ensure_ascii=False) + '\n' for item in cls.event_log]))
         '''
         for item in cls.extra_log:
             if len(cls.extra_log[item]) == 0:
@@ -219,14 +401,23 @@ class TotLogStream(object):
             with open(os.path.join(cls.tar_folder, '{}.txt'.format(item)), 'a') as f:
                 f.write(res_str)
         '''
-        cls.current_num = 0
         cls.model_log = []
         cls.agent_log = [[] for i in range(cls.agent_num)]
         cls.event_log = []
-            
-
-
-                
 
+    @classmethod
+    def flush(cls):
+        """
+        把已添加的日志全部写入文件。
+        """
+        cls.write_log()
 
-            
\ No newline at end of file
+    @classmethod
+    def close(cls):
+        """
+        写入剩余的日志并结束写入线程，运行结束时调用。
+        """
+        cls.write_log()
+        if cls.writer is not None:
+            cls.writer.close()
+            cls.writer = None
@@ -0,0 +1,782 @@
+from abc import ABCMeta, abstractmethod
+
+import numpy as np
+
+
+class VectorStore(metaclass=ABCMeta):
+    """
+    记忆和背景信息的向量存储接口。
+
+    记录以整数ID标识，向量由调用方（MemeoryFactory/BackgroundFactory）生成后传入。
+    metadata过滤条件使用chromadb的where语法：字段等值、$eq/$ne/$gt/$gte/$lt/$lte/$in/$nin以及$and/$or组合。
+    query和get的返回格式与chromadb一致，ID以字符串形式返回。
+    """
+
+    @abstractmethod
+    def add(self, id_list, content_list, meta_list, embedding_list):
+        """
+        添加一批记录。
+
+        参数:
+        - id_list: 整数ID列表。
+        - content_list: 文本列表。
+        - meta_list: 元数据字典列表。
+        - embedding_list: 与文本对应的向量。
+        """
+        pass
+
+    @abstractmethod
+    def query(self, query_vec, n_results, where=None):
+        """
+        按平方L2距离检索最相近的n_results条记录。
+
+        参数:
+        - query_vec: 查询向量，形状为(查询数量, dim)。
+        - n_results: 每个查询返回的记录数量上限。
+        - where: metadata过滤条件。
+
+        返回:
+        - 包含ids、distances、documents、metadatas的字典，每项为每个查询一个列表。
+        """
+        pass
+
+    @abstractmethod
+    def get(self, where=None, id_list=None):
+        """
+        按条件或ID读取记录，结果按ID升序排列。
+
+        返回:
+        - 包含ids、documents、metadatas的字典，可以另外包含与之对应的embeddings（update的默认实现需要）。
+        """
+        pass
+
+    @abstractmethod
+    def count(self):
+        pass
+
+    @abstractmethod
+    def delete(self, id_list):
+        pass
+
+    def update(self, id_list, meta_list):
+        """
+        用meta_list更新已有记录的元数据，文本和向量保持不变。
+
+        默认实现读取记录后删除，再以合并后的元数据重新添加，不存在的ID被忽略。
+        子类可以重写为原地更新。
+
+        抛出:
+        - 如果get的结果中没有embeddings，抛出异常。
+        """
+        if len(id_list) == 0:
+            return
+        meta_dict = {int(item): cur_dict for item, cur_dict in zip(id_list, meta_list)}
+        res = self.get(id_list=list(meta_dict))
+        if len(res['ids']) == 0:
+            return
+        if res.get('embeddings') is None:
+            raise Exception("update needs get() to return embeddings, or override update()")
+        cur_ids = [int(item) for item in res['ids']]
+        self.delete(cur_ids)
+        self.add(cur_ids, res['documents'],
+                 [dict(cur_dict or {}, **meta_dict[item]) for item, cur_dict in zip(cur_ids, res['metadatas'])],
+                 res['embeddings'])
+
+    def get_since(self, last_id, where=None):
+        """
+        读取ID大于last_id且满足where条件的记录。
+        """
+        id_where = {"id": {"$gt": last_id}}
+        if where:
+            id_where = {"$and": [id_where, where]}
+        return self.get(where=id_where)
+
+    def max_id(self):
+        #存储中最大的记录ID，为空时返回-1
+        id_list = self.get()['ids']
+        if len(id_list) == 0:
+            return -1
+        return max(int(item) for item in id_list)
+
+    def query_many(self, request_list, n_results):
+        """
+        批量检索，request_list为(查询向量, where)组成的列表，返回与之对应的结果列表。
+        """
+        return [self.query(query_vec, n_results, where) for query_vec, where in request_list]
+
+
+class ChromaStore(VectorStore):
+    """
+    基于chromadb集合的存储。
+    """
+    def __init__(self, collection):
+        self.collection = collection
+
+    def add(self, id_list, content_list, meta_list, embedding_list):
+        if len(id_list) == 0:
+            return True
+        return self.collection.add(ids=[str(item) for item in id_list], documents=list(content_list),
+                                   metadatas=list(meta_list), embeddings=[list(map(float, item)) for item in embedding_list])
+
+    def query(self, query_vec, n_results, where=None):
+        query_vec = np.asarray(query_vec, dtype=np.float32)
+        if where:
+            return self.collection.query(query_embeddings=query_vec.tolist(), n_results=n_results, where=where)
+        return self.collection.query(query_embeddings=query_vec.tolist(), n_results=n_results)
+
+    def get(self, where=None, id_list=None):
+        if id_list is not None:
+            if len(id_list) == 0:
+                return {'ids': [], 'documents': [], 'metadatas': []}
+            res = self.collection.get(ids=[str(item) for item in id_list], where=where)
+        else:
+            res = self.collection.get(where=where)
+        #chromadb不保证返回顺序
+        order = sorted(range(len(res['ids'])), key=lambda i: int(res['ids'][i]))
+        return {
+            'ids': [res['ids'][i] for i in order],
+            'documents': [res['documents'][i] for i in order],
+            'metadatas': [res['metadatas'][i] for i in order]
+        }
+
+    def count(self):
+        return self.collection.count()
+
+    def delete(self, id_list):
+        if len(id_list) > 0:
+            self.collection.delete(ids=[str(item) for item in id_list])
+
+    def update(self, id_list, meta_list):
+        if len(id_list) > 0:
+            self.collection.update(ids=[str(item) for item in id_list], metadatas=list(meta_list))
+
+    def max_id(self):
+        if self.collection.count() == 0:
+            return -1
+        return max(int(item) for item in self.collection.get(include=[])['ids'])
+
+
+class MetaColumn(object):
+    """
+    NumpyStore中的一列元数据。
+
+    字符串列保存为int32编码和词表，整数和浮点数列保存为对应类型的数组，其他类型退化为object数组。
+    """
+    def __init__(self, capacity):
+        self.kind = None
+        self.data = None
+        self.present = np.zeros(capacity, dtype=bool)
+        self.vocab = {}
+        self.word_list = []
+
+    @staticmethod
+    def get_kind(value):
+        if isinstance(value, str):
+            return 'str'
+        if isinstance(value, (bool, np.bool_)):
+            return 'object'
+        if isinstance(value, (int, np.integer)):
+            return 'int'
+        if isinstance(value, (float, np.floating)):
+            return 'float'
+        return 'object'
+
+    def __init_data__(self, kind, capacity):
+        self.kind = kind
+        if kind == 'str':
+            self.data = np.full(capacity, -1, dtype=np.int32)
+        elif kind == 'int':
+            self.data = np.zeros(capacity, dtype=np.int64)
+        elif kind == 'float':
+            self.data = np.zeros(capacity, dtype=np.float64)
+        else:
+            self.data = np.empty(capacity, dtype=object)
+
+    def __to_object__(self, size):
+        #类型不一致时转换为object列
+        value_list = [self.get_value(i) for i in range(size)]
+        self.__init_data__('object', len(self.present))
+        for i in range(size):
+            self.data[i] = value_list[i]
+
+    def __promote__(self, kind, size):
+        if self.kind is None:
+            self.__init_data__(kind, len(self.present))
+        elif self.kind == kind or self.kind == 'object':
+            pass
+        elif self.kind == 'float' and kind == 'int':
+            pass
+        elif self.kind == 'int' and kind == 'float':
+            self.data = self.data.astype(np.float64)
+        else:
+            self.__to_object__(size)
+
+    def resize(self, capacity):
+        cur_present = np.zeros(capacity, dtype=bool)
+        cur_present[:len(self.present)] = self.present
+        self.present = cur_present
+        if self.data is not None:
+            if self.kind == 'str':
+                cur_data = np.full(capacity, -1, dtype=np.int32)
+            else:
+                cur_data = np.zeros(capacity, dtype=self.data.dtype) if self.kind != 'object' else np.empty(capacity, dtype=object)
+            cur_data[:len(self.data)] = self.data
+            self.data = cur_data
+
+    def set_values(self, start, value_list, size):
+        #从start开始写入一批值，size为写入前的记录数量
+        for value in value_list:
+            if value is not None:
+                self.__promote__(self.get_kind(value), size)
+        if self.data is None:
+            return
+        for i, value in enumerate(value_list):
+            if value is None:
+                continue
+            if self.kind == 'str':
+                code = self.vocab.get(value)
+                if code is None:
+                    code = len(self.word_list)
+                    self.vocab[value] = code
+                    self.word_list.append(value)
+                self.data[start + i] = code
+            else:
+                self.data[start + i] = value
+            self.present[start + i] = True
+
+    def get_value(self, pos):
+        if not self.present[pos]:
+            return None
+        if self.kind == 'str':
+            return self.word_list[self.data[pos]]
+        return self.data[pos].item() if self.kind != 'object' else self.data[pos]
+
+    def take(self, pos_list):
+        #按位置保留记录，用于压缩
+        self.present = self.present[pos_list]
+        if self.data is not None:
+            self.data = self.data[pos_list]
+
+    def match(self, op, value, size):
+        #返回前size条记录中满足条件的布尔数组
+        present = self.present[:size]
+        if self.data is None:
+            return np.full(size, op in ('$ne', '$nin'))
+        data = self.data[:size]
+        if op in ('$in', '$nin') and self.kind in ('int', 'float'):
+            res = present & np.isin(data, np.asarray(list(value)))
+            return ~res if op == '$nin' else res
+        if op in ('$in', '$nin'):
+            res = np.zeros(size, dtype=bool)
+            for item in value:
+                res |= self.match('$eq', item, size)
+            return ~res if op == '$nin' else res
+        if self.kind == 'str':
+            if op in ('$eq', '$ne'):
+                code = self.vocab.get(value, -2)
+                res = present & (data == code)
+                return ~res if op == '$ne' else res
+            #字符串的大小比较退化为逐项比较
+            data = np.array([self.word_list[item] if item >= 0 else None for item in data], dtype=object)
+        elif self.kind == 'object':
+            data = data.copy()
+        if op == '$eq':
+            res = data == value
+        elif op == '$ne':
+            return ~(present & (data == value))
+        elif op == '$gt':
+            res = np.array([item is not None and item > value for item in data]) if data.dtype == object else data > value
+        elif op == '$gte':
+            res = np.array([item is not None and item >= value for item in data]) if data.dtype == object else data >= value
+        elif op == '$lt':
+            res = np.array([item is not None and item < value for item in data]) if data.dtype == object else data < value
+        elif op == '$lte':
+            res = np.array([item is not None and item <= value for item in data]) if data.dtype == object else data <= value
+        else:
+            raise Exception("unsupported where operator: %s" % op)
+        return present & np.asarray(res, dtype=bool)
+
+
+class NumpyStore(VectorStore):
+    """
+    进程内的NumPy向量存储。
+
+    向量保存在连续的矩阵中，元数据按列保存（字符串列使用整数编码），
+    检索时先用列上的布尔运算得到过滤结果，再通过一次矩阵乘法计算平方L2距离并用argpartition取top-k。
+    适合单次运行、不需要持久化的仿真。
+
+    大规模仿真时可以压缩向量：float16或带逐向量缩放系数的int8标量量化，以及在样本上拟合的PCA降维。
+    检索直接在压缩后的矩阵上进行，可选地用原始float32向量对前若干个候选精确重排。
+    """
+    def __init__(self, capacity=1024, quantize=None, pca_dim=None, pca_sample=1024, rerank_num=0, exact_path=None):
+        """
+        初始化存储。
+
+        参数:
+        - capacity: 初始容量，写满后按两倍扩容。
+        - quantize: 向量的存储格式，None为float32，'float16'为半精度，'int8'为带逐向量缩放系数的标量量化。
+        - pca_dim: PCA降维后的维度，为None时不降维。记录数量达到pca_sample时在已有向量上拟合，此后的向量都先降维再保存。
+        - pca_sample: 拟合PCA使用的样本数量。
+        - rerank_num: 大于0时先在压缩向量上取出rerank_num个候选，再用原始float32向量精确计算距离并重排。
+                      此时需要保存原始向量。
+        - exact_path: 原始向量的保存文件。设置后原始向量追加写入该文件并通过内存映射读取，不占用内存；
+                      为None时保存在内存中。
+        """
+        if quantize not in (None, 'float16', 'int8'):
+            raise Exception("unknown quantize type: %s" % quantize)
+        self.capacity = capacity
+        self.size = 0
+        self.input_dim = None
+        self.dim = None
+        self.embeddings = None
+        self.quantize = quantize
+        #int8量化时每个向量的缩放系数
+        self.scales = np.zeros(capacity, dtype=np.float32)
+        #每条记录（压缩后）向量的平方范数
+        self.norms = np.zeros(capacity, dtype=np.float32)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.documents = []
+        self.columns = {}
+        #ID到行号的映射
+        self.id_pos = {}
+        self.alive_num = 0
+        #按块把压缩向量转换为float32参与计算，避免一次性转换整个矩阵
+        self.block_size = 65536
+
+        self.pca_dim = pca_dim
+        self.pca_sample = pca_sample
+        self.pca_mean = None
+        self.pca_components = None
+
+        #原始向量：每行对应的原始向量序号，以及内存中的数组或文件
+        self.rerank_num = rerank_num
+        self.exact_path = exact_path
+        self.keep_exact = rerank_num > 0 or exact_path is not None
+        self.exact_rows = np.zeros(capacity, dtype=np.int64)
+        self.exact = None
+        self.exact_num = 0
+        #原始向量文件的内存映射，写入新的向量后重新映射
+        self.exact_map = None
+
+    def __resize__(self, capacity):
+        cur_embeddings = np.zeros((capacity, self.dim), dtype=self.embeddings.dtype)
+        cur_embeddings[:self.size] = self.embeddings[:self.size]
+        self.embeddings = cur_embeddings
+        for name in ['scales', 'norms', 'ids', 'alive', 'exact_rows']:
+            cur_data = getattr(self, name)
+            new_data = np.zeros(capacity, dtype=cur_data.dtype)
+            new_data[:self.size] = cur_data[:self.size]
+            setattr(self, name, new_data)
+        for column in self.columns.values():
+            column.resize(capacity)
+        self.capacity = capacity
+
+    def __get_dtype__(self):
+        if self.quantize == 'float16':
+            return np.float16
+        if self.quantize == 'int8':
+            return np.int8
+        return np.float32
+
+    def __project__(self, tar_vec):
+        #把原始向量转换到存储空间（PCA降维）
+        if self.pca_components is None:
+            return tar_vec
+        return ((tar_vec - self.pca_mean) @ self.pca_components.T).astype(np.float32)
+
+    def __encode__(self, tar_vec):
+        #原始向量 -> (存储向量, 缩放系数, 压缩后向量的平方范数)
+        tar_vec = self.__project__(tar_vec)
+        if self.quantize == 'int8':
+            scales = np.abs(tar_vec).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            codes = np.clip(np.rint(tar_vec / scales[:, None]), -127, 127).astype(np.int8)
+            decoded = codes.astype(np.float32) * scales[:, None]
+            return codes, scales.astype(np.float32), (decoded ** 2).sum(axis=1)
+        codes = tar_vec.astype(self.__get_dtype__())
+        decoded = codes.astype(np.float32)
+        return codes, np.ones(len(tar_vec), dtype=np.float32), (decoded ** 2).sum(axis=1)
+
+    def __decode__(self, pos_list):
+        #存储空间中的float32向量
+        res = self.embeddings[pos_list].astype(np.float32)
+        if self.quantize == 'int8':
+            res *= self.scales[pos_list][:, None]
+        return res
+
+    def __add_exact__(self, tar_vec):
+        #追加原始向量，返回其起始序号
+        start = self.exact_num
+        if self.exact_path:
+            with open(self.exact_path, 'wb' if start == 0 else 'ab') as f:
+                f.write(np.ascontiguousarray(tar_vec, dtype=np.float32).tobytes())
+        else:
+            if self.exact is None or start + len(tar_vec) > len(self.exact):
+                cur_size = max(self.capacity, 2 * (start + len(tar_vec)))
+                cur_exact = np.zeros((cur_size, self.input_dim), dtype=np.float32)
+                if self.exact is not None:
+                    cur_exact[:start] = self.exact[:start]
+                self.exact = cur_exact
+            self.exact[start:start + len(tar_vec)] = tar_vec
+        self.exact_num += len(tar_vec)
+        return start
+
+    def __get_exact__(self, pos_list):
+        #读取行对应的原始向量
+        rows = self.exact_rows[pos_list]
+        if self.exact_path:
+            if self.exact_map is None or len(self.exact_map) != self.exact_num:
+                self.exact_map = np.memmap(self.exact_path, dtype=np.float32, mode='r', shape=(self.exact_num, self.input_dim))
+            return np.asarray(self.exact_map[rows])
+        return self.exact[rows]
+
+    def fit_pca(self):
+        """
+        在已有向量上拟合PCA，并把全部向量重新编码为降维后的表示。
+
+        样本优先使用保存的原始向量，否则使用存储中的向量；记录数量达到pca_sample时会自动调用。
+        """
+        if not self.pca_dim or self.pca_components is not None or self.size == 0:
+            return
+        pos_list = np.flatnonzero(self.alive[:self.size])
+        sample = pos_list[np.linspace(0, len(pos_list) - 1, min(self.pca_sample, len(pos_list))).astype(np.int64)]
+        source = self.__get_exact__(sample) if self.keep_exact else self.__decode__(sample)
+        self.pca_mean = source.mean(axis=0)
+        _, _, vt = np.linalg.svd(source - self.pca_mean, full_matrices=False)
+        self.pca_components = vt[:self.pca_dim].astype(np.float32)
+
+        #全部向量重新编码
+        all_pos = np.arange(self.size)
+        cur_dim = self.pca_components.shape[0]
+        new_embeddings = np.zeros((self.capacity, cur_dim), dtype=self.__get_dtype__())
+        for start in range(0, self.size, self.block_size):
+            cur_pos = all_pos[start:start + self.block_size]
+            source = self.__get_exact__(cur_pos) if self.keep_exact else self.__decode__(cur_pos)
+            codes, scales, norms = self.__encode__(source)
+            new_embeddings[cur_pos] = codes
+            self.scales[cur_pos] = scales
+            self.norms[cur_pos] = norms
+        self.embeddings = new_embeddings
+        self.dim = cur_dim
+
+    def add(self, id_list, content_list, meta_list, embedding_list):
+        num = len(id_list)
+        if num == 0:
+            return True
+        embedding_list = np.asarray(embedding_list, dtype=np.float32)
+        if self.input_dim is None:
+            self.input_dim = embedding_list.shape[1]
+            self.dim = self.input_dim
+            self.embeddings = np.zeros((self.capacity, self.dim), dtype=self.__get_dtype__())
+        elif embedding_list.shape[1] != self.input_dim:
+            raise Exception("embedding dim not match")
+        for item in id_list:
+            if int(item) in self.id_pos:
+                raise Exception("duplicate id: %s" % item)
+        if self.size + num > self.capacity:
+            cur_capacity = self.capacity
+            while cur_capacity < self.size + num:
+                cur_capacity *= 2
+            self.__resize__(cur_capacity)
+
+        start = self.size
+        end = start + num
+        codes, scales, norms = self.__encode__(embedding_list)
+        self.embeddings[start:end] = codes
+        self.scales[start:end] = scales
+        self.norms[start:end] = norms
+        if self.keep_exact:
+            exact_start = self.__add_exact__(embedding_list)
+            self.exact_rows[start:end] = np.arange(exact_start, exact_start + num)
+        self.ids[start:end] = [int(item) for item in id_list]
+        self.alive[start:end] = True
+        self.documents.extend(content_list)
+        for i, item in enumerate(id_list):
+            self.id_pos[int(item)] = start + i
+
+        key_list = []
+        for cur_dict in meta_list:
+            for key in cur_dict:
+                if key not in self.columns and key not in key_list:
+                    key_list.append(key)
+        for key in key_list:
+            self.columns[key] = MetaColumn(self.capacity)
+        for key, column in self.columns.items():
+            column.set_values(start, [cur_dict.get(key) for cur_dict in meta_list], start)
+
+        self.size = end
+        self.alive_num += num
+        if self.pca_dim and self.pca_components is None and self.size >= self.pca_sample:
+            self.fit_pca()
+        return True
+
+    def __match__(self, where):
+        #把where条件转换为前size条记录上的布尔数组
+        res = self.alive[:self.size].copy()
+        if not where:
+            return res
+        for key, value in where.items():
+            if key == '$and':
+                for item in value:
+                    res &= self.__match__(item)
+            elif key == '$or':
+                cur_res = np.zeros(self.size, dtype=bool)
+                for item in value:
+                    cur_res |= self.__match__(item)
+                res &= cur_res
+            else:
+                column = self.columns.get(key)
+                if isinstance(value, dict):
+                    op_list = list(value.items())
+                else:
+                    op_list = [('$eq', value)]
+                for op, cur_value in op_list:
+                    if column is None:
+                        if op not in ('$ne', '$nin'):
+                            res[:] = False
+                    else:
+                        res &= column.match(op, cur_value, self.size)
+        return res
+
+    def __get_meta__(self, pos):
+        cur_dict = {}
+        for key, column in self.columns.items():
+            value = column.get_value(pos)
+            if value is not None:
+                cur_dict[key] = value
+        return cur_dict
+
+    def __build_result__(self, pos_list):
+        return {
+            'ids': [str(self.ids[pos]) for pos in pos_list],
+            'documents': [self.documents[pos] for pos in pos_list],
+            'metadatas': [self.__get_meta__(pos) for pos in pos_list]
+        }
+
+    def __partial_dist__(self, proj_vec, cand=None):
+        #在压缩向量上计算|x|^2-2*q·x，按块转换为float32，cand为None时计算全部行
+        num = self.size if cand is None else len(cand)
+        res = np.empty((len(proj_vec), num), dtype=np.float32)
+        for start in range(0, num, self.block_size):
+            end = min(start + self.block_size, num)
+            pos = slice(start, end) if cand is None else cand[start:end]
+            cur_dot = proj_vec @ self.embeddings[pos].astype(np.float32, copy=False).T
+            if self.quantize == 'int8':
+                cur_dot *= self.scales[pos][None, :]
+            res[:, start:end] = self.norms[pos][None, :] - 2 * cur_dot
+        return res
+
+    def __topk__(self, query_vec, cand, n_results, dist=None):
+        #在cand选中的行中计算每个查询的top-k，返回(行号, 距离)列表
+        #dist为已经算好的全部行上的-2*q·x+|x|^2，为None时只对cand中的行计算
+        k = min(n_results, len(cand))
+        if k == 0:
+            return [([], []) for _ in range(len(query_vec))]
+        proj_vec = self.__project__(query_vec)
+        if dist is None:
+            dist = self.__partial_dist__(proj_vec, None if len(cand) == self.size else cand)
+        elif len(cand) < self.size:
+            dist = dist[:, cand]
+        query_norm = (proj_vec ** 2).sum(axis=1)
+        #需要重排时先在压缩向量上多取出一些候选
+        rerank = self.rerank_num > 0 and self.keep_exact
+        fetch = min(len(cand), max(k, self.rerank_num)) if rerank else k
+        res = []
+        for i in range(len(query_vec)):
+            if fetch < len(cand):
+                part = np.argpartition(dist[i], fetch - 1)[:fetch]
+            else:
+                part = np.arange(len(cand))
+            if rerank:
+                cur_dist = ((self.__get_exact__(cand[part]) - query_vec[i]) ** 2).sum(axis=1)
+                order = np.argsort(cur_dist, kind='stable')[:k]
+                res.append((cand[part[order]], cur_dist[order]))
+            else:
+                part = part[np.argsort(dist[i, part], kind='stable')]
+                res.append((cand[part], np.maximum(dist[i, part] + query_norm[i], 0)))
+        return res
+
+    def query(self, query_vec, n_results, where=None):
+        query_vec = np.atleast_2d(np.asarray(query_vec, dtype=np.float32))
+        res = {key: [] for key in ['ids', 'distances', 'documents', 'metadatas']}
+        if self.size == 0:
+            for _ in range(len(query_vec)):
+                for key in res:
+                    res[key].append([])
+            return res
+        for pos_list, dist_list in self.__topk__(query_vec, np.flatnonzero(self.__match__(where)), n_results):
+            cur_res = self.__build_result__(pos_list)
+            for key in cur_res:
+                res[key].append(cur_res[key])
+            res['distances'].append([float(item) for item in dist_list])
+        return res
+
+    def get(self, where=None, id_list=None):
+        if id_list is not None and not where:
+            #只按ID读取时直接定位行号，不扫描整个存储
+            pos_list = [self.id_pos[int(item)] for item in id_list if int(item) in self.id_pos]
+            pos_list.sort(key=lambda pos: self.ids[pos])
+            return self.__build_result__(pos_list)
+        mask = self.__match__(where)
+        if id_list is not None:
+            id_mask = np.zeros(self.size, dtype=bool)
+            pos_list = [self.id_pos[int(item)] for item in id_list if int(item) in self.id_pos]
+            id_mask[pos_list] = True
+            mask &= id_mask
+        pos_list = np.flatnonzero(mask)
+        pos_list = pos_list[np.argsort(self.ids[pos_list], kind='stable')]
+        return self.__build_result__(pos_list)
+
+    def count(self):
+        return self.alive_num
+
+    def max_id(self):
+        if self.alive_num == 0:
+            return -1
+        return int(self.ids[:self.size][self.alive[:self.size]].max())
+
+    def delete(self, id_list):
+        for item in id_list:
+            pos = self.id_pos.pop(int(item), None)
+            if pos is not None:
+                self.alive[pos] = False
+                self.alive_num -= 1
+        #已删除的记录超过一半时压缩存储
+        if self.size > 0 and self.alive_num * 2 < self.size:
+            self.compact()
+
+    def update(self, id_list, meta_list):
+        for item, cur_dict in zip(id_list, meta_list):
+            pos = self.id_pos.get(int(item))
+            if pos is None:
+                continue
+            for key in cur_dict:
+                if key not in self.columns:
+                    self.columns[key] = MetaColumn(self.capacity)
+            for key, column in self.columns.items():
+                column.present[pos] = False
+                column.set_values(pos, [cur_dict.get(key)], self.size)
+
+    def compact(self):
+        """
+        移除已删除的记录，释放其占用的行。
+        """
+        pos_list = np.flatnonzero(self.alive[:self.size])
+        num = len(pos_list)
+        if self.dim is not None:
+            self.embeddings[:num] = self.embeddings[pos_list]
+        self.scales[:num] = self.scales[pos_list]
+        self.norms[:num] = self.norms[pos_list]
+        self.ids[:num] = self.ids[pos_list]
+        self.exact_rows[:num] = self.exact_rows[pos_list]
+        self.alive[:num] = True
+        self.alive[num:] = False
+        if self.exact is not None:
+            #内存中的原始向量同样压缩，文件中的原始向量只追加不回收
+            self.exact[:num] = self.exact[self.exact_rows[:num]]
+            self.exact_rows[:num] = np.arange(num)
+            self.exact_num = num
+        self.documents = [self.documents[pos] for pos in pos_list]
+        for column in self.columns.values():
+            cur_capacity = len(column.present)
+            column.take(pos_list)
+            column.resize(cur_capacity)
+        self.id_pos = {int(self.ids[pos]): pos for pos in range(num)}
+        self.size = num
+
+    def query_many(self, request_list, n_results):
+        #候选行较多的请求拼接后与存储矩阵做一次矩阵乘法，候选行较少的请求只计算其候选行
+        if len(request_list) == 0:
+            return []
+        if self.size == 0:
+            return [self.query(query_vec, n_results, where) for query_vec, where in request_list]
+        vec_list = [np.atleast_2d(np.asarray(query_vec, dtype=np.float32)) for query_vec, _ in request_list]
+        cand_list = [np.flatnonzero(self.__match__(where)) for _, where in request_list]
+        dense_list = [i for i in range(len(request_list)) if len(cand_list[i]) * 4 >= self.size]
+        dist_dict = {}
+        if len(dense_list) > 0:
+            all_vec = self.__project__(np.concatenate([vec_list[i] for i in dense_list]))
+            all_dist = self.__partial_dist__(all_vec)
+            offset = 0
+            for i in dense_list:
+                dist_dict[i] = all_dist[offset:offset + len(vec_list[i])]
+                offset += len(vec_list[i])
+
+        res = []
+        for i in range(len(request_list)):
+            cur_res = {key: [] for key in ['ids', 'distances', 'documents', 'metadatas']}
+            for pos_list, dist_list in self.__topk__(vec_list[i], cand_list[i], n_results, dist_dict.get(i)):
+                item_res = self.__build_result__(pos_list)
+                for key in item_res:
+                    cur_res[key].append(item_res[key])
+                cur_res['distances'].append([float(item) for item in dist_list])
+            res.append(cur_res)
+        return res
+
+    def get_memory_stats(self):
+        """
+        统计向量占用的内存。
+
+        返回:
+        - 字典，包含记录数量rows、输入维度input_dim、存储维度dim、存储格式quantize、
+          向量实际占用的字节数vector_bytes、同样的记录以float32保存时的字节数float32_bytes、
+          二者的比值ratio，以及内存中原始向量占用的字节数exact_bytes。
+        """
+        num = self.size
+        if self.dim is None:
+            vector_bytes = 0
+            float32_bytes = 0
+        else:
+            vector_bytes = self.embeddings[:num].nbytes + self.norms[:num].nbytes
+            if self.quantize == 'int8':
+                vector_bytes += self.scales[:num].nbytes
+            float32_bytes = num * self.input_dim * 4 + self.norms[:num].nbytes
+        exact_bytes = 0 if self.exact is None else self.exact[:self.exact_num].nbytes
+        return {
+            'rows': num,
+            'input_dim': self.input_dim,
+            'dim': self.dim,
+            'quantize': self.quantize or 'float32',
+            'vector_bytes': vector_bytes,
+            'float32_bytes': float32_bytes,
+            'ratio': float32_bytes / vector_bytes if vector_bytes > 0 else 1.0,
+            'exact_bytes': exact_bytes
+        }
+
+    def evaluate_recall(self, query_vec, k=10, exact_store=None, where=None):
+        """
+        以精确检索为基准计算recall@k。
+
+        参数:
+        - query_vec: 查询向量，可以是多个。
+        - k: 比较前k个结果。
+        - exact_store: 保存相同数据的未压缩存储，用于精确检索；为None时使用本存储保存的原始向量。
+        - where: 元数据过滤条件。
+
+        返回:
+        - 全部查询的平均recall@k。
+
+        抛出:
+        - Exception: 没有exact_store且没有保存原始向量。
+        """
+        query_vec = np.atleast_2d(np.asarray(query_vec, dtype=np.float32))
+        res = self.query(query_vec, k, where)['ids']
+        if exact_store is not None:
+            exact_res = exact_store.query(query_vec, k, where)['ids']
+        elif self.keep_exact:
+            cand = np.flatnonzero(self.__match__(where))
+            exact_res = []
+            for i in range(len(query_vec)):
+                cur_dist = ((self.__get_exact__(cand) - query_vec[i]) ** 2).sum(axis=1)
+                order = np.argsort(cur_dist, kind='stable')[:k]
+                exact_res.append([str(self.ids[pos]) for pos in cand[order]])
+        else:
+            raise Exception("exact vectors not available")
+        recall_list = []
+        for cur_ids, exact_ids in zip(res, exact_res):
+            if len(exact_ids) > 0:
+                recall_list.append(len(set(cur_ids) & set(exact_ids)) / len(exact_ids))
+        if len(recall_list) == 0:
+            return 1.0
+        return float(np.mean(recall_list))
@@ -0,0 +1,54 @@
+import hashlib
+import types
+
+import numpy as np
+import pytest
+from chromadb import EmbeddingFunction
+
+from casevo import LLM_INTERFACE
+
+
+class FakeEmbedding(EmbeddingFunction):
+    def __init__(self, tar_llm):
+        self.llm = tar_llm
+
+    def __call__(self, input):
+        return self.llm.send_embedding(list(input))
+
+    def name(self):
+        return "fake"
+
+
+class FakeLLM(LLM_INTERFACE):
+    """
+    不访问网络的LLM接口：回复为提示词本身，embedding由文本哈希生成。
+    """
+    def __init__(self, dim=8):
+        self.dim = dim
+        self.message_num = 0
+        self.embedding_num = 0
+
+    def send_message(self, prompt, json_flag=False):
+        self.message_num += 1
+        return "resp:" + prompt
+
+    def send_embedding(self, text_list):
+        self.embedding_num += 1
+        res = []
+        for text in text_list:
+            cur_hash = hashlib.sha256(text.encode()).digest()
+            res.append([float(item) / 255.0 for item in cur_hash[:self.dim]])
+        return res
+
+    def get_lang_embedding(self):
+        return FakeEmbedding(self)
+
+
+@pytest.fixture
+def fake_llm():
+    return FakeLLM()
+
+
+@pytest.fixture
+def fake_model():
+    return types.SimpleNamespace(context=None, schedule=types.SimpleNamespace(time=0, steps=0))
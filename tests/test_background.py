@@ -0,0 +1,25 @@
+import types
+
+from casevo.background import BackgroundFactory
+from casevo.util.vector_store import NumpyStore
+
+
+class CountStore(NumpyStore):
+    def __init__(self):
+        super().__init__()
+        self.max_id_num = 0
+
+    def max_id(self):
+        self.max_id_num += 1
+        return super().max_id()
+
+
+def test_background_ids_come_from_counter(fake_llm, fake_model):
+    factory = BackgroundFactory(fake_llm, 2, fake_model, store=lambda name: CountStore())
+    cur_agent = types.SimpleNamespace(component_id='agent_0', context=None, model=fake_model)
+    cur_background = factory.create_background(cur_agent)
+    for i in range(3):
+        cur_background.add_backgrounds(['fact %d' % i, 'note %d' % i])
+
+    assert factory.background_store.max_id_num == 1
+    assert factory.background_store.get()['ids'] == [str(i) for i in range(6)]
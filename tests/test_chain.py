@@ -0,0 +1,85 @@
+import asyncio
+import types
+
+import pytest
+
+from casevo import PromptFactory, ThoughtChain, BaseStep, ChainPool, ChainPoolError
+
+
+class FailStep(BaseStep):
+    def after_process(self, input, response, agent=None, model=None):
+        raise Exception("bad response")
+
+
+@pytest.fixture
+def prompt(tmp_path, fake_llm):
+    with open(tmp_path / 'talk.txt', 'w') as f:
+        f.write("persona: {{agent.description}} | {{extra}}")
+    return PromptFactory(str(tmp_path), fake_llm).get_template('talk.txt')
+
+
+@pytest.fixture
+def agent():
+    model = types.SimpleNamespace(context=None)
+    return types.SimpleNamespace(description='voter', context=None, component_id='agent_0', model=model)
+
+
+def test_run_step_and_arun_step_agree(prompt, agent):
+    sync_chain = ThoughtChain(agent, [BaseStep(0, prompt), BaseStep(1, prompt)])
+    sync_chain.set_input('hello')
+    sync_chain.run_step()
+
+    async_chain = ThoughtChain(agent, [BaseStep(0, prompt), BaseStep(1, prompt)])
+    async_chain.set_input('hello')
+    asyncio.run(async_chain.arun_step())
+
+    assert sync_chain.get_output() == async_chain.get_output()
+    assert sync_chain.get_history() == async_chain.get_history()
+    assert len(sync_chain.get_history()) == 2
+
+
+@pytest.mark.parametrize('async_flag', [False, True])
+def test_retry_failure_resets_status(prompt, agent, fake_llm, async_flag):
+    cur_chain = ThoughtChain(agent, [FailStep(0, prompt)])
+    cur_chain.set_input('hello')
+    with pytest.raises(Exception, match="Thought Chain Retry Failed"):
+        if async_flag:
+            asyncio.run(cur_chain.arun_step())
+        else:
+            cur_chain.run_step()
+    assert cur_chain.status == 'ready'
+    assert fake_llm.message_num == 3
+    with pytest.raises(Exception, match="running status error"):
+        ThoughtChain(agent, [BaseStep(0, prompt)]).run_step()
+
+
+class AwaitChain(ThoughtChain):
+    async def __run_steps__(self, async_flag):
+        self.status = 'running'
+        await asyncio.sleep(0)
+        self.status = 'finish'
+
+
+def test_run_step_rejects_await_on_sync_path(prompt, agent):
+    cur_chain = AwaitChain(agent, [BaseStep(0, prompt)])
+    cur_chain.set_input('hello')
+    with pytest.raises(RuntimeError, match="await on the sync path"):
+        cur_chain.run_step()
+    assert cur_chain.status == 'ready'
+
+
+def test_chain_pool_maps_results_to_chains(prompt, agent):
+    ok_chain = ThoughtChain(agent, [BaseStep(0, prompt)])
+    ok_chain.set_input('hello')
+    fail_chain = ThoughtChain(agent, [FailStep(0, prompt)])
+    fail_chain.set_input('hello')
+
+    with ChainPool(2) as cur_pool:
+        cur_pool.add_chains([ok_chain, fail_chain])
+        with pytest.raises(ChainPoolError) as cur_error:
+            cur_pool.start_pool()
+        assert cur_pool.wait() == []
+
+    assert [item[0] for item in cur_error.value.errors] == [fail_chain]
+    assert cur_error.value.results[0] == ok_chain.get_output()
+    assert isinstance(cur_error.value.results[1], Exception)
@@ -0,0 +1,15 @@
+import numpy as np
+
+from casevo import ConcurrencyLimiter, LimitedLLM
+
+
+def test_lang_embedding_goes_through_embedding_limiter(fake_llm):
+    embedding_limiter = ConcurrencyLimiter()
+    cur_llm = LimitedLLM(fake_llm, embedding_limiter=embedding_limiter)
+    embedding_function = cur_llm.get_lang_embedding()
+
+    res = embedding_function(["a", "b"])
+
+    assert np.allclose(np.array(res), fake_llm.send_embedding(["a", "b"]))
+    assert embedding_limiter.get_stats()['success'] == 1
+    assert cur_llm.limiter.get_stats()['success'] == 0
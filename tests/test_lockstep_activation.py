@@ -0,0 +1,22 @@
+import mesa
+
+from casevo.model_base import LockstepActivation
+
+
+class StageModel(mesa.Model):
+    def __init__(self, stage_num):
+        super().__init__()
+        self.time_list = []
+        self.schedule = LockstepActivation(self, ["model.record"] * stage_num)
+
+    def record(self):
+        self.time_list.append(self.schedule.time)
+
+
+def test_lockstep_time_has_no_drift():
+    cur_model = StageModel(5)
+    for i in range(1, 101):
+        cur_model.schedule.step()
+        assert cur_model.schedule.time == i
+        assert cur_model.schedule.steps == i
+    assert cur_model.time_list[5:10] == [1, 1.2, 1.4, 1.6, 1.8]
@@ -0,0 +1,37 @@
+import types
+
+from casevo import MemeoryFactory
+
+
+def create_agents(factory, model, num=2):
+    agent_list = []
+    for i in range(num):
+        cur_agent = types.SimpleNamespace(description='', context=None, component_id='agent_%d' % i, model=model)
+        cur_agent.memory = factory.create_memory(cur_agent)
+        agent_list.append(cur_agent)
+    return agent_list
+
+
+def test_cap_evicts_oldest_without_importance(fake_llm, fake_model):
+    factory = MemeoryFactory(fake_llm, 3, None, fake_model, store='numpy', max_memory=3)
+    agent_list = create_agents(factory, fake_model)
+    for ts in range(6):
+        agent_list[0].memory.add_short_memory('agent_0', '', 'think', 'event %d' % ts, ts=ts)
+    assert factory.evict_memory() == 3
+    assert factory.memory_index['agent_0'] == [3, 4, 5]
+
+
+def test_cap_evicts_lowest_importance_first(fake_llm, fake_model):
+    factory = MemeoryFactory(fake_llm, 3, None, fake_model, store='numpy', max_memory=3)
+    agent_list = create_agents(factory, fake_model)
+    importance_list = [9, 1, 5, None, 1, 2]
+    for ts, importance in enumerate(importance_list):
+        agent_list[0].memory.add_short_memory('agent_0', '', 'think', 'event %d' % ts, ts=ts, importance=importance)
+    factory.add_broadcast('debate', ['agent_0', 'agent_1'], 6, 'debate', 'candidate', importance=8)
+
+    #7条中删除4条：重要性为None(0)的3，重要性为1的1和4，以及重要性为2的5
+    assert factory.evict_memory() == 4
+    assert factory.memory_index['agent_0'] == [0, 2, 6]
+    assert factory.memory_index['agent_1'] == [6]
+    assert sorted(factory.importance_index['agent_0']) == [0, 2, 6]
+    assert factory.memory_store.count() == 3
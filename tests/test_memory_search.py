@@ -0,0 +1,31 @@
+import types
+
+from casevo import MemeoryFactory
+
+
+def test_pending_memory_is_embedded_once(fake_llm, fake_model):
+    text_list = []
+    send_embedding = fake_llm.send_embedding
+
+    def count_embedding(cur_list):
+        text_list.extend(cur_list)
+        return send_embedding(cur_list)
+
+    fake_llm.send_embedding = count_embedding
+    factory = MemeoryFactory(fake_llm, 3, None, fake_model, store='numpy', write_behind=True)
+    agent_list = []
+    for i in range(3):
+        cur_agent = types.SimpleNamespace(description='', context=None, component_id='agent_%d' % i, model=fake_model)
+        cur_agent.memory = factory.create_memory(cur_agent)
+        agent_list.append(cur_agent)
+    for i, cur_agent in enumerate(agent_list):
+        cur_agent.memory.add_short_memory('agent_%d' % i, 'agent_%d' % ((i + 1) % 3), 'talk', 'event %d' % i)
+
+    for _ in range(2):
+        res = factory.search_many([(cur_agent.component_id, ['query']) for cur_agent in agent_list])
+        assert [len(res[cur_agent.component_id]['ids'][0]) for cur_agent in agent_list] == [2, 2, 2]
+    factory.flush_memory()
+
+    assert sorted(item for item in text_list if item != 'query') == ['event 0', 'event 1', 'event 2']
+    assert factory.pending_vec == {}
+    assert factory.memory_store.count() == 3
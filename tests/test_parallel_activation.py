@@ -0,0 +1,40 @@
+import asyncio
+import types
+
+import mesa
+
+from casevo import AgentBase
+from casevo.model_base import ParallelActivation
+
+
+class StepAgent(AgentBase):
+    def step(self):
+        self.model.step_list.append(self.unique_id)
+
+
+class StepModel(mesa.Model):
+    def __init__(self, agent_num):
+        super().__init__()
+        self.memory_factory = types.SimpleNamespace(create_memory=lambda agent: None)
+        self.step_list = []
+        self.schedule = ParallelActivation(self, use_async=True)
+        for i in range(agent_num):
+            self.schedule.add(StepAgent(i, self, "", None))
+
+
+def test_async_schedule_runs_sync_step():
+    cur_model = StepModel(4)
+    cur_model.schedule.step()
+
+    assert sorted(cur_model.step_list) == [0, 1, 2, 3]
+    assert cur_model.schedule.steps == 1
+
+
+def test_async_schedule_inside_running_loop():
+    cur_model = StepModel(4)
+
+    async def run_step():
+        cur_model.schedule.step()
+
+    asyncio.run(run_step())
+    assert sorted(cur_model.step_list) == [0, 1, 2, 3]
@@ -0,0 +1,25 @@
+import sqlite3
+
+import networkx as nx
+
+from casevo import ModelBase, RequestCache
+
+
+def get_row_num(tar_path):
+    with sqlite3.connect(tar_path) as cur_conn:
+        return cur_conn.execute("SELECT COUNT(*) FROM request_cache").fetchone()[0]
+
+
+def test_model_step_flushes_request_cache(tmp_path, fake_llm):
+    with open(tmp_path / 'reflect.txt', 'w') as f:
+        f.write("{{extra}}")
+    cache_path = str(tmp_path / 'cache.db')
+    cur_cache = RequestCache(cache_path, commit_size=32)
+    cur_model = ModelBase(nx.Graph(), fake_llm, prompt_path=str(tmp_path) + '/', request_cache=cur_cache, memory_store='numpy')
+
+    cur_cache.add_request_cache("prompt", "response")
+    assert get_row_num(cache_path) == 0
+
+    cur_model.step()
+    assert get_row_num(cache_path) == 1
+    cur_cache.close()
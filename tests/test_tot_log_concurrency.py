@@ -0,0 +1,67 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from casevo.util.tot_log import TotLog
+from casevo.util.tot_log_stream import TotLogStream
+
+
+THREAD_NUM = 64
+AGENT_NUM = 256
+STEP_NUM = 20
+
+
+def run_agents(add_agent_log, add_model_log):
+    #每个任务依次写入一个agent全部时间步的日志，64个线程同时执行
+    def work(agent_id):
+        for ts in range(STEP_NUM):
+            add_agent_log(ts, 'vote', {'agent': agent_id, 'ts': ts}, agent_id)
+            if agent_id == 0:
+                add_model_log(ts, 'step', {'ts': ts})
+
+    with ThreadPoolExecutor(max_workers=THREAD_NUM) as executor:
+        list(executor.map(work, range(AGENT_NUM)))
+
+
+def check_agent_log(agent_log_list):
+    for agent_id, cur_log in enumerate(agent_log_list):
+        assert [item['ts'] for item in cur_log] == list(range(STEP_NUM))
+        assert all(item['item']['agent'] == agent_id for item in cur_log)
+
+
+def check_event_log(event_log):
+    assert len(event_log) == AGENT_NUM * STEP_NUM + STEP_NUM
+    key_set = set((item['owner'], item['ts']) for item in event_log)
+    assert len(key_set) == len(event_log)
+
+
+def read_lines(tar_path):
+    with open(tar_path, 'r') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_tot_log_concurrent():
+    TotLog.init_log(AGENT_NUM, True)
+    run_agents(TotLog.add_agent_log, TotLog.add_model_log)
+
+    check_agent_log([TotLog.get_agent_log(i) for i in range(AGENT_NUM)])
+    assert [item['ts'] for item in TotLog.get_model_log()] == list(range(STEP_NUM))
+    event_log = TotLog.get_event_log()
+    check_event_log(event_log)
+    assert [item['ts'] for item in event_log] == sorted(item['ts'] for item in event_log)
+
+
+@pytest.mark.parametrize('async_write', [False, True])
+def test_tot_log_stream_concurrent(tmp_path, async_write):
+    TotLogStream.init_log(AGENT_NUM, str(tmp_path), True, buffer_size=97, async_write=async_write,
+                          queue_size=500, flush_interval=0.05)
+    try:
+        run_agents(TotLogStream.add_agent_log, TotLogStream.add_model_log)
+    finally:
+        TotLogStream.close()
+
+    check_agent_log([read_lines(os.path.join(tmp_path, 'agent_{}.txt'.format(i))) for i in range(AGENT_NUM)])
+    assert [item['ts'] for item in read_lines(os.path.join(tmp_path, 'model.txt'))] == list(range(STEP_NUM))
+    check_event_log(read_lines(os.path.join(tmp_path, 'event.txt')))
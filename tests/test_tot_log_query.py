@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from casevo.util.tot_log import TotLog
+from casevo.util.log_binary import BinaryLogSink, BinaryLogReader
+from casevo.util.log_sqlite import SqliteLogSink
+
+
+AGENT_NUM = 4
+
+
+def fill_log():
+    #LockstepActivation按阶段推进时ts为小数
+    for ts in [0, 0.5, 1, 1.5, 2]:
+        TotLog.add_model_log(ts, 'step', {'ts': ts})
+        for i in range(AGENT_NUM):
+            TotLog.add_agent_log(ts, 'vote' if i % 2 else 'talk', {'agent': i}, i)
+
+
+def get_sink(kind, tmp_path):
+    if kind == 'binary':
+        return BinaryLogSink(os.path.join(tmp_path, 'log.bin'), chunk_size=7)
+    if kind == 'sqlite':
+        return SqliteLogSink(os.path.join(tmp_path, 'log.db'), batch_size=7)
+    return None
+
+
+def run_query():
+    return [
+        TotLog.query(owner='agent_1'),
+        TotLog.query(type='vote', ts_range=(0.5, 1)),
+        TotLog.query(owner=['model', 'agent_2'], ts_range=(1.5, None)),
+    ]
+
+
+@pytest.mark.parametrize('kind', ['memory', 'binary', 'sqlite'])
+def test_query_backends_agree(tmp_path, kind):
+    TotLog.init_log(AGENT_NUM, False)
+    fill_log()
+    expected = run_query()
+
+    TotLog.init_log(AGENT_NUM, False, sink=get_sink(kind, tmp_path))
+    fill_log()
+    res = run_query()
+    TotLog.close()
+
+    key = lambda tar_list: sorted((item['ts'], item['owner'], item['type'], str(item['item'])) for item in tar_list)
+    for cur_res, cur_expected in zip(res, expected):
+        assert key(cur_res) == key(cur_expected)
+    assert [item['ts'] for item in res[0]] == [0, 0.5, 1, 1.5, 2]
+
+
+def test_binary_log_reopen(tmp_path):
+    tar_path = os.path.join(tmp_path, 'log.bin')
+    cur_sink = BinaryLogSink(tar_path, chunk_size=3)
+    cur_sink.write([{'ts': 0.25 * i, 'owner': 'model', 'type': 'step', 'item': i} for i in range(10)])
+    cur_sink.close()
+    cur_sink = BinaryLogSink(tar_path, chunk_size=3)
+    cur_sink.write([{'ts': 2.5, 'owner': 'agent_0', 'type': 'vote', 'item': 10}])
+    cur_sink.close()
+
+    with BinaryLogReader(tar_path) as cur_reader:
+        assert len(cur_reader) == 11
+        assert [item['item'] for item in cur_reader.iter_records(ts_range=(0.5, 1.0))] == [2, 3, 4]
+        assert list(cur_reader.iter_records(owner='agent_0'))[0]['ts'] == 2.5
@@ -0,0 +1,60 @@
+import pytest
+
+from casevo.util.vector_store import VectorStore
+
+
+class DictStore(VectorStore):
+    """
+    只实现必要方法的存储，update使用基类的默认实现。
+    """
+    def __init__(self, embedding_flag=True):
+        self.record_dict = {}
+        self.embedding_flag = embedding_flag
+
+    def add(self, id_list, content_list, meta_list, embedding_list):
+        for item in zip(id_list, content_list, meta_list, embedding_list):
+            self.record_dict[item[0]] = item[1:]
+
+    def query(self, query_vec, n_results, where=None):
+        raise NotImplementedError
+
+    def get(self, where=None, id_list=None):
+        id_list = sorted(self.record_dict if id_list is None else [item for item in id_list if item in self.record_dict])
+        res = {
+            'ids': [str(item) for item in id_list],
+            'documents': [self.record_dict[item][0] for item in id_list],
+            'metadatas': [self.record_dict[item][1] for item in id_list]
+        }
+        if self.embedding_flag:
+            res['embeddings'] = [self.record_dict[item][2] for item in id_list]
+        return res
+
+    def count(self):
+        return len(self.record_dict)
+
+    def delete(self, id_list):
+        for item in id_list:
+            self.record_dict.pop(item, None)
+
+
+def test_default_update_merges_metadata():
+    cur_store = DictStore()
+    cur_store.add([0, 1], ["a", "b"], [{'source': 'x', 'ts': 0}, {'source': 'y', 'ts': 1}], [[0.0], [1.0]])
+
+    cur_store.update([1, 5], [{'ts': 3}, {'ts': 4}])
+
+    assert cur_store.get() == {
+        'ids': ['0', '1'],
+        'documents': ['a', 'b'],
+        'metadatas': [{'source': 'x', 'ts': 0}, {'source': 'y', 'ts': 3}],
+        'embeddings': [[0.0], [1.0]]
+    }
+
+
+def test_default_update_needs_embeddings():
+    cur_store = DictStore(embedding_flag=False)
+    cur_store.add([0], ["a"], [{'ts': 0}], [[0.0]])
+
+    with pytest.raises(Exception, match="embeddings"):
+        cur_store.update([0], [{'ts': 1}])
+    assert cur_store.count() == 1